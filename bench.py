@@ -0,0 +1,378 @@
+"""
+Нагрузочные замеры бота: запись сообщений, чтение из БД, подготовка промпта
+и полный путь /summary через локальную заглушку OpenAI.
+
+Запуск:
+    python bench.py --sizes 10000,100000 --output bench.json
+    python bench.py --compare old.json new.json
+
+Результаты сохраняются в JSON, чтобы сравнивать их между коммитами.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# config.py требует токены при импорте; запросы к LLM уходят только в заглушку
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from aiohttp import web
+from cache import SummaryCache
+from db import Database
+from ingest import MessageIngestor
+from jobs import SummaryJobQueue
+from llm import LLMService
+from search import build_match_query
+from summarizer import ChunkSummarizer
+from summary import SummaryService
+
+WORDS = ("привет", "сегодня", "релиз", "баг", "созвон", "ссылка", "вопрос", "кажется", "готово",
+         "бэкенд", "фронтенд", "база", "деплой", "тесты", "завтра", "ревью", "задача", "идея",
+         "логи", "ошибка", "сервер", "клиент", "обсудим", "согласен", "посмотрю", "минуту")
+NOISE = ("+1", "ок", "))", "спасибо", "👍")
+
+class MessageGenerator:
+    """Синтетическая история: chats групп, users участников, days дней"""
+
+    def __init__(self, chats: int = 50, users: int = 500, days: int = 30, seed: int = 1):
+        self.chats = chats
+        self.users = users
+        self.days = days
+        self.random = random.Random(seed)
+        # У каждого участника несколько групп, активность групп неравномерна
+        self.members = {
+            chat: self.random.sample(range(1, users + 1), max(2, min(users, users * 3 // chats)))
+            for chat in range(1, chats + 1)
+        }
+        self.weights = [1.0 / rank for rank in range(1, chats + 1)]
+
+    def text(self) -> str:
+        if self.random.random() < 0.15:
+            return self.random.choice(NOISE)
+        return " ".join(self.random.choices(WORDS, k=self.random.randint(2, 40)))
+
+    def rows(self, count: int, end_ts: Optional[int] = None) -> Iterator[Tuple]:
+        """Строки для Database.save_messages_batch, равномерно по времени до end_ts"""
+        end_ts = end_ts or int(time.time())
+        start_ts = end_ts - self.days * 86400
+        step = (end_ts - start_ts) / max(count, 1)
+        chats = self.random.choices(range(1, self.chats + 1), weights=self.weights, k=count)
+        for i, chat in enumerate(chats):
+            user_id = self.random.choice(self.members[chat])
+            yield (-chat, f"Группа {chat}", user_id, f"user{user_id}", self.text(), int(start_ts + i * step))
+
+    def messages(self, count: int) -> List[Dict]:
+        """Сообщения в формате Database.get_recent_messages"""
+        return [{'id': i, 'chat_title': row[1], 'user_id': row[2], 'username': row[3],
+                 'message_text': row[4], 'ts': row[5], 'timestamp': ''}
+                for i, row in enumerate(self.rows(count), 1)]
+
+class FakeOpenAI:
+    """Локальный сервер /v1/chat/completions с настраиваемой задержкой ответа.
+
+    Потоковые запросы (stream) получают первый фрагмент через десятую часть
+    задержки, остальные - равномерно за оставшееся время.
+    """
+
+    CONTENT = "Краткий пересказ обсуждения"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self.url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _completions(self, request: web.Request) -> web.StreamResponse:
+        self.calls += 1
+        body = await request.json()
+        if body.get("stream"):
+            return await self._stream(request)
+        await asyncio.sleep(self.delay)
+        return web.json_response({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "bench",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": self.CONTENT}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+    async def _stream(self, request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = self.CONTENT.split(" ")
+        pieces = [word + " " for word in words[:-1]] + words[-1:]
+
+        async def send(payload: Dict):
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench"}
+            chunk.update(payload)
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+
+        await asyncio.sleep(self.delay * 0.1)
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(self.delay * 0.9 / (len(pieces) - 1))
+            await send({"choices": [{"index": 0, "finish_reason": None, "delta": {"content": piece}}]})
+        await send({"choices": [], "usage": {"prompt_tokens": 1, "completion_tokens": len(pieces),
+                                             "total_tokens": 1 + len(pieces)}})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/v1"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 и среднее в миллисекундах"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': round(pick(50), 3),
+        'p95_ms': round(pick(95), 3),
+        'p99_ms': round(pick(99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+async def _timed(samples: List[float], coro):
+    started = time.perf_counter()
+    result = await coro
+    samples.append(time.perf_counter() - started)
+    return result
+
+async def bench_writes(workdir: str, generator: MessageGenerator, count: int) -> Dict:
+    """Пропускная способность записи: по одному сообщению и через конвейер приёма"""
+    rows = list(generator.rows(count))
+    results = {}
+
+    db = Database(os.path.join(workdir, "writes.db"))
+    started = time.perf_counter()
+    for row in rows:
+        await db.save_message(*row[:5])
+    elapsed = time.perf_counter() - started
+    results['save_message_sequential'] = {'messages': count, 'per_second': round(count / elapsed, 1)}
+    db.close()
+
+    db = Database(os.path.join(workdir, "ingest.db"))
+    ingestor = MessageIngestor(db)
+    await ingestor.start()
+    started = time.perf_counter()
+    for row in rows:
+        await ingestor.submit(*row[:5])
+    await ingestor.stop()
+    elapsed = time.perf_counter() - started
+    results['ingest_pipeline'] = {'messages': count, 'per_second': round(count / elapsed, 1)}
+    db.close()
+    return results
+
+async def bench_reads(workdir: str, generator: MessageGenerator, sizes: List[int],
+                      queries: int) -> Dict:
+    """Задержки чтения при росте таблицы messages до каждого из sizes"""
+    db = Database(os.path.join(workdir, "reads.db"))
+    results = {}
+    stored = 0
+    rng = random.Random(2)
+    for size in sizes:
+        rows = list(generator.rows(size - stored))
+        for i in range(0, len(rows), 5000):
+            await db.save_messages_batch(rows[i:i + 5000])
+        stored = size
+
+        groups, recent, today, search = [], [], [], []
+        for _ in range(queries):
+            user_id = rng.randint(1, generator.users)
+            chat_id = -rng.randint(1, generator.chats)
+            user_groups = await _timed(groups, db.get_user_groups(user_id))
+            await _timed(recent, db.get_recent_messages(chat_id))
+            await _timed(today, db.get_today_messages(chat_id))
+            chat_ids = [group['chat_id'] for group in user_groups] or [chat_id]
+            await _timed(search, db.search_messages(chat_ids, build_match_query(rng.choice(WORDS)), 6))
+        results[str(size)] = {
+            'get_user_groups': percentiles(groups),
+            'get_recent_messages': percentiles(recent),
+            'get_today_messages': percentiles(today),
+            'search_messages': percentiles(search),
+        }
+    db.close()
+    return results
+
+def bench_prompt(generator: MessageGenerator, counts: List[int], repeats: int = 5) -> Dict:
+    """Стоимость format_messages_for_summary в зависимости от числа сообщений"""
+    llm = LLMService(api_key="bench", base_url="http://127.0.0.1:9/v1")
+    results = {}
+    for count in counts:
+        messages = generator.messages(count)
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            llm.format_messages_for_summary(messages)
+            samples.append(time.perf_counter() - started)
+        results[str(count)] = percentiles(samples)
+    return results
+
+class _RecordingBot:
+    """Бот без сети: запоминает время первого текста пересказа и последней правки сообщения"""
+
+    def __init__(self):
+        self.first_content: Dict[int, float] = {}
+        self.finished: Dict[int, float] = {}
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None):
+        if not text.startswith("🔄"):
+            self.first_content.setdefault(message_id, time.perf_counter())
+            self.finished[message_id] = time.perf_counter()
+
+async def bench_summary(workdir: str, generator: MessageGenerator, history: int,
+                        requests: int, llm_delay: float) -> Dict:
+    """Полный путь /summary Nh: очередь задач, БД, промпт и HTTP-запрос к заглушке"""
+    fake = FakeOpenAI(llm_delay)
+    url = await fake.start()
+    llm = LLMService(api_key="bench", base_url=url)
+    db = Database(os.path.join(workdir, "summary.db"))
+    try:
+        rows = list(generator.rows(history))
+        for i in range(0, len(rows), 5000):
+            await db.save_messages_batch(rows[i:i + 5000])
+
+        summarizer = ChunkSummarizer(db, lambda: llm, background=False)
+        service = SummaryService(db, SummaryCache(), llm_provider=lambda: llm, summarizer=summarizer)
+        queue = SummaryJobQueue(db, service, max_per_user=requests)
+        bot = _RecordingBot()
+        await queue.start(bot)
+
+        submitted = {}
+        for i in range(requests):
+            chat_id = -(i % generator.chats + 1)
+            submitted[i] = time.perf_counter()
+            await queue.submit(i, chat_id, "24h", None, 0, i)
+        while queue.depth or queue.running:
+            await asyncio.sleep(0.005)
+        await queue.stop()
+
+        latencies = [bot.finished[i] - submitted[i] for i in submitted if i in bot.finished]
+        first_content = [bot.first_content[i] - submitted[i] for i in submitted if i in bot.first_content]
+        return {
+            'requests': requests,
+            'llm_delay_ms': round(llm_delay * 1000, 1),
+            'llm_calls': fake.calls,
+            'cache_hits': service.cache.hits,
+            'latency': percentiles(latencies),
+            'first_content': percentiles(first_content),
+            'queue': queue.stats(),
+        }
+    finally:
+        db.close()
+        await llm.close()
+        await fake.stop()
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+async def run(args: argparse.Namespace) -> Dict:
+    generator = MessageGenerator(args.chats, args.users, args.days, args.seed)
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        results = {
+            'writes': await bench_writes(workdir, generator, args.writes),
+            'reads': await bench_reads(workdir, generator, sizes, args.queries),
+            'prompt': bench_prompt(generator, [200, 1000, 5000]),
+            'summary': await bench_summary(workdir, generator, args.history, args.requests, args.llm_delay),
+        }
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': int(time.time()),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'params': vars(args),
+        },
+        'results': results,
+    }
+
+def _flatten(data: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(old_path: str, new_path: str) -> List[str]:
+    """Построчное сравнение двух файлов результатов"""
+    with open(old_path, encoding='utf-8') as f:
+        old = _flatten(json.load(f)['results'])
+    with open(new_path, encoding='utf-8') as f:
+        new = _flatten(json.load(f)['results'])
+    lines = []
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name], new[name]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        lines.append(f"{name:70} {before:>12} -> {after:>12} ({change})")
+    return lines
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Замеры производительности бота")
+    parser.add_argument('--sizes', default="10000,100000", help="размеры таблицы messages через запятую")
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--writes', type=int, default=5000, help="сообщений в замере записи")
+    parser.add_argument('--queries', type=int, default=200, help="запросов каждого вида на размер")
+    parser.add_argument('--history', type=int, default=20000, help="сообщений в БД для замера /summary")
+    parser.add_argument('--requests', type=int, default=50, help="одновременных запросов /summary")
+    parser.add_argument('--llm-delay', type=float, default=0.2, help="задержка заглушки OpenAI, с")
+    parser.add_argument('--output', default=None, help="файл для результатов (по умолчанию stdout)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="сравнить два файла результатов")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.compare:
+        print("\n".join(compare(*args.compare)))
+        return
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    sys.exit(main())
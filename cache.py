@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from config import SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+class SummaryCache:
+    """LRU-кэш готовых пересказов с ограничением по времени жизни.
+
+    Ключ включает id последнего сообщения окна, поэтому запись остаётся
+    верной, пока в группу не пришли новые сообщения. Если передана база
+    данных, записи дублируются в таблицу summary_cache и переживают перезапуск.
+    Одинаковые запросы, пришедшие одновременно, выполняются один раз.
+    """
+
+    def __init__(self, max_entries: int = SUMMARY_CACHE_SIZE, ttl: float = SUMMARY_CACHE_TTL,
+                 db=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db = db
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(chat_id: int, window: str, max_message_id: int) -> str:
+        return f"{chat_id}:{window}:{max_message_id}"
+
+    async def get(self, key: str) -> Optional[str]:
+        """Получение записи из памяти или из постоянного хранилища"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+
+        if self.db is not None:
+            stored = await self.db.get_cached_summary(key, now)
+            if stored is not None:
+                value, expires_at = stored
+                self._remember(key, value, expires_at)
+                return value
+        return None
+
+    async def set(self, key: str, chat_id: int, value: str):
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self.db is not None:
+            await self.db.save_cached_summary(key, chat_id, value, expires_at)
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key: str, chat_id: int,
+                             compute: Callable[[], Awaitable[str]]) -> str:
+        """Значение из кэша либо результат compute() с объединением параллельных запросов.
+
+        Исключения из compute() получают все ожидающие, в кэш они не попадают.
+        """
+        value = await self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.hits += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            await self.set(key, chat_id, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано вызывающему, ожидающих может не быть
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
@@ -7,8 +7,156 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bot_database.db")
 
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "40"))
+
+# Конвейер приёма сообщений (пакетная запись в БД)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))
+# Повторы записи пакета при ошибке БД: число попыток и первая пауза (дальше вдвое больше)
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "5"))
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", "0.5"))
+
+# Часовой пояс для границ суток ("за сегодня") и отображения времени
+TIMEZONE = os.getenv("TIMEZONE", "UTC")
+
+# Пул соединений SQLite
+DB_READ_WORKERS = int(os.getenv("DB_READ_WORKERS", "4"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "65536"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# Новая БД создаётся с auto_vacuum=INCREMENTAL; существующую переводит полный VACUUM при
+# запуске - он блокирует запись, поэтому включается явно на время обслуживания
+DB_ENABLE_INCREMENTAL_VACUUM = os.getenv("DB_ENABLE_INCREMENTAL_VACUUM", "false").lower() == "true"
+# Пул соединений PostgreSQL (DATABASE_URL=postgresql://...)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+# Клиент LLM
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "10"))
+# Маршрутизация запросов: модели по предпочтению с размером контекста ("модель:токены,..."),
+# целевое время ответа, допустимая доля ошибок и минимальный лимит ответа
+LLM_ROUTES = os.getenv("LLM_ROUTES", f"{LLM_MODEL}:16385")
+LLM_SLO_SECONDS = float(os.getenv("LLM_SLO_SECONDS", "10"))
+LLM_ERROR_BUDGET = float(os.getenv("LLM_ERROR_BUDGET", "0.5"))
+LLM_MIN_OUTPUT_TOKENS = int(os.getenv("LLM_MIN_OUTPUT_TOKENS", "150"))
+# Пересказ не ждёт LLM дольше этого: иначе пользователь получает локальный пересказ
+SUMMARY_DEADLINE = float(os.getenv("SUMMARY_DEADLINE", "25"))
+# Потоковый ответ LLM: пересказ показывается по мере генерации
+LLM_STREAMING_ENABLED = os.getenv("LLM_STREAMING_ENABLED", "true").lower() == "true"
+# Не чаще одной правки сообщения за столько секунд (ограничения Telegram на редактирование)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Отправка в Telegram: общий лимит в секунду и лимиты на чат (личный и группу), повторы после RetryAfter
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Компиляция промпта: бюджет токенов на обсуждение и правила сжатия
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+PROMPT_MAX_MESSAGE_CHARS = int(os.getenv("PROMPT_MAX_MESSAGE_CHARS", "600"))
+PROMPT_COLLAPSE_SECONDS = int(os.getenv("PROMPT_COLLAPSE_SECONDS", "300"))
+
+# Локальный отбор информативных сообщений, если обсуждение не помещается в бюджет
+EXTRACTIVE_ENABLED = os.getenv("EXTRACTIVE_ENABLED", "true").lower() == "true"
+EXTRACT_REPLY_WINDOW = int(os.getenv("EXTRACT_REPLY_WINDOW", "120"))
+EXTRACT_DUPLICATE_JACCARD = float(os.getenv("EXTRACT_DUPLICATE_JACCARD", "0.7"))
+
+# Кэш готовых пересказов
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "512"))
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "3600"))
+SUMMARY_CACHE_PERSIST = os.getenv("SUMMARY_CACHE_PERSIST", "true").lower() == "true"
+
+# Иерархический пересказ: фрагменты по CHUNK_SIZE сообщений пересказываются заранее
+CHUNK_SUMMARIES_ENABLED = os.getenv("CHUNK_SUMMARIES_ENABLED", "true").lower() == "true"
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "100"))
+CHUNK_REDUCE_FANIN = int(os.getenv("CHUNK_REDUCE_FANIN", "20"))
+# Фоновый пересказ фрагментов доходит только до сообщений за последние CHUNK_BACKFILL_HOURS часов:
+# после первого запуска или долгого простоя старая история не отправляется в LLM
+CHUNK_BACKFILL_HOURS = int(os.getenv("CHUNK_BACKFILL_HOURS", "24"))
+
+# Разбиение окна на темы: каждая тема пересказывается отдельным параллельным запросом
+TOPIC_SEGMENTATION_ENABLED = os.getenv("TOPIC_SEGMENTATION_ENABLED", "true").lower() == "true"
+TOPIC_MIN_MESSAGES = int(os.getenv("TOPIC_MIN_MESSAGES", "40"))
+TOPIC_GAP_SECONDS = int(os.getenv("TOPIC_GAP_SECONDS", "1800"))
+TOPIC_JOIN_THRESHOLD = float(os.getenv("TOPIC_JOIN_THRESHOLD", "0.2"))
+TOPIC_MIN_SIZE = int(os.getenv("TOPIC_MIN_SIZE", "5"))
+TOPIC_MAX_TOPICS = int(os.getenv("TOPIC_MAX_TOPICS", "8"))
+
+# Буфер последних сообщений в памяти: лимиты на группу и число групп
+HOT_BUFFER_SIZE = int(os.getenv("HOT_BUFFER_SIZE", "1000"))
+HOT_BUFFER_MAX_BYTES = int(os.getenv("HOT_BUFFER_MAX_BYTES", str(1024 * 1024)))
+HOT_BUFFER_MAX_CHATS = int(os.getenv("HOT_BUFFER_MAX_CHATS", "2000"))
+
+# Контроль задержки цикла событий
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "200"))
+# /health отвечает 503, если задержка цикла выше порога
+HEALTH_MAX_LAG_MS = float(os.getenv("HEALTH_MAX_LAG_MS", "1000"))
+
+# Трассировка: обновления и задачи дольше TRACE_SLOW_MS пишутся в лог с деревом участков
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+# Токен для /admin/* на веб-сервере; без него эндпоинты отключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+
+# Фоновая очередь пересказов
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "1000"))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "3"))
+# Дайджест /summary all: сколько групп пересказывается одновременно
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "4"))
+# Пересказы "за сегодня" строятся заранее в DIGEST_TIMES (местное время) для групп с сообщениями
+# за день; старт каждой группы сдвигается на случайные до DIGEST_JITTER секунд. В DIGEST_PUSH_TIME
+# пересказ отправляется в подписанные группы (/digest on). /summary today досказывает только
+# сообщения после готового пересказа, если их не больше DIGEST_TAIL_LIMIT
+DIGEST_SCHEDULE_ENABLED = os.getenv("DIGEST_SCHEDULE_ENABLED", "true").lower() == "true"
+DIGEST_TIMES = os.getenv("DIGEST_TIMES", "10:00,14:00,18:00")
+DIGEST_PUSH_TIME = os.getenv("DIGEST_PUSH_TIME", "21:00")
+DIGEST_JITTER = float(os.getenv("DIGEST_JITTER", "600"))
+DIGEST_PRECOMPUTE_CONCURRENCY = int(os.getenv("DIGEST_PRECOMPUTE_CONCURRENCY", "2"))
+DIGEST_TAIL_LIMIT = int(os.getenv("DIGEST_TAIL_LIMIT", "300"))
+
+# Процессы-исполнители: при BOT_WORKERS > 1 основной процесс принимает обновления и передаёт
+# их исполнителям по chat_id (у исполнителя очередь до WORKER_QUEUE_SIZE обновлений)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+# Хранилище состояний диалогов: sqlite (общее для процессов и переживает перезапуск) или memory;
+# диалоги, брошенные дольше FSM_STATE_TTL секунд, удаляются
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400"))
+
+# Хранение сообщений: старше RETENTION_DAYS дней (0 - без ограничения) уходят в архив
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "90"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# Полнотекстовый поиск: результатов на странице /search и максимум сообщений в пересказе по теме
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "5"))
+SEARCH_SUMMARY_LIMIT = int(os.getenv("SEARCH_SUMMARY_LIMIT", "1000"))
+
 # Проверка наличия обязательных переменных
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения")
 if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY не найден в переменных окружения") 
\ No newline at end of file
+    raise ValueError("OPENAI_API_KEY не найден в переменных окружения")
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError("BOT_MODE должен быть polling или webhook")
+if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL:
+    raise ValueError("WEBHOOK_BASE_URL обязателен в режиме webhook") 
\ No newline at end of file
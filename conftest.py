@@ -0,0 +1,44 @@
+import asyncio
+import os
+import uuid
+import pytest
+
+# config.py требует токены при импорте - для тестов достаточно заглушек
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+# Адрес сервера PostgreSQL для тестов хранилища, например
+# postgresql://postgres@127.0.0.1:5432/postgres; без него тесты PostgreSQL пропускаются
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def database(request, tmp_path):
+    """Пустое хранилище каждого движка: SQLite во временном файле, PostgreSQL - во временной базе"""
+    from db import Database
+    if request.param == "sqlite":
+        db = Database(str(tmp_path / "bot.db"))
+        yield db
+        db.close()
+        return
+
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    asyncpg = pytest.importorskip("asyncpg")
+    from pgdb import PostgresDatabase
+    name = f"bot_test_{uuid.uuid4().hex[:12]}"
+
+    async def admin(sql: str):
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            await conn.execute(sql)
+        finally:
+            await conn.close()
+
+    asyncio.run(admin(f"CREATE DATABASE {name}"))
+    base, _, _ = TEST_DATABASE_URL.rpartition("/")
+    db = PostgresDatabase(f"{base}/{name}", min_size=1, max_size=4)
+    try:
+        yield db
+    finally:
+        db.close()
+        asyncio.run(admin(f"DROP DATABASE {name} WITH (FORCE)"))
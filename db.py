@@ -1,175 +1,1205 @@
 import sqlite3
 import asyncio
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dtime, timedelta, tzinfo
+from typing import Any, Callable, List, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
 import logging
+from metrics import DB_LATENCY
+from tracing import span
+from config import (DB_READ_WORKERS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_STATEMENT_CACHE,
+                    DB_BUSY_TIMEOUT_MS, DB_ENABLE_INCREMENTAL_VACUUM, TIMEZONE, DATABASE_URL)
 
 logger = logging.getLogger(__name__)
 
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
 class Database:
-    def __init__(self, db_path: str = "bot_database.db"):
+    """Асинхронный доступ к SQLite.
+
+    Запросы выполняются в отдельных потоках, чтобы не блокировать цикл событий:
+    все записи идут через один поток-писатель, чтения - через пул читателей.
+    У каждого потока своё долгоживущее соединение в режиме WAL с кэшем
+    подготовленных выражений.
+    """
+
+    def __init__(self, db_path: str = "bot_database.db", read_workers: int = DB_READ_WORKERS):
         self.db_path = db_path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-reader")
+        self.pending_reads = 0
+        self.pending_writes = 0
         self.init_database()
-    
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открытие соединения с настроенными прагмами"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE)
+        # Действует только на новую БД (до перехода в WAL и создания таблиц); существующую
+        # переводит полный VACUUM, см. _enable_incremental_vacuum
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def _thread_connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока пула (создаётся при первом обращении)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, func: Callable, args: Tuple, write: bool) -> Any:
+        conn = self._thread_connection()
+        if not write:
+            return func(conn, *args)
+        # Контекстный менеджер соединения: commit при успехе, rollback при ошибке
+        with conn:
+            return func(conn, *args)
+
+    async def _read(self, func: Callable, *args) -> Any:
+        """Выполнение func(conn, *args) в пуле читателей"""
+        loop = asyncio.get_running_loop()
+        name = func.__name__.lstrip('_')
+        started = time.perf_counter()
+        self.pending_reads += 1
+        try:
+            with span(f"db.{name}"):
+                return await loop.run_in_executor(self._readers, self._call, func, args, False)
+        finally:
+            self.pending_reads -= 1
+            DB_LATENCY.observe(time.perf_counter() - started, name)
+
+    async def _write(self, func: Callable, *args) -> Any:
+        """Выполнение func(conn, *args) в потоке-писателе одной транзакцией"""
+        loop = asyncio.get_running_loop()
+        name = func.__name__.lstrip('_')
+        started = time.perf_counter()
+        self.pending_writes += 1
+        try:
+            with span(f"db.{name}"):
+                return await loop.run_in_executor(self._writer, self._call, func, args, True)
+        finally:
+            self.pending_writes -= 1
+            DB_LATENCY.observe(time.perf_counter() - started, name)
+
+    def close(self):
+        """Остановка потоков и закрытие соединений"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
     def init_database(self):
-        """Инициализация базы данных и создание таблиц"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Таблица для хранения сообщений
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER NOT NULL,
-                chat_title TEXT,
-                user_id INTEGER,
-                username TEXT,
-                message_text TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица для хранения информации о группах
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS groups (
-                chat_id INTEGER PRIMARY KEY,
-                chat_title TEXT,
-                member_count INTEGER,
-                last_activity DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logger.info("База данных инициализирована")
-    
-    async def save_message(self, chat_id: int, chat_title: str, user_id: int, 
+        """Инициализация базы данных и применение миграций схемы"""
+        conn = self._connect()
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, migration in MIGRATIONS:
+                if target <= version:
+                    continue
+                logger.info(f"Применение миграции схемы {target}: {migration.__doc__}")
+                migration(conn)
+                # PRAGMA не принимает параметры, версия берётся из списка миграций
+                conn.execute(f"PRAGMA user_version = {int(target)}")
+                conn.commit()
+                version = target
+            if DB_ENABLE_INCREMENTAL_VACUUM:
+                _enable_incremental_vacuum(conn)
+        finally:
+            conn.close()
+        logger.info(f"База данных инициализирована (версия схемы {version})")
+
+    async def ping(self) -> bool:
+        """Проверка доступности БД для /health"""
+        try:
+            return await self._read(self._ping)
+        except Exception as e:
+            logger.error(f"БД недоступна: {e}")
+            return False
+
+    @staticmethod
+    def _ping(conn: sqlite3.Connection) -> bool:
+        return conn.execute("SELECT 1").fetchone()[0] == 1
+
+    async def save_message(self, chat_id: int, chat_title: str, user_id: int,
                           username: str, message_text: str):
         """Сохранение сообщения в базу данных"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO messages (chat_id, chat_title, user_id, username, message_text)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (chat_id, chat_title, user_id, username, message_text))
-            
-            # Обновляем информацию о группе
-            cursor.execute('''
-                INSERT OR REPLACE INTO groups (chat_id, chat_title, last_activity)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-            ''', (chat_id, chat_title))
-            
-            conn.commit()
-            conn.close()
+            await self._write(self._save_message, chat_id, chat_title, user_id,
+                              username, message_text)
         except Exception as e:
             logger.error(f"Ошибка при сохранении сообщения: {e}")
-    
+
+    @staticmethod
+    def _save_message(conn: sqlite3.Connection, chat_id: int, chat_title: str,
+                      user_id: int, username: str, message_text: str):
+        row = (chat_id, chat_title, user_id, username, message_text, int(time.time()))
+        Database._save_messages_batch(conn, [row])
+
+    async def save_messages_batch(self, rows: List[Tuple]) -> List[int]:
+        """Пакетное сохранение сообщений одной транзакцией.
+
+        Каждая строка - (chat_id, chat_title, user_id, username, message_text, ts),
+        где ts - время сообщения в секундах Unix.
+        Счётчики в groups и user_chats обновляются один раз на ключ за пакет.
+        Возвращает id вставленных сообщений в порядке строк.
+        """
+        if not rows:
+            return []
+        return await self._write(self._save_messages_batch, rows)
+
+    @staticmethod
+    def _save_messages_batch(conn: sqlite3.Connection, rows: List[Tuple]) -> List[int]:
+        groups, members = batch_counters(rows)
+
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO messages (chat_id, chat_title, user_id, username, message_text, ts, timestamp)
+            VALUES (?1, ?2, ?3, ?4, ?5, ?6, datetime(?6, 'unixepoch'))
+        ''', rows)
+
+        # Пакет вставляется одной транзакцией, поэтому id идут подряд
+        last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+
+        cursor.executemany('''
+            INSERT INTO groups (chat_id, chat_title, last_activity, message_count)
+            VALUES (?, ?, datetime(?, 'unixepoch'), ?)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                chat_title = excluded.chat_title,
+                last_activity = MAX(last_activity, excluded.last_activity),
+                message_count = message_count + excluded.message_count
+        ''', groups)
+
+        cursor.executemany('''
+            INSERT INTO user_chats (user_id, chat_id, message_count, last_seen)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, chat_id) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                last_seen = MAX(COALESCE(last_seen, 0), excluded.last_seen)
+        ''', members)
+
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
     async def get_user_groups(self, user_id: int) -> List[Dict]:
         """Получение списка групп, где пользователь и бот состоят вместе"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT DISTINCT g.chat_id, g.chat_title, g.last_activity,
-                       COUNT(m.id) as message_count
-                FROM groups g
-                LEFT JOIN messages m ON g.chat_id = m.chat_id
-                WHERE g.chat_id IN (
-                    SELECT DISTINCT chat_id FROM messages 
-                    WHERE user_id = ? OR chat_id IN (
-                        SELECT chat_id FROM messages 
-                        WHERE user_id = ?
-                    )
-                )
-                GROUP BY g.chat_id, g.chat_title, g.last_activity
-                ORDER BY g.last_activity DESC
-            ''', (user_id, user_id))
-            
-            groups = []
-            for row in cursor.fetchall():
-                groups.append({
-                    'chat_id': row[0],
-                    'chat_title': row[1],
-                    'last_activity': row[2],
-                    'message_count': row[3]
-                })
-            
-            conn.close()
-            return groups
+            return await self._read(self._get_user_groups, user_id)
         except Exception as e:
             logger.error(f"Ошибка при получении групп пользователя: {e}")
             return []
-    
-    async def get_recent_messages(self, chat_id: int, limit: int = 200, 
+
+    @staticmethod
+    def _get_user_groups(conn: sqlite3.Connection, user_id: int) -> List[Dict]:
+        cursor = conn.cursor()
+
+        # Членство и счётчики ведутся при записи - здесь только поиск по первичному ключу
+        cursor.execute('''
+            SELECT g.chat_id, g.chat_title, g.last_activity, g.message_count
+            FROM user_chats uc
+            JOIN groups g ON g.chat_id = uc.chat_id
+            WHERE uc.user_id = ?
+            ORDER BY g.last_activity DESC
+        ''', (user_id,))
+
+        groups = []
+        for row in cursor.fetchall():
+            groups.append({
+                'chat_id': row[0],
+                'chat_title': row[1],
+                'last_activity': row[2],
+                'message_count': row[3]
+            })
+        return groups
+
+    async def get_recent_messages(self, chat_id: int, limit: int = 200,
                                  hours: Optional[int] = None) -> List[Dict]:
         """Получение последних сообщений из группы"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            if hours:
-                # Получаем сообщения за последние N часов
-                time_filter = datetime.now() - timedelta(hours=hours)
-                cursor.execute('''
-                    SELECT user_id, username, message_text, timestamp
-                    FROM messages
-                    WHERE chat_id = ? AND timestamp >= ?
-                    ORDER BY timestamp DESC
-                    LIMIT ?
-                ''', (chat_id, time_filter, limit))
-            else:
-                # Получаем последние N сообщений
-                cursor.execute('''
-                    SELECT user_id, username, message_text, timestamp
-                    FROM messages
-                    WHERE chat_id = ?
-                    ORDER BY timestamp DESC
-                    LIMIT ?
-                ''', (chat_id, limit))
-            
-            messages = []
-            for row in cursor.fetchall():
-                messages.append({
-                    'user_id': row[0],
-                    'username': row[1],
-                    'message_text': row[2],
-                    'timestamp': row[3]
-                })
-            
-            conn.close()
-            return messages[::-1]  # Возвращаем в хронологическом порядке
+            return await self._read(self._get_recent_messages, chat_id, limit, hours)
         except Exception as e:
             logger.error(f"Ошибка при получении сообщений: {e}")
             return []
-    
+
+    @staticmethod
+    def _get_recent_messages(conn: sqlite3.Connection, chat_id: int, limit: int,
+                             hours: Optional[int]) -> List[Dict]:
+        cursor = conn.cursor()
+
+        if hours:
+            # Получаем сообщения за последние N часов (диапазон по индексу chat_id, ts)
+            since = int(time.time()) - hours * 3600
+            cursor.execute(f'''
+                SELECT {MESSAGE_COLUMNS}
+                FROM messages
+                WHERE chat_id = ? AND ts >= ?
+                ORDER BY ts DESC
+                LIMIT ?
+            ''', (chat_id, since, limit))
+        else:
+            # Получаем последние N сообщений
+            cursor.execute(f'''
+                SELECT {MESSAGE_COLUMNS}
+                FROM messages
+                WHERE chat_id = ?
+                ORDER BY ts DESC
+                LIMIT ?
+            ''', (chat_id, limit))
+
+        messages = [_message_from_row(row) for row in cursor.fetchall()]
+        return messages[::-1]  # Возвращаем в хронологическом порядке
+
+    async def load_recent_messages(self, chat_id: int, limit: int) -> List[Dict]:
+        """Последние limit сообщений группы без перехвата ошибок (для прогрева буфера)"""
+        return await self._read(self._get_recent_messages, chat_id, limit, None)
+
     async def get_today_messages(self, chat_id: int) -> List[Dict]:
         """Получение сообщений за сегодня"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            today = datetime.now().date()
-            cursor.execute('''
-                SELECT user_id, username, message_text, timestamp
-                FROM messages
-                WHERE chat_id = ? AND DATE(timestamp) = ?
-                ORDER BY timestamp ASC
-            ''', (chat_id, today))
-            
-            messages = []
-            for row in cursor.fetchall():
-                messages.append({
-                    'user_id': row[0],
-                    'username': row[1],
-                    'message_text': row[2],
-                    'timestamp': row[3]
-                })
-            
-            conn.close()
-            return messages
+            return await self._read(self._get_today_messages, chat_id)
         except Exception as e:
             logger.error(f"Ошибка при получении сообщений за сегодня: {e}")
-            return [] 
\ No newline at end of file
+            return []
+
+    @staticmethod
+    def _get_today_messages(conn: sqlite3.Connection, chat_id: int) -> List[Dict]:
+        cursor = conn.cursor()
+
+        start, end = day_bounds(datetime.now(LOCAL_TZ).date())
+        cursor.execute(f'''
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE chat_id = ? AND ts >= ? AND ts < ?
+            ORDER BY ts ASC
+        ''', (chat_id, start, end))
+
+        return [_message_from_row(row) for row in cursor.fetchall()]
+
+    async def get_cached_summary(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        """Получение сохранённого пересказа (текст, срок годности), если он не устарел"""
+        try:
+            return await self._read(self._get_cached_summary, key, now)
+        except Exception as e:
+            logger.error(f"Ошибка при чтении кэша пересказов: {e}")
+            return None
+
+    @staticmethod
+    def _get_cached_summary(conn: sqlite3.Connection, key: str,
+                            now: float) -> Optional[Tuple[str, float]]:
+        row = conn.execute('''
+            SELECT summary, expires_at FROM summary_cache
+            WHERE cache_key = ? AND expires_at > ?
+        ''', (key, now)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    async def save_cached_summary(self, key: str, chat_id: int, summary: str, expires_at: float):
+        """Сохранение пересказа в кэш с удалением устаревших записей"""
+        try:
+            await self._write(self._save_cached_summary, key, chat_id, summary, expires_at)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении кэша пересказов: {e}")
+
+    @staticmethod
+    def _save_cached_summary(conn: sqlite3.Connection, key: str, chat_id: int,
+                             summary: str, expires_at: float):
+        conn.execute("DELETE FROM summary_cache WHERE expires_at <= ?", (time.time(),))
+        conn.execute('''
+            INSERT OR REPLACE INTO summary_cache (cache_key, chat_id, summary, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (key, chat_id, summary, time.time(), expires_at))
+
+    async def get_chat_ids(self) -> List[int]:
+        """Идентификаторы всех известных групп"""
+        try:
+            return await self._read(self._get_chat_ids)
+        except Exception as e:
+            logger.error(f"Ошибка при получении списка групп: {e}")
+            return []
+
+    @staticmethod
+    def _get_chat_ids(conn: sqlite3.Connection) -> List[int]:
+        return [row[0] for row in conn.execute("SELECT chat_id FROM groups")]
+
+    async def get_window_stats(self, chat_ids: List[int], since_ts: int, until_ts: int) -> Dict[int, Dict]:
+        """Число сообщений и последний id за [since_ts, until_ts) для нескольких групп одним
+        запросом; группы без сообщений в окне отсутствуют в результате"""
+        if not chat_ids:
+            return {}
+        return await self._read(self._get_window_stats, chat_ids, since_ts, until_ts)
+
+    @staticmethod
+    def _get_window_stats(conn: sqlite3.Connection, chat_ids: List[int], since_ts: int,
+                          until_ts: int) -> Dict[int, Dict]:
+        placeholders = ", ".join("?" * len(chat_ids))
+        cursor = conn.execute(f'''
+            SELECT chat_id, COUNT(*), MAX(id)
+            FROM messages
+            WHERE chat_id IN ({placeholders}) AND ts >= ? AND ts < ?
+            GROUP BY chat_id
+        ''', (*chat_ids, since_ts, until_ts))
+        return {row[0]: {'message_count': row[1], 'max_message_id': row[2]} for row in cursor.fetchall()}
+
+    async def get_window_messages(self, chat_id: int, since_ts: int, until_ts: int,
+                                  skip_ids: Optional[Tuple[int, int]] = None) -> List[Dict]:
+        """Сообщения группы за [since_ts, until_ts) в хронологическом порядке.
+
+        skip_ids - диапазон id (включительно), уже покрытый сохранёнными фрагментами.
+        """
+        return await self._read(self._get_window_messages, chat_id, since_ts, until_ts, skip_ids)
+
+    @staticmethod
+    def _get_window_messages(conn: sqlite3.Connection, chat_id: int, since_ts: int, until_ts: int,
+                             skip_ids: Optional[Tuple[int, int]]) -> List[Dict]:
+        if skip_ids is None:
+            skip_ids = (0, -1)
+        cursor = conn.execute(f'''
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE chat_id = ? AND ts >= ? AND ts < ? AND (id < ? OR id > ?)
+            ORDER BY ts ASC, id ASC
+        ''', (chat_id, since_ts, until_ts, skip_ids[0], skip_ids[1]))
+        return [_message_from_row(row) for row in cursor.fetchall()]
+
+    async def get_chats_window_messages(self, chat_ids: List[int], since_ts: int, until_ts: int,
+                                        skip_ids: Dict[int, Tuple[int, int]]) -> Dict[int, List[Dict]]:
+        """Сообщения нескольких групп за [since_ts, until_ts) одним запросом (для дайджеста).
+
+        skip_ids - диапазоны id, уже покрытые фрагментами, по группам; группы
+        без сообщений в окне отсутствуют в результате.
+        """
+        if not chat_ids:
+            return {}
+        return await self._read(self._get_chats_window_messages, chat_ids, since_ts, until_ts, skip_ids)
+
+    @staticmethod
+    def _get_chats_window_messages(conn: sqlite3.Connection, chat_ids: List[int], since_ts: int,
+                                   until_ts: int, skip_ids: Dict[int, Tuple[int, int]]) -> Dict[int, List[Dict]]:
+        # Диапазоны передаются строками VALUES: для каждой группы - свой проход по индексу (chat_id, ts)
+        ranges = [value for chat_id in chat_ids for value in (chat_id, *skip_ids.get(chat_id, (0, -1)))]
+        values = ", ".join(["(?, ?, ?)"] * len(chat_ids))
+        cursor = conn.execute(f'''
+            WITH skip (chat_id, low, high) AS (VALUES {values})
+            SELECT m.chat_id, m.id, m.chat_title, m.user_id, m.username, m.message_text, m.ts
+            FROM skip s
+            JOIN messages m ON m.chat_id = s.chat_id AND m.ts >= ? AND m.ts < ?
+            WHERE m.id < s.low OR m.id > s.high
+            ORDER BY m.chat_id, m.ts ASC, m.id ASC
+        ''', (*ranges, since_ts, until_ts))
+        messages: Dict[int, List[Dict]] = {}
+        for row in cursor.fetchall():
+            messages.setdefault(row[0], []).append(_message_from_row(row[1:]))
+        return messages
+
+    async def get_messages_after(self, chat_id: int, after_id: int, since_ts: int,
+                                 limit: int) -> List[Dict]:
+        """Следующие limit сообщений группы после after_id (не раньше since_ts)"""
+        return await self._read(self._get_messages_after, chat_id, after_id, since_ts, limit)
+
+    @staticmethod
+    def _get_messages_after(conn: sqlite3.Connection, chat_id: int, after_id: int,
+                            since_ts: int, limit: int) -> List[Dict]:
+        # Условие по ts позволяет начать диапазон индекса (chat_id, ts) с конца прошлого фрагмента
+        cursor = conn.execute(f'''
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE chat_id = ? AND ts >= ? AND id > ?
+            ORDER BY id ASC
+            LIMIT ?
+        ''', (chat_id, since_ts, after_id, limit))
+        return [_message_from_row(row) for row in cursor.fetchall()]
+
+    async def get_last_chunk(self, chat_id: int) -> Tuple[int, int]:
+        """(last_message_id, start_ts) последнего сохранённого фрагмента или (0, 0)"""
+        return await self._read(self._get_last_chunk, chat_id)
+
+    @staticmethod
+    def _get_last_chunk(conn: sqlite3.Connection, chat_id: int) -> Tuple[int, int]:
+        row = conn.execute('''
+            SELECT last_message_id, start_ts FROM chunk_summaries
+            WHERE chat_id = ?
+            ORDER BY last_message_id DESC
+            LIMIT 1
+        ''', (chat_id,)).fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+    async def save_chunk_summary(self, chat_id: int, messages: List[Dict], summary: str):
+        """Сохранение пересказа фрагмента из последовательных сообщений"""
+        await self._write(self._save_chunk_summary, chat_id, messages, summary)
+
+    @staticmethod
+    def _save_chunk_summary(conn: sqlite3.Connection, chat_id: int, messages: List[Dict],
+                            summary: str):
+        user_ids = sorted({msg['user_id'] for msg in messages if msg.get('user_id') is not None})
+        conn.execute('''
+            INSERT OR REPLACE INTO chunk_summaries
+                (chat_id, first_message_id, last_message_id, start_ts, end_ts,
+                 message_count, user_ids, summary, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (chat_id, messages[0]['id'], messages[-1]['id'],
+              min(msg['ts'] for msg in messages), max(msg['ts'] for msg in messages),
+              len(messages), ",".join(map(str, user_ids)), summary, int(time.time())))
+
+    async def delete_chunk_summaries(self, chat_id: int):
+        """Удаление всех фрагментов группы"""
+        await self._write(self._delete_chunk_summaries, chat_id)
+
+    @staticmethod
+    def _delete_chunk_summaries(conn: sqlite3.Connection, chat_id: int):
+        conn.execute("DELETE FROM chunk_summaries WHERE chat_id = ?", (chat_id,))
+
+    async def get_chunk_summaries(self, chat_id: int, since_ts: int, until_ts: int) -> List[Dict]:
+        """Сохранённые фрагменты, целиком попадающие в [since_ts, until_ts)"""
+        return await self._read(self._get_chunk_summaries, chat_id, since_ts, until_ts)
+
+    @staticmethod
+    def _get_chunk_summaries(conn: sqlite3.Connection, chat_id: int, since_ts: int,
+                             until_ts: int) -> List[Dict]:
+        cursor = conn.execute('''
+            SELECT first_message_id, last_message_id, start_ts, end_ts,
+                   message_count, user_ids, summary
+            FROM chunk_summaries
+            WHERE chat_id = ? AND start_ts >= ? AND end_ts < ?
+            ORDER BY first_message_id ASC
+        ''', (chat_id, since_ts, until_ts))
+        return [_chunk_from_row(row) for row in cursor.fetchall()]
+
+    async def get_chats_chunk_summaries(self, chat_ids: List[int], since_ts: int,
+                                        until_ts: int) -> Dict[int, List[Dict]]:
+        """Фрагменты нескольких групп, целиком попадающие в [since_ts, until_ts), одним запросом"""
+        if not chat_ids:
+            return {}
+        return await self._read(self._get_chats_chunk_summaries, chat_ids, since_ts, until_ts)
+
+    @staticmethod
+    def _get_chats_chunk_summaries(conn: sqlite3.Connection, chat_ids: List[int], since_ts: int,
+                                   until_ts: int) -> Dict[int, List[Dict]]:
+        placeholders = ", ".join("?" * len(chat_ids))
+        cursor = conn.execute(f'''
+            SELECT chat_id, first_message_id, last_message_id, start_ts, end_ts,
+                   message_count, user_ids, summary
+            FROM chunk_summaries
+            WHERE chat_id IN ({placeholders}) AND start_ts >= ? AND end_ts < ?
+            ORDER BY chat_id, first_message_id ASC
+        ''', (*chat_ids, since_ts, until_ts))
+        chunks: Dict[int, List[Dict]] = {}
+        for row in cursor.fetchall():
+            chunks.setdefault(row[0], []).append(_chunk_from_row(row[1:]))
+        return chunks
+
+    async def create_summary_job(self, user_id: int, chat_id: int, window: str, group_title: Optional[str],
+                                 reply_chat_id: int, message_id: int) -> int:
+        """Сохранение задачи на пересказ; возвращает её id"""
+        return await self._write(self._create_summary_job, user_id, chat_id, window, group_title,
+                                 reply_chat_id, message_id)
+
+    @staticmethod
+    def _create_summary_job(conn: sqlite3.Connection, user_id: int, chat_id: int, window: str,
+                            group_title: Optional[str], reply_chat_id: int, message_id: int) -> int:
+        cursor = conn.execute('''
+            INSERT INTO summary_jobs (user_id, chat_id, window, group_title, reply_chat_id,
+                                      message_id, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)
+        ''', (user_id, chat_id, window, group_title, reply_chat_id, message_id, time.time()))
+        return cursor.lastrowid
+
+    async def mark_summary_job_running(self, job_id: int):
+        try:
+            await self._write(self._mark_summary_job_running, job_id)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении задачи {job_id}: {e}")
+
+    @staticmethod
+    def _mark_summary_job_running(conn: sqlite3.Connection, job_id: int):
+        conn.execute("UPDATE summary_jobs SET status = 'running', started_at = ? WHERE id = ?",
+                     (time.time(), job_id))
+
+    async def delete_summary_jobs(self, job_ids: List[int]):
+        """Удаление выполненных задач"""
+        try:
+            await self._write(self._delete_summary_jobs, job_ids)
+        except Exception as e:
+            logger.error(f"Ошибка при удалении задач: {e}")
+
+    @staticmethod
+    def _delete_summary_jobs(conn: sqlite3.Connection, job_ids: List[int]):
+        conn.executemany("DELETE FROM summary_jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+
+    async def get_unfinished_summary_jobs(self) -> List[Dict]:
+        """Задачи, не завершённые до перезапуска, в порядке постановки"""
+        try:
+            return await self._read(self._get_unfinished_summary_jobs)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке задач: {e}")
+            return []
+
+    @staticmethod
+    def _get_unfinished_summary_jobs(conn: sqlite3.Connection) -> List[Dict]:
+        cursor = conn.execute('''
+            SELECT id, user_id, chat_id, window, group_title, reply_chat_id, message_id, created_at
+            FROM summary_jobs
+            ORDER BY id ASC
+        ''')
+        return [{
+            'id': row[0],
+            'user_id': row[1],
+            'chat_id': row[2],
+            'window': row[3],
+            'group_title': row[4],
+            'reply_chat_id': row[5],
+            'message_id': row[6],
+            'created_at': row[7]
+        } for row in cursor.fetchall()]
+
+    async def get_messages_before(self, chat_id: int, before_ts: int, limit: int) -> List[Dict]:
+        """Самые старые limit сообщений группы раньше before_ts (кандидаты в архив)"""
+        return await self._read(self._get_messages_before, chat_id, before_ts, limit)
+
+    @staticmethod
+    def _get_messages_before(conn: sqlite3.Connection, chat_id: int, before_ts: int,
+                             limit: int) -> List[Dict]:
+        cursor = conn.execute(f'''
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE chat_id = ? AND ts < ?
+            ORDER BY ts ASC, id ASC
+            LIMIT ?
+        ''', (chat_id, before_ts, limit))
+        return [_message_from_row(row) for row in cursor.fetchall()]
+
+    async def search_messages(self, chat_ids: List[int], match: str, limit: int,
+                              offset: int = 0) -> List[Dict]:
+        """Сообщения групп chat_ids по запросу FTS5 match, самые релевантные первыми.
+
+        Каждый результат содержит фрагмент текста (snippet) с найденными
+        словами в «кавычках».
+        """
+        if not chat_ids:
+            return []
+        return await self._read(self._search_messages, chat_ids, match, limit, offset)
+
+    @staticmethod
+    def _search_messages(conn: sqlite3.Connection, chat_ids: List[int], match: str, limit: int,
+                         offset: int) -> List[Dict]:
+        placeholders = ", ".join("?" * len(chat_ids))
+        cursor = conn.execute(f'''
+            SELECT m.id, m.chat_id, m.chat_title, m.username, m.ts,
+                   snippet(messages_fts, 0, '«', '»', '…', {SNIPPET_TOKENS})
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ? AND m.chat_id IN ({placeholders})
+            ORDER BY bm25(messages_fts, 1.0, 0.0)
+            LIMIT ? OFFSET ?
+        ''', (_scoped_match(chat_ids, match), *chat_ids, limit, offset))
+        return [{
+            'id': row[0],
+            'chat_id': row[1],
+            'chat_title': row[2],
+            'username': row[3],
+            'ts': row[4],
+            'timestamp': format_ts(row[4]),
+            'snippet': row[5]
+        } for row in cursor.fetchall()]
+
+    async def search_window_messages(self, chat_id: int, match: str, since_ts: Optional[int],
+                                     until_ts: Optional[int], limit: int) -> List[Dict]:
+        """Последние limit сообщений группы по запросу FTS5 match за [since_ts, until_ts)
+        в хронологическом порядке (для пересказа по теме)"""
+        return await self._read(self._search_window_messages, chat_id, match, since_ts, until_ts, limit)
+
+    @staticmethod
+    def _search_window_messages(conn: sqlite3.Connection, chat_id: int, match: str,
+                                since_ts: Optional[int], until_ts: Optional[int], limit: int) -> List[Dict]:
+        cursor = conn.execute('''
+            SELECT m.id, m.chat_title, m.user_id, m.username, m.message_text, m.ts
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ? AND m.chat_id = ? AND m.ts >= ? AND m.ts < ?
+            ORDER BY messages_fts.rowid DESC
+            LIMIT ?
+        ''', (_scoped_match([chat_id], match), chat_id,
+              since_ts if since_ts is not None else -2 ** 62,
+              until_ts if until_ts is not None else 2 ** 62, limit))
+        messages = [_message_from_row(row) for row in cursor.fetchall()]
+        return messages[::-1]
+
+    async def delete_messages(self, message_ids: List[int]):
+        """Удаление сообщений, перенесённых в архив; счётчики сообщений групп и
+        участников уменьшаются в той же транзакции"""
+        await self._write(self._delete_messages, message_ids)
+
+    @staticmethod
+    def _delete_messages(conn: sqlite3.Connection, message_ids: List[int]):
+        counts = []
+        # Порциями: число параметров запроса SQLite ограничено
+        for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+            batch = message_ids[start:start + DELETE_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            counts += conn.execute(f'''
+                SELECT chat_id, user_id, COUNT(*) FROM messages
+                WHERE id IN ({placeholders})
+                GROUP BY chat_id, user_id
+            ''', batch).fetchall()
+            conn.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", batch)
+        groups, members = deleted_counters(counts)
+        conn.executemany("UPDATE groups SET message_count = MAX(0, message_count - ?) WHERE chat_id = ?",
+                         [(count, chat_id) for chat_id, count in groups])
+        conn.executemany('''
+            UPDATE user_chats SET message_count = MAX(0, message_count - ?)
+            WHERE user_id = ? AND chat_id = ?
+        ''', [(count, user_id, chat_id) for user_id, chat_id, count in members])
+
+    async def delete_expired_summaries(self, now: float) -> int:
+        """Удаление устаревших записей кэша пересказов"""
+        return await self._write(self._delete_expired_summaries, now)
+
+    @staticmethod
+    def _delete_expired_summaries(conn: sqlite3.Connection, now: float) -> int:
+        return conn.execute("DELETE FROM summary_cache WHERE expires_at <= ?", (now,)).rowcount
+
+    async def incremental_vacuum(self) -> int:
+        """Возврат свободных страниц файлу БД; возвращает число освобождённых страниц"""
+        return await self._write(self._incremental_vacuum)
+
+    @staticmethod
+    def _incremental_vacuum(conn: sqlite3.Connection) -> int:
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return before - after
+
+    async def get_retention_policies(self) -> Dict[int, int]:
+        """Сроки хранения сообщений в днях, заданные для отдельных групп"""
+        try:
+            return await self._read(self._get_retention_policies)
+        except Exception as e:
+            logger.error(f"Ошибка при получении сроков хранения: {e}")
+            return {}
+
+    @staticmethod
+    def _get_retention_policies(conn: sqlite3.Connection) -> Dict[int, int]:
+        return dict(conn.execute("SELECT chat_id, days FROM retention_policies").fetchall())
+
+    async def set_retention_days(self, chat_id: int, days: Optional[int]):
+        """Срок хранения для группы; None - вернуть значение по умолчанию"""
+        await self._write(self._set_retention_days, chat_id, days)
+
+    @staticmethod
+    def _set_retention_days(conn: sqlite3.Connection, chat_id: int, days: Optional[int]):
+        if days is None:
+            conn.execute("DELETE FROM retention_policies WHERE chat_id = ?", (chat_id,))
+        else:
+            conn.execute('''
+                INSERT INTO retention_policies (chat_id, days) VALUES (?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET days = excluded.days
+            ''', (chat_id, days))
+
+    async def get_active_chat_ids(self, since_ts: int) -> List[int]:
+        """Группы, в которых были сообщения начиная с since_ts (по groups.last_activity)"""
+        return await self._read(self._get_active_chat_ids, since_ts)
+
+    @staticmethod
+    def _get_active_chat_ids(conn: sqlite3.Connection, since_ts: int) -> List[int]:
+        cursor = conn.execute('''
+            SELECT chat_id FROM groups
+            WHERE last_activity >= datetime(?, 'unixepoch')
+            ORDER BY last_activity DESC
+        ''', (since_ts,))
+        return [row[0] for row in cursor.fetchall()]
+
+    async def get_precomputed_summary(self, chat_id: int, day: str) -> Optional[Dict]:
+        """Заранее построенный пересказ группы за день (ГГГГ-ММ-ДД)"""
+        return await self._read(self._get_precomputed_summary, chat_id, day)
+
+    @staticmethod
+    def _get_precomputed_summary(conn: sqlite3.Connection, chat_id: int, day: str) -> Optional[Dict]:
+        row = conn.execute('''
+            SELECT chat_title, last_message_id, message_count, summary, created_at
+            FROM precomputed_summaries
+            WHERE chat_id = ? AND day = ?
+        ''', (chat_id, day)).fetchone()
+        if row is None:
+            return None
+        return {
+            'chat_title': row[0],
+            'last_message_id': row[1],
+            'message_count': row[2],
+            'summary': row[3],
+            'created_at': row[4]
+        }
+
+    async def save_precomputed_summary(self, chat_id: int, day: str, chat_title: Optional[str],
+                                       last_message_id: int, message_count: int, summary: str):
+        await self._write(self._save_precomputed_summary, chat_id, day, chat_title,
+                          last_message_id, message_count, summary)
+
+    @staticmethod
+    def _save_precomputed_summary(conn: sqlite3.Connection, chat_id: int, day: str, chat_title: Optional[str],
+                                  last_message_id: int, message_count: int, summary: str):
+        conn.execute('''
+            INSERT OR REPLACE INTO precomputed_summaries
+                (chat_id, day, chat_title, last_message_id, message_count, summary, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (chat_id, day, chat_title, last_message_id, message_count, summary, time.time()))
+
+    async def delete_precomputed_summaries_before(self, day: str) -> int:
+        """Удаление заранее построенных пересказов за дни раньше day"""
+        return await self._write(self._delete_precomputed_summaries_before, day)
+
+    @staticmethod
+    def _delete_precomputed_summaries_before(conn: sqlite3.Connection, day: str) -> int:
+        return conn.execute("DELETE FROM precomputed_summaries WHERE day < ?", (day,)).rowcount
+
+    async def get_digest_subscriptions(self) -> Dict[int, Optional[str]]:
+        """Группы, подписанные на ежедневный пересказ, и день последней отправки"""
+        return await self._read(self._get_digest_subscriptions)
+
+    @staticmethod
+    def _get_digest_subscriptions(conn: sqlite3.Connection) -> Dict[int, Optional[str]]:
+        return dict(conn.execute("SELECT chat_id, last_pushed_day FROM digest_subscriptions").fetchall())
+
+    async def set_digest_subscription(self, chat_id: int, enabled: bool):
+        """Подписка группы на ежедневный пересказ или отписка"""
+        await self._write(self._set_digest_subscription, chat_id, enabled)
+
+    @staticmethod
+    def _set_digest_subscription(conn: sqlite3.Connection, chat_id: int, enabled: bool):
+        if enabled:
+            conn.execute("INSERT OR IGNORE INTO digest_subscriptions (chat_id) VALUES (?)", (chat_id,))
+        else:
+            conn.execute("DELETE FROM digest_subscriptions WHERE chat_id = ?", (chat_id,))
+
+    async def mark_digest_pushed(self, chat_id: int, day: str):
+        await self._write(self._mark_digest_pushed, chat_id, day)
+
+    @staticmethod
+    def _mark_digest_pushed(conn: sqlite3.Connection, chat_id: int, day: str):
+        conn.execute("UPDATE digest_subscriptions SET last_pushed_day = ? WHERE chat_id = ?", (day, chat_id))
+
+    async def get_fsm_record(self, key: str) -> Tuple[Optional[str], Dict]:
+        """(состояние, данные) FSM по ключу; (None, {}), если записи нет"""
+        return await self._read(self._get_fsm_record, key)
+
+    @staticmethod
+    def _get_fsm_record(conn: sqlite3.Connection, key: str) -> Tuple[Optional[str], Dict]:
+        row = conn.execute("SELECT state, data FROM fsm_states WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    async def set_fsm_state(self, key: str, state: Optional[str]):
+        await self._write(self._set_fsm_state, key, state)
+
+    @staticmethod
+    def _set_fsm_state(conn: sqlite3.Connection, key: str, state: Optional[str]):
+        conn.execute('''
+            INSERT INTO fsm_states (key, state, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        ''', (key, state, time.time()))
+        # Пустая запись не нужна: её отсутствие означает то же самое
+        conn.execute("DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+    async def set_fsm_data(self, key: str, data: Dict):
+        await self._write(self._set_fsm_data, key, json.dumps(data, ensure_ascii=False))
+
+    @staticmethod
+    def _set_fsm_data(conn: sqlite3.Connection, key: str, data: str):
+        conn.execute('''
+            INSERT INTO fsm_states (key, data, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        ''', (key, data, time.time()))
+        conn.execute("DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+    async def delete_fsm_states_before(self, updated_before: float) -> int:
+        """Удаление брошенных диалогов (состояние не менялось с updated_before)"""
+        return await self._write(self._delete_fsm_states_before, updated_before)
+
+    @staticmethod
+    def _delete_fsm_states_before(conn: sqlite3.Connection, updated_before: float) -> int:
+        return conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (updated_before,)).rowcount
+
+def open_database(url: str = DATABASE_URL) -> Database:
+    """База данных по адресу DATABASE_URL: sqlite:///путь или postgresql://..."""
+    if url.startswith(("postgres://", "postgresql://")):
+        # asyncpg нужен только для PostgreSQL
+        from pgdb import PostgresDatabase
+        return PostgresDatabase(url)
+    if url.startswith("sqlite:///"):
+        return Database(url[len("sqlite:///"):])
+    raise ValueError(f"Неподдерживаемый DATABASE_URL: {url.split('://')[0]}://...")
+
+def batch_counters(rows: List[Tuple]) -> Tuple[List[Tuple], List[Tuple]]:
+    """Счётчики пакета сообщений: одно обновление groups и user_chats на ключ.
+
+    Возвращает строки (chat_id, chat_title, last_ts, count) и
+    (user_id, chat_id, count, last_ts).
+    """
+    groups = {}
+    members = {}
+    for chat_id, chat_title, user_id, _, _, ts in rows:
+        if chat_id in groups:
+            _, _, last_ts, count = groups[chat_id]
+            groups[chat_id] = (chat_id, chat_title, max(last_ts, ts), count + 1)
+        else:
+            groups[chat_id] = (chat_id, chat_title, ts, 1)
+        if user_id is not None:
+            key = (user_id, chat_id)
+            if key in members:
+                _, _, count, last_ts = members[key]
+                members[key] = (user_id, chat_id, count + 1, max(last_ts, ts))
+            else:
+                members[key] = (user_id, chat_id, 1, ts)
+    return list(groups.values()), list(members.values())
+
+def deleted_counters(counts: List[Tuple]) -> Tuple[List[Tuple], List[Tuple]]:
+    """На сколько уменьшить счётчики после удаления сообщений.
+
+    counts - строки (chat_id, user_id, count); возвращает (chat_id, count) и
+    (user_id, chat_id, count).
+    """
+    groups: Dict[int, int] = {}
+    members: Dict[Tuple[int, int], int] = {}
+    for chat_id, user_id, count in counts:
+        groups[chat_id] = groups.get(chat_id, 0) + count
+        if user_id is not None:
+            members[(user_id, chat_id)] = members.get((user_id, chat_id), 0) + count
+    return (list(groups.items()),
+            [(user_id, chat_id, count) for (user_id, chat_id), count in members.items()])
+
+def day_bounds(day: date, tz: Optional[tzinfo] = None) -> Tuple[int, int]:
+    """Границы суток [начало, конец) в секундах Unix с учётом часового пояса"""
+    tz = tz or LOCAL_TZ
+    start = datetime.combine(day, dtime.min, tzinfo=tz)
+    end = datetime.combine(day + timedelta(days=1), dtime.min, tzinfo=tz)
+    return int(start.timestamp()), int(end.timestamp())
+
+def format_ts(ts: Optional[int]) -> str:
+    """Время сообщения в локальном часовом поясе для отображения"""
+    if ts is None:
+        return ''
+    return datetime.fromtimestamp(ts, LOCAL_TZ).strftime('%Y-%m-%d %H:%M:%S')
+
+MESSAGE_COLUMNS = "id, chat_title, user_id, username, message_text, ts"
+
+# Длина фрагмента с найденными словами в результатах поиска, в словах
+SNIPPET_TOKENS = 16
+
+# Сообщений в одном запросе удаления (не больше лимита параметров SQLite)
+DELETE_BATCH_SIZE = 500
+
+def _scoped_match(chat_ids: List[int], match: str) -> str:
+    """Запрос FTS5, ограниченный группами: id группы проиндексирован в колонке chat_id.
+
+    Токенизатор отбрасывает знак минуса, поэтому условие по колонке сужает
+    выборку до пересечения списков индекса, а точная проверка chat_id
+    остаётся в SQL.
+    """
+    scope = " OR ".join(f'"{abs(int(chat_id))}"' for chat_id in chat_ids)
+    return f"chat_id : ({scope}) AND ({match})"
+
+def _chunk_from_row(row: Tuple) -> Dict:
+    return {
+        'first_message_id': row[0],
+        'last_message_id': row[1],
+        'start_ts': row[2],
+        'end_ts': row[3],
+        'message_count': row[4],
+        'user_ids': {int(uid) for uid in row[5].split(",") if uid},
+        'summary': row[6]
+    }
+
+def _message_from_row(row: Tuple) -> Dict:
+    return {
+        'id': row[0],
+        'chat_title': row[1],
+        'user_id': row[2],
+        'username': row[3],
+        'message_text': row[4],
+        'ts': row[5],
+        'timestamp': format_ts(row[5])
+    }
+
+# Миграции схемы. Текущая версия хранится в PRAGMA user_version.
+# Миграция должна переживать повторный запуск: если процесс прервётся
+# посередине, при следующем старте она выполнится заново.
+
+def _migration_base_schema(conn: sqlite3.Connection):
+    """базовые таблицы messages и groups"""
+    cursor = conn.cursor()
+
+    # Таблица для хранения сообщений
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            chat_title TEXT,
+            user_id INTEGER,
+            username TEXT,
+            message_text TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица для хранения информации о группах
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS groups (
+            chat_id INTEGER PRIMARY KEY,
+            chat_title TEXT,
+            member_count INTEGER,
+            last_activity DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_epoch_timestamps(conn: sqlite3.Connection):
+    """время сообщений в секундах Unix (ts) и индексы по времени"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+    if 'ts' not in columns:
+        conn.execute("ALTER TABLE messages ADD COLUMN ts INTEGER")
+
+    # Строки, которые запишет старая версия бота во время выкладки, получат ts триггером
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fill_ts
+        AFTER INSERT ON messages WHEN NEW.ts IS NULL
+        BEGIN
+            UPDATE messages
+            SET ts = COALESCE(CAST(strftime('%s', NEW.timestamp) AS INTEGER), 0)
+            WHERE id = NEW.id;
+        END
+    ''')
+    conn.commit()
+
+    # Заполняем ts короткими транзакциями, чтобы не держать блокировку записи
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+    for low in range(0, max_id, MIGRATION_BATCH_SIZE):
+        conn.execute('''
+            UPDATE messages
+            SET ts = COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), 0)
+            WHERE id > ? AND id <= ? AND ts IS NULL
+        ''', (low, low + MIGRATION_BATCH_SIZE))
+        conn.commit()
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_ts ON messages (chat_id, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_chat ON messages (user_id, chat_id)")
+    conn.execute("ANALYZE")
+
+def _migration_membership_counters(conn: sqlite3.Connection):
+    """таблица участия user_chats и счётчик сообщений в groups"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_chats (
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_seen INTEGER,
+            PRIMARY KEY (user_id, chat_id)
+        ) WITHOUT ROWID
+    ''')
+
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(groups)")}
+    if 'message_count' not in columns:
+        conn.execute("ALTER TABLE groups ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+
+    # Начальные значения считаем один раз по индексу (user_id, chat_id)
+    conn.execute('''
+        INSERT OR REPLACE INTO user_chats (user_id, chat_id, message_count, last_seen)
+        SELECT user_id, chat_id, COUNT(*), MAX(ts)
+        FROM messages
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id, chat_id
+    ''')
+    conn.execute('''
+        UPDATE groups
+        SET message_count = (SELECT COUNT(*) FROM messages m WHERE m.chat_id = groups.chat_id)
+    ''')
+
+def _migration_summary_cache(conn: sqlite3.Connection):
+    """постоянный кэш готовых пересказов"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS summary_cache (
+            cache_key TEXT PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_summary_cache_expires ON summary_cache (expires_at)")
+
+def _migration_chunk_summaries(conn: sqlite3.Connection):
+    """сохранённые пересказы фрагментов для иерархического пересказа"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chunk_summaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            first_message_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            user_ids TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            UNIQUE (chat_id, first_message_id)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_summaries_chat_start ON chunk_summaries (chat_id, start_ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_summaries_chat_last ON chunk_summaries (chat_id, last_message_id)")
+
+def _migration_summary_jobs(conn: sqlite3.Connection):
+    """очередь фоновых задач на пересказ"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS summary_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            window TEXT NOT NULL,
+            group_title TEXT,
+            reply_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            started_at REAL
+        )
+    ''')
+
+def _migration_retention(conn: sqlite3.Connection):
+    """сроки хранения по группам"""
+    # Режим auto_vacuum существующей БД меняется только полным VACUUM, который
+    # блокирует запись: он выполняется отдельно, см. _enable_incremental_vacuum
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS retention_policies (
+            chat_id INTEGER PRIMARY KEY,
+            days INTEGER NOT NULL
+        )
+    ''')
+
+def _migration_search_index(conn: sqlite3.Connection):
+    """полнотекстовый индекс сообщений FTS5"""
+    # Индекс хранит только словарь: текст для фрагментов читается из messages через
+    # представление, где "ё" заменена на "е" (unicode61 их не отождествляет)
+    conn.execute(f'''
+        CREATE VIEW IF NOT EXISTS messages_search AS
+        SELECT id, {_fts_text('message_text')} AS message_text, chat_id FROM messages
+    ''')
+    # Префиксный индекс на 4 символа - под самые короткие (и самые широкие) основы слов
+    # запроса, см. search.MIN_PREFIX_LENGTH
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            message_text, chat_id,
+            content = 'messages_search', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '4'
+        )
+    ''')
+
+    # Индекс обновляется в той же транзакции, что и запись сообщений
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO messages_fts (rowid, message_text, chat_id)
+            VALUES (NEW.id, {_fts_text('NEW.message_text')}, NEW.chat_id);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text, chat_id)
+            VALUES ('delete', OLD.id, {_fts_text('OLD.message_text')}, OLD.chat_id);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text, chat_id ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text, chat_id)
+            VALUES ('delete', OLD.id, {_fts_text('OLD.message_text')}, OLD.chat_id);
+            INSERT INTO messages_fts (rowid, message_text, chat_id)
+            VALUES (NEW.id, {_fts_text('NEW.message_text')}, NEW.chat_id);
+        END
+    ''')
+    conn.commit()
+
+    # Индекс очищается и заполняется заново короткими транзакциями, поэтому прерванную
+    # миграцию безопасно повторить. Очистка и граница заполнения - в одной транзакции:
+    # сообщения после границы индексирует триггер
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+    conn.commit()
+    for low in range(0, max_id, MIGRATION_BATCH_SIZE):
+        conn.execute(f'''
+            INSERT INTO messages_fts (rowid, message_text, chat_id)
+            SELECT id, {_fts_text('message_text')}, chat_id FROM messages
+            WHERE id > ? AND id <= ?
+        ''', (low, min(low + MIGRATION_BATCH_SIZE, max_id)))
+        conn.commit()
+
+def _migration_precomputed_summaries(conn: sqlite3.Connection):
+    """заранее построенные пересказы за день и подписки групп на ежедневный пересказ"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS precomputed_summaries (
+            chat_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            chat_title TEXT,
+            last_message_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, day)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS digest_subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            last_pushed_day TEXT
+        )
+    ''')
+
+def _migration_fsm_states(conn: sqlite3.Connection):
+    """состояния диалогов FSM, общие для процессов-исполнителей"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+def _enable_incremental_vacuum(conn: sqlite3.Connection):
+    """Перевод существующей БД в режим auto_vacuum=INCREMENTAL (DB_ENABLE_INCREMENTAL_VACUUM)"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    logger.warning("Перевод БД в режим auto_vacuum=INCREMENTAL: полный VACUUM блокирует запись "
+                   "и временно требует места под копию файла БД")
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    logger.info("Режим auto_vacuum=INCREMENTAL включён")
+
+def _fts_text(column: str) -> str:
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+MIGRATION_BATCH_SIZE = 5000
+
+MIGRATIONS = [
+    (1, _migration_base_schema),
+    (2, _migration_epoch_timestamps),
+    (3, _migration_membership_counters),
+    (4, _migration_summary_cache),
+    (5, _migration_chunk_summaries),
+    (6, _migration_summary_jobs),
+    (7, _migration_retention),
+    (8, _migration_search_index),
+    (9, _migration_precomputed_summaries),
+    (10, _migration_fsm_states),
+]
@@ -0,0 +1,228 @@
+import math
+import re
+import zlib
+from bisect import bisect_right
+from collections import Counter
+from itertools import chain
+from typing import Dict, List, Mapping, Optional, Sequence, Set, Tuple
+from config import EXTRACT_REPLY_WINDOW, EXTRACT_DUPLICATE_JACCARD
+from prompt import estimate_tokens, is_noise
+
+TOKEN_RE = re.compile(r"[^\W\d_]{3,}")
+MENTION_RE = re.compile(r"@(\w+)")
+
+# Частые слова без смысловой нагрузки - не учитываются в весах
+STOPWORDS = frozenset("""
+это как так что его она они оно мне мой моя мое мои вот был была были было будет быть уже еще ещё
+где когда тут там кто чем для при про над под без или если тоже только можно нужно надо есть нет
+даже очень просто вообще сейчас потом тогда всё все всех чтобы который которые этот эта эти того
+the and for that this with you are was have not but just can will what from they there
+""".split())
+
+# Веса составляющих оценки
+W_SALIENCE = 1.0
+W_REPLIES = 0.6
+W_MENTIONS = 0.4
+W_QUESTION = 0.15
+
+# Сколько следующих сообщений проверяется при подсчёте ответов
+REPLY_LOOKAHEAD = 12
+
+# Накладные расходы строки промпта на псевдоним и смещение времени, в токенах
+LINE_OVERHEAD_TOKENS = 4
+
+# Число хэш-функций MinHash и размер полосы для поиска похожих сообщений
+MINHASH_SEEDS = (0x5bd1e995, 0x27d4eb2f, 0x165667b1, 0x9e3779b1)
+MINHASH_BAND = 2
+
+def tokenize(text: str) -> Set[str]:
+    """Значимые слова сообщения в нижнем регистре, без стоп-слов"""
+    return set(TOKEN_RE.findall(text.lower())) - STOPWORDS
+
+class ScoredMessage:
+    """Оценка одного сообщения и решение отборщика (для отладки)"""
+
+    __slots__ = ('index', 'message_id', 'salience', 'replies', 'mentions', 'question', 'score',
+                 'tokens', 'status')
+
+    def __init__(self, index: int, message_id: Optional[int]):
+        self.index = index
+        self.message_id = message_id
+        self.salience = 0.0
+        self.replies = 0.0
+        self.mentions = 0.0
+        self.question = 0.0
+        self.score = 0.0
+        self.tokens = 0
+        # selected | budget | duplicate | noise
+        self.status = "budget"
+
+    def as_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class Selection:
+    """Результат отбора: выбранные сообщения в хронологическом порядке и оценки всех"""
+
+    def __init__(self, messages: List[Mapping], scored: List[ScoredMessage], token_budget: int):
+        self.messages = messages
+        self.scored = scored
+        self.token_budget = token_budget
+
+    @property
+    def tokens(self) -> int:
+        return sum(item.tokens for item in self.scored if item.status == "selected")
+
+    def counts(self) -> Dict[str, int]:
+        return dict(Counter(item.status for item in self.scored))
+
+    def explain(self, limit: int = 30) -> str:
+        """Таблица самых высоко оценённых сообщений с составляющими оценки"""
+        lines = [f"Отобрано {len(self.messages)} из {len(self.scored)} (~{self.tokens} из {self.token_budget} токенов), "
+                 f"{self.counts()}"]
+        for item in sorted(self.scored, key=lambda item: -item.score)[:limit]:
+            lines.append(f"  #{item.message_id} {item.status:9} score={item.score:.3f} "
+                         f"sal={item.salience:.2f} rep={item.replies:.2f} men={item.mentions:.2f} "
+                         f"q={item.question:.2f} tok={item.tokens}")
+        return "\n".join(lines)
+
+class ExtractiveSelector:
+    """Локальный отбор самых информативных сообщений под бюджет токенов.
+
+    Оценка сообщения складывается из:
+    - значимости: сумма IDF его слов, нормированная на длину (редкие
+      для окна слова - признак содержательного сообщения);
+    - ответов: сколько других участников написали в течение reply_window
+      секунд после него (в базе нет reply_to, поэтому ответы оцениваются
+      по времени);
+    - упоминаний: как часто автора упоминают через @username;
+    - вопросов.
+    Затем сообщения берутся по убыванию оценки на корень из длины, пока
+    помещаются в бюджет;
+    почти дубликаты уже выбранных (MinHash + Жаккар) пропускаются.
+    """
+
+    def __init__(self, reply_window: int = EXTRACT_REPLY_WINDOW,
+                 duplicate_jaccard: float = EXTRACT_DUPLICATE_JACCARD):
+        self.reply_window = reply_window
+        self.duplicate_jaccard = duplicate_jaccard
+
+    def select(self, messages: Sequence[Mapping], token_budget: int) -> Selection:
+        count = len(messages)
+        scored = [ScoredMessage(i, msg.get('id')) for i, msg in enumerate(messages)]
+        texts = [(msg.get('message_text') or '').strip() for msg in messages]
+        token_sets: List[Set[str]] = []
+
+        noise = 0
+        for i, text in enumerate(texts):
+            # Шумом бывают только короткие сообщения или одиночные ссылки - длинные не проверяем
+            if not text or ((len(text) < 24 or ' ' not in text) and is_noise(text)):
+                scored[i].status = "noise"
+                token_sets.append(set())
+                noise += 1
+                continue
+            token_sets.append(tokenize(text))
+
+        document_frequency = Counter(chain.from_iterable(token_sets))
+        documents = max(1, count - noise)
+        idf = {token: math.log(documents / df) + 1.0 for token, df in document_frequency.items()}
+
+        mentions = self._mention_counts(messages, texts)
+        replies = self._reply_counts(messages)
+
+        salience = [sum(map(idf.__getitem__, tokens)) / math.sqrt(len(tokens)) if tokens else 0.0
+                    for tokens in token_sets]
+        max_salience = max(salience, default=0.0) or 1.0
+        max_replies = max(replies, default=0) or 1
+        max_mentions = max(mentions.values(), default=0) or 1
+        for item, msg, text in zip(scored, messages, texts):
+            if item.status == "noise":
+                continue
+            item.salience = salience[item.index] / max_salience
+            item.replies = replies[item.index] / max_replies
+            if mentions:
+                item.mentions = mentions.get((msg.get('username') or '').lower(), 0) / max_mentions
+            item.question = 1.0 if '?' in text else 0.0
+            item.tokens = estimate_tokens(text) + LINE_OVERHEAD_TOKENS
+            item.score = (W_SALIENCE * item.salience + W_REPLIES * item.replies
+                          + W_MENTIONS * item.mentions + W_QUESTION * item.question)
+
+        chosen = self._choose(scored, token_sets, token_budget)
+        selected = [messages[i] for i in sorted(chosen)]
+        return Selection(selected, scored, token_budget)
+
+    @staticmethod
+    def _mention_counts(messages: Sequence[Mapping], texts: List[str]) -> Dict[str, int]:
+        """Сколько раз упомянут каждый автор (по @username)"""
+        authors = {(msg.get('username') or '').lower() for msg in messages}
+        counts: Counter = Counter()
+        for text in texts:
+            if '@' in text:
+                counts.update(name.lower() for name in MENTION_RE.findall(text))
+        return {name: counts[name] for name in authors if counts.get(name)}
+
+    def _reply_counts(self, messages: Sequence[Mapping]) -> List[int]:
+        """Число разных участников, написавших в течение reply_window после сообщения.
+
+        Сообщения идут в хронологическом порядке; смотрим только ближайшие
+        REPLY_LOOKAHEAD - в оживлённой группе ответы идут сразу.
+        """
+        count = len(messages)
+        times = [msg.get('ts') or 0 for msg in messages]
+        users = [msg.get('user_id') for msg in messages]
+        replies = [0] * count
+        for i in range(count):
+            end = bisect_right(times, times[i] + self.reply_window, i + 1, min(count, i + REPLY_LOOKAHEAD))
+            if end > i + 1:
+                others = set(users[i + 1:end])
+                others.discard(users[i])
+                replies[i] = len(others)
+        return replies
+
+    def _choose(self, scored: List[ScoredMessage], token_sets: List[Set[str]],
+                token_budget: int) -> List[int]:
+        chosen = []
+        used = 0
+        bands: Dict[Tuple, List[int]] = {}
+        # Длинное сообщение должно быть ценнее короткого, но не пропорционально длине
+        ranked = sorted((item for item in scored if item.status != "noise"),
+                        key=lambda item: (-item.score / math.sqrt(item.tokens), item.index))
+        for item in ranked:
+            if used + item.tokens > token_budget:
+                continue
+            tokens = token_sets[item.index]
+            keys = self._band_keys(tokens)
+            if self._is_duplicate(tokens, keys, bands, token_sets):
+                item.status = "duplicate"
+                continue
+            for key in keys:
+                bands.setdefault(key, []).append(item.index)
+            item.status = "selected"
+            chosen.append(item.index)
+            used += item.tokens
+        return chosen
+
+    @staticmethod
+    def _band_keys(tokens: Set[str]) -> List[Tuple]:
+        if not tokens:
+            return []
+        # Не hash(): он зависит от PYTHONHASHSEED, и отбор менялся бы от процесса к процессу
+        hashes = [zlib.crc32(token.encode()) for token in tokens]
+        signature = [min(value ^ seed for value in hashes) for seed in MINHASH_SEEDS]
+        return [(band,) + tuple(signature[band:band + MINHASH_BAND])
+                for band in range(0, len(signature), MINHASH_BAND)]
+
+    def _is_duplicate(self, tokens: Set[str], keys: List[Tuple], bands: Dict[Tuple, List[int]],
+                      token_sets: List[Set[str]]) -> bool:
+        for key in keys:
+            for other in bands.get(key, ()):
+                other_tokens = token_sets[other]
+                union = len(tokens | other_tokens)
+                if union and len(tokens & other_tokens) / union >= self.duplicate_jaccard:
+                    return True
+        return False
+
+_default_selector = ExtractiveSelector()
+
+def select_messages(messages: Sequence[Mapping], token_budget: int) -> Selection:
+    """Отбор отборщиком с настройками по умолчанию"""
+    return _default_selector.select(messages, token_budget)
@@ -0,0 +1,66 @@
+import math
+from collections import Counter
+from typing import Dict, List, Mapping, Optional, Sequence
+from extract import ExtractiveSelector, tokenize
+from topics import TopicSegmenter
+
+# Сколько тем и сообщений на тему показывать, и длина цитаты
+MAX_TOPICS = 5
+MESSAGES_PER_TOPIC = 2
+KEYWORDS_PER_TOPIC = 4
+QUOTE_CHARS = 200
+
+FALLBACK_NOTICE = ("⚠️ Сервис пересказов сейчас недоступен или перегружен, поэтому это автоматическая "
+                   "выжимка: главные темы и ключевые сообщения.")
+
+class LocalSummarizer:
+    """Пересказ без LLM, который всегда строится за ограниченное время.
+
+    Окно разбивается на темы (TopicSegmenter); для самых больших тем
+    показываются ключевые слова (частые в теме и редкие в остальных) и
+    самые информативные сообщения по оценке ExtractiveSelector.
+    """
+
+    def __init__(self, segmenter: Optional[TopicSegmenter] = None,
+                 selector: Optional[ExtractiveSelector] = None):
+        self.segmenter = segmenter or TopicSegmenter()
+        self.selector = selector or ExtractiveSelector()
+
+    def summarize(self, messages: Sequence[Mapping]) -> str:
+        unique_users = len({msg.get('user_id') for msg in messages})
+        stats = f"📊 Статистика: {len(messages)} сообщений от {unique_users} участников"
+        if not messages:
+            return f"{FALLBACK_NOTICE}\n\n{stats}"
+
+        topics = sorted(self.segmenter.segment(messages), key=len, reverse=True)[:MAX_TOPICS]
+        term_sets = [Counter(token for msg in topic for token in tokenize(msg.get('message_text') or ''))
+                     for topic in topics]
+        document_frequency = Counter(token for terms in term_sets for token in terms)
+
+        sections = []
+        for number, (topic, terms) in enumerate(zip(topics, term_sets), 1):
+            keywords = self._keywords(terms, document_frequency, len(topics))
+            title = ", ".join(keywords) if keywords else "разное"
+            lines = [f"🔹 Тема {number}: {title} ({len(topic)} сообщ.)"]
+            for msg in self._key_messages(topic):
+                author = msg.get('username') or f"user{msg.get('user_id')}"
+                lines.append(f"  • {author}: {_quote(msg.get('message_text') or '')}")
+            sections.append("\n".join(lines))
+
+        return f"{FALLBACK_NOTICE}\n\n" + "\n\n".join(sections) + f"\n\n{stats}"
+
+    @staticmethod
+    def _keywords(terms: Counter, document_frequency: Counter, topics: int) -> List[str]:
+        weights: Dict[str, float] = {token: count * (math.log(topics / document_frequency[token]) + 1.0)
+                                     for token, count in terms.items() if count > 1}
+        return sorted(weights, key=lambda token: (-weights[token], token))[:KEYWORDS_PER_TOPIC]
+
+    def _key_messages(self, topic: Sequence[Mapping]) -> List[Mapping]:
+        scored = [item for item in self.selector.select(topic, len(topic) * 1000).scored
+                  if item.status == "selected"]
+        best = sorted(scored, key=lambda item: -item.score)[:MESSAGES_PER_TOPIC]
+        return [topic[item.index] for item in sorted(best, key=lambda item: item.index)]
+
+def _quote(text: str) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= QUOTE_CHARS else text[:QUOTE_CHARS - 1].rstrip() + "…"
@@ -0,0 +1,50 @@
+import logging
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from config import FSM_STORAGE
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+class SQLiteStorage(BaseStorage):
+    """Состояния диалогов FSM в таблице fsm_states.
+
+    В отличие от MemoryStorage состояние переживает перезапуск и видно всем
+    процессам-исполнителям: выбор группы и выбор периода в /summary могут
+    обработать разные процессы. Данные хранятся как JSON, поэтому в них
+    можно класть только сериализуемые значения.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.db.set_fsm_state(self._key(key), state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self.db.get_fsm_record(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.db.set_fsm_data(self._key(key), data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self.db.get_fsm_record(self._key(key))
+        return data
+
+    async def close(self) -> None:
+        pass
+
+def create_storage(db: Database, kind: str = FSM_STORAGE) -> BaseStorage:
+    """Хранилище состояний по настройке FSM_STORAGE"""
+    if kind == "memory":
+        return MemoryStorage()
+    if kind != "sqlite":
+        logger.warning(f"Неизвестное хранилище состояний {kind!r}, используется sqlite")
+    return SQLiteStorage(db)
@@ -5,8 +5,19 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
-from db import Database
-from llm import LLMService
+from cache import SummaryCache
+from config import SUMMARY_CACHE_PERSIST, SEARCH_PAGE_SIZE
+from db import open_database
+from hotbuffer import HotBuffer
+from ingest import MessageIngestor
+from retention import MessageArchive, RetentionManager
+from scheduler import DigestScheduler
+from jobs import DIGEST_CHAT_ID, QueueFullError, SummaryJobQueue
+from metrics import HandlerMetricsMiddleware
+from search import build_match_query, format_results
+from tracing import TracingMiddleware
+from summarizer import ChunkSummarizer
+from summary import SummaryService, parse_window
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -16,8 +27,36 @@ class SummaryStates(StatesGroup):
     waiting_for_group_selection = State()
     waiting_for_time_period = State()
 
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
+router.message.middleware(TracingMiddleware())
+router.callback_query.middleware(TracingMiddleware())
+
 # Инициализация сервисов
-db = Database()
+db = open_database()
+ingestor = MessageIngestor(db)
+archive = MessageArchive()
+retention = RetentionManager(db, archive)
+hot_buffer = HotBuffer(db)
+summarizer = ChunkSummarizer(db, archive=archive, hot_buffer=hot_buffer)
+ingestor.add_listener(hot_buffer.on_flush)
+ingestor.add_listener(summarizer.on_flush)
+summary_service = SummaryService(db, SummaryCache(db=db if SUMMARY_CACHE_PERSIST else None),
+                                 summarizer=summarizer, hot_buffer=hot_buffer)
+job_queue = SummaryJobQueue(db, summary_service)
+digest_scheduler = DigestScheduler(db, summary_service)
+
+async def enqueue_summary(status: Message, user_id: int, chat_id: int, window: str,
+                          group_title: str = None):
+    """Постановка пересказа в фоновую очередь; status - сообщение, которое покажет результат"""
+    try:
+        position = await job_queue.submit(user_id, chat_id, window, group_title,
+                                          status.chat.id, status.message_id)
+    except QueueFullError:
+        await status.edit_text("❌ Слишком много запросов на пересказ. Попробуйте немного позже.")
+        return
+    if position > 1:
+        await status.edit_text(f"⏳ Пересказ поставлен в очередь (позиция {position}).")
 
 @router.message(Command("start"))
 async def cmd_start(message: Message):
@@ -29,6 +68,9 @@ async def cmd_start(message: Message):
 /summary - Выбрать группу для пересказа
 /summary today - Пересказ обсуждения за сегодня
 /summary 3h - Пересказ за последние 3 часа
+/summary today about деплой - Пересказ только по теме
+/summary all - Дайджест по всем вашим группам за сегодня
+/search запрос - Поиск по сообщениям ваших групп
 
 💡 Как использовать:
 1. Добавьте меня в группу
@@ -51,9 +93,14 @@ async def cmd_help(message: Message):
 🔹 /summary 3h - Пересказ за последние 3 часа
 🔹 /summary 6h - Пересказ за последние 6 часов
 🔹 /summary 12h - Пересказ за последние 12 часов
+🔹 /summary today about деплой - Пересказ сообщений по теме (также /summary about деплой, /summary 3h about релиз)
+🔹 /summary all - Дайджест по всем вашим группам за сегодня (также /summary all 3h)
+🔹 /search запрос - Поиск по сообщениям ваших групп
+🔹 /retention 30 - Срок хранения сообщений группы в днях (для администраторов)
+🔹 /digest on - Ежедневный пересказ дня в группе (для администраторов)
 
 💡 Советы:
-• Бот анализирует последние 200 сообщений
+• Пересказ охватывает весь выбранный период
 • Пересказ создается с помощью ИИ
 • Работает только в группах, где вы состоите
 """
@@ -70,6 +117,16 @@ async def cmd_summary(message: Message, state: FSMContext):
             # Обработка команд с параметрами времени
             time_param = command_parts[1].lower()
             
+            # /summary all 3h - дайджест по всем группам пользователя
+            if time_param == "all":
+                await handle_all_summary(message, " ".join(command_parts[2:]) or "today")
+                return
+            
+            # /summary today about деплой - пересказ только сообщений по теме
+            if time_param == "about" or [part.lower() for part in command_parts[2:3]] == ["about"]:
+                await handle_topic_summary(message, " ".join(command_parts[1:]))
+                return
+            
             if time_param == "today":
                 await handle_today_summary(message)
                 return
@@ -169,33 +226,9 @@ async def process_time_selection(callback: CallbackQuery, state: FSMContext):
         # Показываем сообщение о начале обработки
         await callback.message.edit_text("🔄 Создаю пересказ... Это может занять несколько секунд.")
         
-        # Получаем сообщения в зависимости от выбранного периода
-        if time_option == "recent":
-            messages = await db.get_recent_messages(chat_id, limit=200)
-            time_period = "последние 200 сообщений"
-        elif time_option == "today":
-            messages = await db.get_today_messages(chat_id)
-            time_period = "сегодня"
-        else:
-            # Извлекаем количество часов
-            hours = int(time_option[:-1])
-            messages = await db.get_recent_messages(chat_id, limit=200, hours=hours)
-            time_period = f"последние {hours} часов"
-        
-        if not messages:
-            await callback.message.edit_text("❌ Нет сообщений для анализа в указанный период.")
-            await state.clear()
-            return
-        
-        # Получаем название группы
-        group_title = messages[0].get('chat_title', f"Группа {chat_id}") if messages else f"Группа {chat_id}"
-        
-        # Генерируем пересказ
-        llm_service = LLMService()
-        summary = await llm_service.generate_group_summary(messages, group_title, time_period)
-        
-        # Отправляем результат
-        await callback.message.edit_text(summary)
+        # Пересказ строится в фоне, результат появится в этом же сообщении
+        parse_window(time_option)
+        await enqueue_summary(callback.message, callback.from_user.id, chat_id, time_option)
         
         # Очищаем состояние
         await state.clear()
@@ -220,17 +253,8 @@ async def handle_today_summary(message: Message):
         chat_id = group['chat_id']
         group_title = group['chat_title'] or f"Группа {chat_id}"
         
-        await message.answer("🔄 Создаю пересказ за сегодня...")
-        
-        messages = await db.get_today_messages(chat_id)
-        
-        if not messages:
-            await message.answer("❌ Нет сообщений за сегодня в этой группе.")
-            return
-        
-        llm_service = LLMService()
-        summary = await llm_service.generate_group_summary(messages, group_title, "сегодня")
-        await message.answer(summary)
+        status = await message.answer("🔄 Создаю пересказ за сегодня...")
+        await enqueue_summary(status, user_id, chat_id, "today", group_title)
         
     except Exception as e:
         logger.error(f"Ошибка при обработке today summary: {e}")
@@ -251,23 +275,190 @@ async def handle_hours_summary(message: Message, hours: int):
         chat_id = group['chat_id']
         group_title = group['chat_title'] or f"Группа {chat_id}"
         
-        await message.answer(f"🔄 Создаю пересказ за последние {hours} часов...")
+        status = await message.answer(f"🔄 Создаю пересказ за последние {hours} часов...")
+        await enqueue_summary(status, user_id, chat_id, f"{hours}h", group_title)
         
-        messages = await db.get_recent_messages(chat_id, limit=200, hours=hours)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке hours summary: {e}")
+        await message.answer("❌ Произошла ошибка при создании пересказа")
+
+async def handle_all_summary(message: Message, option: str):
+    """Обработка команды /summary all [today|Nh]"""
+    try:
+        window = parse_window(option)
+        if window.bounds() is None:
+            raise ValueError("Дайджест строится только за период")
+    except ValueError:
+        await message.answer("❌ Используйте: /summary all, /summary all today или /summary all 3h")
+        return
+    try:
+        status = await message.answer(f"🔄 Собираю дайджест по всем группам за {window.title}...")
+        await enqueue_summary(status, message.from_user.id, DIGEST_CHAT_ID, option)
+        
+    except Exception as e:
+        logger.error(f"Ошибка при обработке all summary: {e}")
+        await message.answer("❌ Произошла ошибка при создании дайджеста")
+
+async def handle_topic_summary(message: Message, option: str):
+    """Обработка команды /summary [период] about тема"""
+    try:
+        window = parse_window(option)
+    except ValueError:
+        await message.answer("❌ Укажите период и тему, например: /summary today about деплой")
+        return
+    try:
+        user_id = message.from_user.id
+        groups = await db.get_user_groups(user_id)
         
-        if not messages:
-            await message.answer(f"❌ Нет сообщений за последние {hours} часов в этой группе.")
+        if not groups:
+            await message.answer("❌ Не найдено групп для анализа.")
             return
         
-        time_period = f"последние {hours} часов"
-        llm_service = LLMService()
-        summary = await llm_service.generate_group_summary(messages, group_title, time_period)
-        await message.answer(summary)
+        # Берем первую группу (самую активную)
+        group = groups[0]
+        chat_id = group['chat_id']
+        group_title = group['chat_title'] or f"Группа {chat_id}"
+        
+        status = await message.answer(f"🔄 Создаю пересказ по теме «{window.query}»...")
+        await enqueue_summary(status, user_id, chat_id, option, group_title)
         
     except Exception as e:
-        logger.error(f"Ошибка при обработке hours summary: {e}")
+        logger.error(f"Ошибка при обработке topic summary: {e}")
         await message.answer("❌ Произошла ошибка при создании пересказа")
 
+@router.message(Command("search"))
+async def cmd_search(message: Message, state: FSMContext):
+    """Поиск по сообщениям: /search запрос"""
+    try:
+        query = message.text.partition(' ')[2].strip()
+        if build_match_query(query) is None:
+            await message.answer("❌ Используйте: /search запрос, например /search деплой сервера")
+            return
+        
+        chat_id = _search_chat_id(message)
+        await state.update_data(search_query=query, search_chat_id=chat_id)
+        text, keyboard = await search_page(message.from_user.id, query, 0, chat_id)
+        await message.answer(text, reply_markup=keyboard)
+        
+    except Exception as e:
+        logger.error(f"Ошибка при обработке команды search: {e}")
+        await message.answer("❌ Произошла ошибка при поиске")
+
+@router.callback_query(lambda c: c.data.startswith('search_'))
+async def process_search_page(callback: CallbackQuery, state: FSMContext):
+    """Переход между страницами результатов поиска"""
+    try:
+        page = int(callback.data.split('_')[1])
+        user_data = await state.get_data()
+        query = user_data.get('search_query')
+        
+        if not query:
+            await callback.answer("❌ Поиск устарел, повторите /search")
+            return
+        
+        text, keyboard = await search_page(callback.from_user.id, query, page, user_data.get('search_chat_id'))
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
+        
+    except Exception as e:
+        logger.error(f"Ошибка при переходе по результатам поиска: {e}")
+        await callback.answer("❌ Произошла ошибка при поиске")
+
+def _search_chat_id(message: Message):
+    """В группе поиск идёт только по ней, в личке - по всем группам пользователя"""
+    return message.chat.id if message.chat.type in ['group', 'supergroup'] else None
+
+async def search_page(user_id: int, query: str, page: int, chat_id: int = None):
+    """Текст и кнопки страницы результатов поиска"""
+    chat_ids = [group['chat_id'] for group in await db.get_user_groups(user_id)]
+    if chat_id is not None:
+        chat_ids = [chat_id] if chat_id in chat_ids else []
+    # Лишний результат показывает, есть ли следующая страница
+    results = await db.search_messages(chat_ids, build_match_query(query), SEARCH_PAGE_SIZE + 1,
+                                       page * SEARCH_PAGE_SIZE)
+    has_next = len(results) > SEARCH_PAGE_SIZE
+    
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"search_{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="Далее ▶️", callback_data=f"search_{page + 1}"))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return format_results(query, results[:SEARCH_PAGE_SIZE], page), keyboard
+
+@router.message(Command("retention"))
+async def cmd_retention(message: Message):
+    """Срок хранения сообщений группы: /retention, /retention 30, /retention default"""
+    try:
+        if message.chat.type not in ['group', 'supergroup']:
+            await message.answer("❌ Команда работает только в группе.")
+            return
+        
+        chat_id = message.chat.id
+        command_parts = message.text.split()
+        if len(command_parts) == 1:
+            days = (await db.get_retention_policies()).get(chat_id, retention.default_days)
+            period = f"{days} дн." if days > 0 else "без ограничения"
+            await message.answer(f"🗄 Срок хранения сообщений в базе: {period}\n"
+                                 "Более старые сообщения переносятся в архив.")
+            return
+        
+        member = await message.bot.get_chat_member(chat_id, message.from_user.id)
+        if member.status not in ('creator', 'administrator'):
+            await message.answer("❌ Срок хранения могут менять только администраторы группы.")
+            return
+        
+        argument = command_parts[1].lower()
+        days = None if argument == "default" else int(argument)
+        if days is not None and days < 0:
+            raise ValueError("Срок хранения не может быть отрицательным")
+        await db.set_retention_days(chat_id, days)
+        await message.answer("✅ Срок хранения обновлён.")
+        
+    except ValueError:
+        await message.answer("❌ Используйте: /retention 30 (дней), /retention 0 (без ограничения) или /retention default")
+    except Exception as e:
+        logger.error(f"Ошибка при обработке команды retention: {e}")
+        await message.answer("❌ Произошла ошибка при обработке команды")
+
+@router.message(Command("digest"))
+async def cmd_digest(message: Message):
+    """Ежедневный пересказ дня в группе: /digest, /digest on, /digest off"""
+    try:
+        if message.chat.type not in ['group', 'supergroup']:
+            await message.answer("❌ Команда работает только в группе.")
+            return
+        
+        chat_id = message.chat.id
+        command_parts = message.text.split()
+        push_time = digest_scheduler.push_time.strftime('%H:%M')
+        if len(command_parts) == 1:
+            enabled = chat_id in await db.get_digest_subscriptions()
+            state = f"включён, в {push_time}" if enabled else "выключен"
+            await message.answer(f"📬 Ежедневный пересказ дня: {state}.\n"
+                                 "Включить или выключить: /digest on, /digest off")
+            return
+        
+        argument = command_parts[1].lower()
+        if argument not in ("on", "off"):
+            raise ValueError(f"Неизвестный аргумент: {argument}")
+        member = await message.bot.get_chat_member(chat_id, message.from_user.id)
+        if member.status not in ('creator', 'administrator'):
+            await message.answer("❌ Ежедневный пересказ могут включать только администраторы группы.")
+            return
+        
+        await db.set_digest_subscription(chat_id, argument == "on")
+        if argument == "on":
+            await message.answer(f"✅ Пересказ дня будет приходить в группу ежедневно в {push_time}.")
+        else:
+            await message.answer("✅ Ежедневный пересказ выключен.")
+        
+    except ValueError:
+        await message.answer("❌ Используйте: /digest on или /digest off")
+    except Exception as e:
+        logger.error(f"Ошибка при обработке команды digest: {e}")
+        await message.answer("❌ Произошла ошибка при обработке команды")
+
 @router.message()
 async def handle_all_messages(message: Message):
     """Обработчик всех сообщений для сохранения в базу данных"""
@@ -283,7 +474,8 @@ async def handle_all_messages(message: Message):
             username = message.from_user.username or message.from_user.first_name
             message_text = message.text
             
-            await db.save_message(chat_id, chat_title, user_id, username, message_text)
+            await ingestor.submit(chat_id, chat_title, user_id, username, message_text,
+                                  date=message.date)
             
     except Exception as e:
         logger.error(f"Ошибка при сохранении сообщения: {e}") 
\ No newline at end of file
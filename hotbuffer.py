@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+from config import HOT_BUFFER_SIZE, HOT_BUFFER_MAX_BYTES, HOT_BUFFER_MAX_CHATS
+from db import Database, LOCAL_TZ, day_bounds, format_ts
+from metrics import HOT_BUFFER_BYTES, HOT_BUFFER_HITS
+
+logger = logging.getLogger(__name__)
+
+# Примерный расход памяти на запись без текста: объект со слотами и числа
+RECORD_OVERHEAD = 120
+
+class HotMessage(Mapping):
+    """Компактная запись сообщения в буфере.
+
+    Читается как словарь из Database.get_recent_messages (msg['id'],
+    msg.get('username'), ...), поэтому отдаётся потребителям без копирования.
+    """
+
+    __slots__ = ('id', 'chat_title', 'user_id', 'username', 'message_text', 'ts')
+
+    KEYS = ('id', 'chat_title', 'user_id', 'username', 'message_text', 'ts', 'timestamp')
+
+    def __init__(self, message_id: int, chat_title: Optional[str], user_id: int,
+                 username: Optional[str], message_text: str, ts: int):
+        self.id = message_id
+        self.chat_title = chat_title
+        self.user_id = user_id
+        self.username = username
+        self.message_text = message_text
+        self.ts = ts
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'timestamp':
+            return format_ts(self.ts)
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.KEYS)
+
+    def __len__(self) -> int:
+        return len(self.KEYS)
+
+    @property
+    def size(self) -> int:
+        return RECORD_OVERHEAD + sys.getsizeof(self.message_text)
+
+class ChatBuffer:
+    """Последние сообщения одной группы в порядке записи (по id).
+
+    covered_since - граница, начиная с которой в буфере есть все сообщения
+    группы: окна, начинающиеся не раньше неё, отдаются из памяти.
+    """
+
+    __slots__ = ('messages', 'ids', 'bytes', 'covered_since', 'warm')
+
+    def __init__(self, covered_since: int):
+        self.messages: Deque[HotMessage] = deque()
+        self.ids = set()
+        self.bytes = 0
+        self.covered_since = covered_since
+        self.warm = False
+
+    def append(self, message: HotMessage):
+        if message.id in self.ids:
+            return
+        self.messages.append(message)
+        self.ids.add(message.id)
+        self.bytes += message.size
+
+    def trim(self, max_messages: int, max_bytes: int):
+        while self.messages and (len(self.messages) > max_messages or self.bytes > max_bytes):
+            evicted = self.messages.popleft()
+            self.ids.discard(evicted.id)
+            self.bytes -= evicted.size
+            # Вытесненное сообщение могло быть позже оставшихся - граница сдвигается за него
+            self.covered_since = max(self.covered_since, evicted.ts + 1)
+
+class HotBuffer:
+    """Кольцевые буферы последних сообщений по группам.
+
+    Заполняется слушателем конвейера приёма и отдаёт окна "последние N",
+    "N часов" и "сегодня" без обращения к SQLite, если окно целиком
+    помещается в буфер. Иначе запрос уходит в базу; при первом обращении к
+    группе буфер дозаполняется из базы. Размер буфера ограничен числом
+    сообщений и памятью на группу, число групп - LRU.
+    """
+
+    def __init__(self, db: Database, max_messages: int = HOT_BUFFER_SIZE,
+                 max_bytes: int = HOT_BUFFER_MAX_BYTES, max_chats: int = HOT_BUFFER_MAX_CHATS):
+        self.db = db
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[int, ChatBuffer]" = OrderedDict()
+        self._warming: Dict[int, asyncio.Future] = {}
+        # В процессе-исполнителе новые сообщения приходят только по его группам:
+        # буфер чужой группы устарел бы, поэтому её окна читаются из базы
+        self.owns: Optional[Callable[[int], bool]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _buffer(self, chat_id: int, covered_since: int) -> ChatBuffer:
+        buffer = self._chats.get(chat_id)
+        if buffer is None:
+            buffer = self._chats[chat_id] = ChatBuffer(covered_since)
+            while len(self._chats) > self.max_chats:
+                evicted_id, _ = self._chats.popitem(last=False)
+                HOT_BUFFER_BYTES.remove(evicted_id)
+        else:
+            self._chats.move_to_end(chat_id)
+        return buffer
+
+    def _add(self, chat_id: int, buffer: ChatBuffer, rows: Sequence[Tuple], ids: Sequence[int]):
+        for (_, chat_title, user_id, username, message_text, ts), message_id in zip(rows, ids):
+            if username is not None:
+                username = sys.intern(username)
+            buffer.append(HotMessage(message_id, chat_title, user_id, username, message_text, ts))
+        buffer.trim(self.max_messages, self.max_bytes)
+        HOT_BUFFER_BYTES.set(buffer.bytes, chat_id)
+
+    def on_flush(self, rows: List[Tuple], ids: List[int]):
+        """Слушатель конвейера приёма: новые сообщения попадают в буфер группы"""
+        by_chat: Dict[int, Tuple[List[Tuple], List[int]]] = {}
+        for row, message_id in zip(rows, ids):
+            chat_rows, chat_ids = by_chat.setdefault(row[0], ([], []))
+            chat_rows.append(row)
+            chat_ids.append(message_id)
+        # Сообщения, записанные до появления буфера, в нём отсутствуют
+        now = int(time.time()) + 1
+        for chat_id, (chat_rows, chat_ids) in by_chat.items():
+            self._add(chat_id, self._buffer(chat_id, now), chat_rows, chat_ids)
+
+    async def warm(self, chat_id: int):
+        """Загрузка последних сообщений группы из базы (один раз на группу)"""
+        buffer = self._chats.get(chat_id)
+        if buffer is not None and buffer.warm:
+            return
+        pending = self._warming.get(chat_id)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._warming[chat_id] = future
+        try:
+            loaded = await self.db.load_recent_messages(chat_id, self.max_messages)
+            buffer = self._buffer(chat_id, int(time.time()) + 1)
+            fresh = list(buffer.messages)
+            buffer.messages.clear()
+            buffer.ids.clear()
+            buffer.bytes = 0
+            # В группе меньше сообщений, чем вмещает буфер, - загружены все;
+            # иначе из сообщений с самым ранним ts могли загрузиться не все
+            buffer.covered_since = min(msg['ts'] for msg in loaded) + 1 if len(loaded) >= self.max_messages else 0
+            for msg in loaded:
+                username = sys.intern(msg['username']) if msg['username'] is not None else None
+                buffer.append(HotMessage(msg['id'], msg['chat_title'], msg['user_id'], username,
+                                         msg['message_text'], msg['ts']))
+            # Сообщения, пришедшие во время чтения из базы, идут после загруженных
+            for message in fresh:
+                buffer.append(message)
+            buffer.trim(self.max_messages, self.max_bytes)
+            HOT_BUFFER_BYTES.set(buffer.bytes, chat_id)
+            buffer.warm = True
+            future.set_result(None)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке буфера группы {chat_id}: {e}")
+            future.set_result(None)
+        finally:
+            del self._warming[chat_id]
+
+    def recent(self, chat_id: int, limit: int, since_ts: int = 0) -> Optional[List[HotMessage]]:
+        """Последние limit сообщений не раньше since_ts или None, если буфер их не покрывает"""
+        buffer = self._chats.get(chat_id)
+        if buffer is None:
+            return None
+        messages = sorted((msg for msg in buffer.messages if msg.ts >= since_ts),
+                          key=lambda msg: (msg.ts, msg.id))[-limit:]
+        oldest = messages[0].ts if len(messages) == limit else since_ts
+        if oldest < buffer.covered_since:
+            return None
+        return messages
+
+    def window(self, chat_id: int, since_ts: int, until_ts: int) -> Optional[List[HotMessage]]:
+        """Сообщения за [since_ts, until_ts) или None, если окно не помещается в буфер"""
+        buffer = self._chats.get(chat_id)
+        if buffer is None or since_ts < buffer.covered_since:
+            return None
+        return sorted((msg for msg in buffer.messages if since_ts <= msg.ts < until_ts),
+                      key=lambda msg: (msg.ts, msg.id))
+
+    def _count(self, result: Optional[List]) -> bool:
+        if result is None:
+            self.misses += 1
+            HOT_BUFFER_HITS.inc("miss")
+            return False
+        self.hits += 1
+        HOT_BUFFER_HITS.inc("hit")
+        return True
+
+    # Те же методы, что у Database, с чтением из буфера, когда это возможно
+
+    async def get_recent_messages(self, chat_id: int, limit: int = 200,
+                                  hours: Optional[int] = None) -> List:
+        since_ts = int(time.time()) - hours * 3600 if hours else 0
+        if self.owns is not None and not self.owns(chat_id):
+            return await self.db.get_recent_messages(chat_id, limit, hours)
+        await self.warm(chat_id)
+        result = self.recent(chat_id, limit, since_ts)
+        if self._count(result):
+            return result
+        return await self.db.get_recent_messages(chat_id, limit, hours)
+
+    async def get_today_messages(self, chat_id: int) -> List:
+        return await self.get_window_messages(chat_id, *day_bounds(datetime.now(LOCAL_TZ).date()))
+
+    async def get_window_messages(self, chat_id: int, since_ts: int, until_ts: int,
+                                  skip_ids: Optional[Tuple[int, int]] = None) -> List:
+        if self.owns is not None and not self.owns(chat_id):
+            return await self.db.get_window_messages(chat_id, since_ts, until_ts, skip_ids)
+        await self.warm(chat_id)
+        result = self.window(chat_id, since_ts, until_ts)
+        if not self._count(result):
+            return await self.db.get_window_messages(chat_id, since_ts, until_ts, skip_ids)
+        if skip_ids is not None:
+            result = [msg for msg in result if msg.id < skip_ids[0] or msg.id > skip_ids[1]]
+        return result
+
+    def memory_report(self) -> Dict[str, Any]:
+        """Расход памяти буферов: всего и по группам"""
+        chats = {chat_id: {'messages': len(buffer.messages), 'bytes': buffer.bytes}
+                 for chat_id, buffer in self._chats.items()}
+        return {
+            'chats': len(chats),
+            'messages': sum(chat['messages'] for chat in chats.values()),
+            'bytes': sum(chat['bytes'] for chat in chats.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'per_chat': chats,
+        }
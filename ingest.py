@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+from config import (INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL, INGEST_MAX_RETRIES,
+                    INGEST_RETRY_DELAY)
+from db import Database
+from metrics import INGEST_DROPPED, INGEST_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+class MessageIngestor:
+    """Конвейер отложенной записи сообщений в базу данных.
+
+    Сообщения складываются в ограниченную очередь и записываются пакетами:
+    когда набирается batch_size сообщений или проходит flush_interval секунд.
+    Если очередь переполнена, submit ждёт освобождения места (backpressure).
+    Пакет, который не удалось записать, повторяется до max_retries раз с
+    удваивающейся паузой (очередь тем временем заполняется и притормаживает
+    submit); только после этого сообщения теряются (dropped, INGEST_DROPPED).
+    Слушатели (add_listener) получают каждый записанный пакет вместе с id сообщений.
+    """
+
+    def __init__(self, db: Database, queue_size: int = INGEST_QUEUE_SIZE,
+                 batch_size: int = INGEST_BATCH_SIZE,
+                 flush_interval: float = INGEST_FLUSH_INTERVAL, max_retries: int = INGEST_MAX_RETRIES,
+                 retry_delay: float = INGEST_RETRY_DELAY):
+        self.db = db
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._listeners: List[Callable[[List[Tuple], List[int]], None]] = []
+
+    def add_listener(self, listener: Callable[[List[Tuple], List[int]], None]):
+        """Подписка на записанные пакеты: listener(rows, ids)"""
+        self._listeners.append(listener)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        """Количество сообщений, ожидающих записи"""
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """Запуск фоновой задачи записи"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info("Конвейер приёма сообщений запущен")
+
+    async def stop(self):
+        """Остановка с записью всех накопленных сообщений"""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        logger.info("Конвейер приёма сообщений остановлен")
+
+    async def submit(self, chat_id: int, chat_title: str, user_id: int,
+                     username: str, message_text: str,
+                     date: Optional[datetime] = None):
+        """Постановка сообщения в очередь на запись"""
+        row = (chat_id, chat_title, user_id, username, message_text, _epoch(date))
+
+        if not self.running:
+            # Конвейер не запущен (например, при локальной отладке) - пишем сразу
+            await self._flush([row])
+            return
+
+        await self._queue.put(row)
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._drain()
+        await self._drain()
+
+    async def _drain(self):
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple]):
+        attempt = 0
+        while True:
+            try:
+                ids = await self.db.save_messages_batch(batch)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"Пакет из {len(batch)} сообщений не записан после {attempt + 1} попыток, "
+                                 f"сообщения потеряны: {e}")
+                    self.dropped += len(batch)
+                    INGEST_DROPPED.inc(amount=len(batch))
+                    return
+                delay = self.retry_delay * 2 ** attempt
+                attempt += 1
+                logger.warning(f"Ошибка при записи пакета из {len(batch)} сообщений, "
+                               f"повтор через {delay:.1f} с: {e}")
+                await asyncio.sleep(delay)
+        for row in batch:
+            INGEST_MESSAGES.inc(row[0])
+        for listener in self._listeners:
+            try:
+                listener(batch, ids)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике записанного пакета: {e}")
+
+def _epoch(date: Optional[datetime]) -> int:
+    """Время сообщения в секундах Unix (наивное время считается UTC)"""
+    if date is None:
+        return int(time.time())
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp())
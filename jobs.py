@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from aiogram import Bot
+from config import JOB_WORKERS, JOB_QUEUE_MAX, JOB_MAX_PER_USER
+from db import Database
+from metrics import JOB_WAIT
+from outbound import PRIORITY_INTERACTIVE, PRIORITY_PROGRESS, outbound_priority
+from streaming import MessageStream
+from tracing import trace
+from summary import SummaryService, parse_window
+
+logger = logging.getLogger(__name__)
+
+# chat_id задачи-дайджеста по всем группам пользователя (/summary all)
+DIGEST_CHAT_ID = 0
+
+class SummaryJob:
+    """Задача на пересказ и сообщение, в котором показывается её ход"""
+
+    __slots__ = ('id', 'user_id', 'chat_id', 'window', 'group_title',
+                 'reply_chat_id', 'message_id', 'created_at', 'started_at')
+
+    def __init__(self, user_id: int, chat_id: int, window: str, group_title: Optional[str],
+                 reply_chat_id: int, message_id: int, job_id: Optional[int] = None,
+                 created_at: Optional[float] = None):
+        self.id = job_id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.window = window
+        self.group_title = group_title
+        self.reply_chat_id = reply_chat_id
+        self.message_id = message_id
+        self.created_at = created_at or time.time()
+        self.started_at: Optional[float] = None
+
+    @property
+    def digest(self) -> bool:
+        return self.chat_id == DIGEST_CHAT_ID
+
+    @property
+    def key(self) -> Tuple[int, str]:
+        if self.digest:
+            # Дайджест у каждого пользователя свой: набор групп зависит от него
+            return self.chat_id, f"{self.window}:{self.user_id}"
+        return self.chat_id, self.window
+
+class QueueFullError(Exception):
+    """Очередь задач или лимит пользователя исчерпан"""
+
+class SummaryJobQueue:
+    """Фоновая очередь пересказов.
+
+    Обработчики ставят задачу и сразу отвечают. Пул из workers исполнителей
+    берёт задачи по кругу между пользователями, чтобы один пользователь не
+    занимал всю очередь. Одинаковые задачи (та же группа и период) не
+    дублируются: ожидающие получают результат первой. Задачи хранятся в
+    SQLite и после перезапуска ставятся в очередь заново. Ход работы и
+    пересказ по мере генерации показываются правками сообщения задачи
+    (MessageStream).
+    """
+
+    def __init__(self, db: Database, summary_service: SummaryService, workers: int = JOB_WORKERS,
+                 max_queued: int = JOB_QUEUE_MAX, max_per_user: int = JOB_MAX_PER_USER):
+        self.db = db
+        self.summary_service = summary_service
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.bot: Optional[Bot] = None
+        self._queues: "OrderedDict[int, Deque[SummaryJob]]" = OrderedDict()
+        self._groups: Dict[Tuple[int, str], List[SummaryJob]] = {}
+        self._per_user: Dict[int, int] = {}
+        self._available: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.completed = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+
+    @property
+    def available(self) -> asyncio.Semaphore:
+        if self._available is None:
+            self._available = asyncio.Semaphore(0)
+        return self._available
+
+    @property
+    def depth(self) -> int:
+        """Число задач в очереди (без выполняемых)"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'depth': self.depth,
+            'running': self.running,
+            'completed': self.completed,
+            'last_wait_seconds': round(self.last_wait, 3),
+            'max_wait_seconds': round(self.max_wait, 3),
+            'avg_wait_seconds': round(self.total_wait / self.completed, 3) if self.completed else 0.0,
+        }
+
+    async def start(self, bot: Bot, owns: Optional[Callable[[int], bool]] = None):
+        """Запуск исполнителей и восстановление незавершённых задач.
+
+        owns - для процесса-исполнителя: восстанавливаются только задачи чатов,
+        которые он обслуживает, иначе их подхватили бы все процессы.
+        """
+        self.bot = bot
+        for row in await self.db.get_unfinished_summary_jobs():
+            if owns is not None and not owns(row['reply_chat_id']):
+                continue
+            job = SummaryJob(row['user_id'], row['chat_id'], row['window'], row['group_title'],
+                             row['reply_chat_id'], row['message_id'], row['id'], row['created_at'])
+            self._enqueue(job)
+        if self.depth:
+            logger.info(f"Восстановлено задач на пересказ: {self.depth}")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, user_id: int, chat_id: int, window: str, group_title: Optional[str],
+                     reply_chat_id: int, message_id: int) -> int:
+        """Постановка задачи; возвращает позицию в очереди (0 - уже выполняется такая же)"""
+        if self.depth >= self.max_queued or self._per_user.get(user_id, 0) >= self.max_per_user:
+            raise QueueFullError()
+        job = SummaryJob(user_id, chat_id, window, group_title, reply_chat_id, message_id)
+        job.id = await self.db.create_summary_job(user_id, chat_id, window, group_title,
+                                                  reply_chat_id, message_id)
+        return self._enqueue(job)
+
+    def _enqueue(self, job: SummaryJob) -> int:
+        self._per_user[job.user_id] = self._per_user.get(job.user_id, 0) + 1
+        group = self._groups.get(job.key)
+        if group is not None:
+            # Такой же пересказ уже ждёт или строится - результат получат все
+            group.append(job)
+            return 0
+        self._groups[job.key] = [job]
+        self._queues.setdefault(job.user_id, deque()).append(job)
+        self.available.release()
+        return self.depth
+
+    def _next(self) -> SummaryJob:
+        # Круговой обход пользователей: после задачи пользователь уходит в конец
+        user_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        del self._queues[user_id]
+        if queue:
+            self._queues[user_id] = queue
+        return job
+
+    async def _worker(self):
+        while True:
+            await self.available.acquire()
+            job = self._next()
+            self.running += 1
+            try:
+                # Ход работы уступает в очереди отправки ответам на команды
+                with trace("job:summary", chat_id=job.chat_id, window=job.window), \
+                        outbound_priority(PRIORITY_PROGRESS):
+                    await self._execute(job)
+            except Exception as e:
+                logger.error(f"Ошибка при выполнении задачи {job.id}: {e}")
+            finally:
+                self.running -= 1
+
+    async def _execute(self, job: SummaryJob):
+        job.started_at = time.time()
+        wait = job.started_at - job.created_at
+        self.last_wait = wait
+        self.max_wait = max(self.max_wait, wait)
+        self.total_wait += wait
+        JOB_WAIT.observe(wait)
+        await self.db.mark_summary_job_running(job.id)
+
+        streams: Dict[int, MessageStream] = {}
+
+        def stream(waiting: SummaryJob) -> MessageStream:
+            if waiting.id not in streams:
+                streams[waiting.id] = MessageStream(self.bot, waiting.reply_chat_id, waiting.message_id)
+            return streams[waiting.id]
+
+        async def progress(text: str):
+            # Задачи, присоединившиеся позже, видят текст с очередного обновления
+            for waiting in self._groups.get(job.key, [job]):
+                await stream(waiting).update(text)
+
+        try:
+            window = parse_window(job.window)
+            if job.digest:
+                summary = await self.summary_service.digest(job.user_id, window, progress)
+            else:
+                summary = await self.summary_service.summarize(job.chat_id, window, job.group_title,
+                                                               progress, on_text=progress)
+            text = summary if summary is not None else _empty_text(job.window, job.digest)
+        except Exception as e:
+            logger.error(f"Ошибка при создании пересказа: {e}")
+            text = "❌ Произошла ошибка при создании пересказа"
+
+        group = self._groups.pop(job.key, [job])
+        try:
+            # Готовый пересказ - ответ на команду: он не ждёт за правками с ходом работы
+            with outbound_priority(PRIORITY_INTERACTIVE):
+                for done in group:
+                    try:
+                        await stream(done).finish(text)
+                    except Exception as e:
+                        logger.error(f"Не удалось отправить результат задачи {done.id}: {e}")
+        finally:
+            # Даже при ошибке доставки задача завершена: иначе лимит пользователя
+            # остался бы занят, а после перезапуска задача повторялась бы
+            for done in group:
+                self._per_user[done.user_id] -= 1
+                if not self._per_user[done.user_id]:
+                    del self._per_user[done.user_id]
+            self.completed += 1
+            await self.db.delete_summary_jobs([done.id for done in group])
+
+def _empty_text(window: str, digest: bool = False) -> str:
+    if digest:
+        return f"❌ Нет сообщений за {parse_window(window).title} ни в одной из ваших групп."
+    query = parse_window(window).query
+    if query:
+        return f"❌ Нет сообщений по теме «{query}» за этот период в этой группе."
+    if window == "today":
+        return "❌ Нет сообщений за сегодня в этой группе."
+    if window.endswith('h'):
+        return f"❌ Нет сообщений за последние {window[:-1]} часов в этой группе."
+    return "❌ Нет сообщений для анализа в указанный период."
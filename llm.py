@@ -1,48 +1,259 @@
+import asyncio
+import random
 import openai
 import logging
-from typing import List, Dict
-from config import OPENAI_API_KEY
+import time
+from typing import Any, Awaitable, Callable, List, Dict, Optional
+from config import (OPENAI_API_KEY, OPENAI_BASE_URL, LLM_CONCURRENCY, LLM_TIMEOUT,
+                    LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_STREAMING_ENABLED,
+                    EXTRACTIVE_ENABLED)
+from extract import select_messages
+from metrics import LLM_FIRST_TOKEN, LLM_IN_FLIGHT, LLM_LATENCY, LLM_TOKENS
+from prompt import PromptCompiler
+from routing import ModelRouter
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
+# Большие обсуждения перед сборкой промпта сокращаются локальным отбором сообщений
+PROMPT_COMPILER = PromptCompiler(selector=select_messages if EXTRACTIVE_ENABLED else None)
+
+SYSTEM_PROMPT = "Ты - помощник для создания кратких пересказов обсуждений в Telegram-группах. Отвечай на русском языке."
+
+# Разделы итогового пересказа при объединении частей
+STRUCTURED_TASK = """Создай структурированный пересказ, который включает:
+1. Основные темы обсуждения
+2. Ключевые моменты и решения
+3. Важные вопросы или проблемы
+4. Общий тон и атмосфера обсуждения
+
+Пересказ должен быть на русском языке, лаконичным (не более 300-400 слов) и информативным."""
+
+# Ошибки, после которых запрос имеет смысл повторить: 429, 5xx, таймауты и обрывы соединения
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+)
+
 class LLMService:
-    def __init__(self):
+    """Асинхронный клиент LLM.
+
+    Один экземпляр на процесс (см. get_llm_service): HTTP-соединения
+    переиспользуются, число одновременных запросов ограничено семафором,
+    временные ошибки повторяются с экспоненциальной задержкой и джиттером.
+    transport позволяет подменить HTTP-транспорт (например, в тестах),
+    base_url - направить запросы на локальную заглушку вместо OpenAI.
+    Итоговые пересказы с on_text запрашиваются потоком (streaming), и
+    текст передаётся в on_text по мере генерации. Модель и лимит ответа
+    выбирает router (см. routing.ModelRouter), если модель не указана явно.
+    """
+
+    def __init__(self, api_key: str = OPENAI_API_KEY, base_url: Optional[str] = OPENAI_BASE_URL,
+                 concurrency: int = LLM_CONCURRENCY,
+                 timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX,
+                 streaming: bool = LLM_STREAMING_ENABLED, router: Optional[ModelRouter] = None,
+                 transport: Any = None):
         try:
-            self.client = openai.OpenAI(api_key=OPENAI_API_KEY)
+            http_client = openai.DefaultAsyncHttpxClient(transport=transport) if transport else None
+            # Повторы делаем сами, чтобы они учитывались в семафоре и джиттере
+            self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout,
+                                             max_retries=0, http_client=http_client)
         except Exception as e:
             logger.error(f"Ошибка инициализации OpenAI клиента: {e}")
             raise
-    
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.streaming = streaming
+        self.router = router or ModelRouter()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def close(self):
+        """Закрытие пула HTTP-соединений"""
+        await self.client.close()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """Пауза перед повтором: Retry-After сервера или экспонента с джиттером"""
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    async def chat_completion(self, messages: List[Dict], max_tokens: int = 500,
+                              temperature: float = 0.7, model: Optional[str] = None):
+        """Запрос к chat completions с ограничением параллелизма и повторами"""
+        if model is None:
+            model, max_tokens = self.router.route(messages, max_tokens)
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    return await self._create(messages, max_tokens, temperature, model)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                logger.warning(f"Временная ошибка LLM ({type(e).__name__}), повтор {attempt} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+
+    async def chat_completion_stream(self, messages: List[Dict], on_text: Callable[[str], Awaitable[None]],
+                                     max_tokens: int = 500, temperature: float = 0.7,
+                                     model: Optional[str] = None) -> str:
+        """Потоковый запрос: on_text получает накопленный текст после каждого фрагмента.
+
+        Повторяется только запрос, не успевший вернуть ни одного фрагмента:
+        показанный пользователю текст не начинается заново.
+        """
+        if model is None:
+            model, max_tokens = self.router.route(messages, max_tokens)
+        attempt = 0
+        received = [False]
+        while True:
+            try:
+                async with self.semaphore:
+                    return await self._create_stream(messages, max_tokens, temperature, model,
+                                                     on_text, received)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries or received[0]:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                logger.warning(f"Временная ошибка LLM ({type(e).__name__}), повтор {attempt} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+
+    async def _create_stream(self, messages: List[Dict], max_tokens: int, temperature: float, model: str,
+                             on_text: Callable[[str], Awaitable[None]], received: List[bool]) -> str:
+        self.in_flight += 1
+        LLM_IN_FLIGHT.set(self.in_flight)
+        started = time.perf_counter()
+        outcome = "error"
+        text = ""
+        usage = None
+        with span("llm.stream", model=model) as current:
+            try:
+                stream = await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    if not received[0]:
+                        received[0] = True
+                        first_token = time.perf_counter() - started
+                        LLM_FIRST_TOKEN.observe(first_token, model)
+                        if current is not None:
+                            current.attrs['first_token_ms'] = round(first_token * 1000)
+                    text += delta
+                    await on_text(text)
+                outcome = "ok"
+            finally:
+                self.in_flight -= 1
+                LLM_IN_FLIGHT.set(self.in_flight)
+                elapsed = time.perf_counter() - started
+                LLM_LATENCY.observe(elapsed, model, outcome)
+                self.router.observe(model, elapsed, outcome == "ok")
+            if usage is not None:
+                LLM_TOKENS.inc(model, "prompt", amount=usage.prompt_tokens or 0)
+                LLM_TOKENS.inc(model, "completion", amount=usage.completion_tokens or 0)
+                if current is not None:
+                    current.attrs.update(prompt_tokens=usage.prompt_tokens,
+                                         completion_tokens=usage.completion_tokens)
+        return text
+
+    async def _complete(self, messages: List[Dict], max_tokens: int, temperature: float,
+                        on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """Текст ответа LLM; с on_text и включённым streaming - потоком"""
+        if on_text is not None and self.streaming:
+            text = await self.chat_completion_stream(messages, on_text, max_tokens, temperature)
+            return text.strip()
+        response = await self.chat_completion(messages=messages, max_tokens=max_tokens, temperature=temperature)
+        return response.choices[0].message.content.strip()
+
+    async def _create(self, messages: List[Dict], max_tokens: int, temperature: float, model: str):
+        """Один запрос к API с учётом времени и токенов в метриках"""
+        self.in_flight += 1
+        LLM_IN_FLIGHT.set(self.in_flight)
+        started = time.perf_counter()
+        outcome = "error"
+        with span("llm.request", model=model) as current:
+            try:
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature
+                )
+                outcome = "ok"
+            finally:
+                self.in_flight -= 1
+                LLM_IN_FLIGHT.set(self.in_flight)
+                elapsed = time.perf_counter() - started
+                LLM_LATENCY.observe(elapsed, model, outcome)
+                self.router.observe(model, elapsed, outcome == "ok")
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                LLM_TOKENS.inc(model, "prompt", amount=usage.prompt_tokens or 0)
+                LLM_TOKENS.inc(model, "completion", amount=usage.completion_tokens or 0)
+                if current is not None:
+                    current.attrs.update(prompt_tokens=usage.prompt_tokens,
+                                         completion_tokens=usage.completion_tokens)
+        return response
+
     def format_messages_for_summary(self, messages: List[Dict]) -> str:
         """Форматирование сообщений для отправки в LLM"""
         if not messages:
             return "Нет сообщений для анализа."
-        
-        formatted_text = "Обсуждение в группе:\n\n"
-        
-        for msg in messages:
-            username = msg.get('username', f"User{msg.get('user_id', 'Unknown')}")
-            text = msg.get('message_text', '').strip()
-            timestamp = msg.get('timestamp', '')
-            
-            if text:  # Пропускаем пустые сообщения
-                formatted_text += f"[{timestamp}] {username}: {text}\n\n"
-        
+
+        with span("prompt.compile", messages=len(messages)) as current:
+            formatted_text, report = PROMPT_COMPILER.compile(messages)
+            if current is not None:
+                current.attrs['tokens'] = report.tokens
+                current.attrs['extracted_out'] = report.extracted_out
+        logger.debug(f"Промпт: {report}")
+        if report.selection is not None:
+            logger.debug(f"Отбор сообщений: {report.selection.explain()}")
         return formatted_text
-    
-    async def generate_summary(self, messages: List[Dict], time_period: str = "общее") -> str:
-        """Генерация краткого пересказа обсуждения"""
-        try:
-            if not messages:
-                return "Нет сообщений для анализа в указанный период."
-            
-            formatted_messages = self.format_messages_for_summary(messages)
-            
-            # Подсчитываем количество сообщений и участников
-            unique_users = len(set(msg.get('user_id') for msg in messages))
-            total_messages = len(messages)
-            
-            prompt = f"""
+
+    async def _format(self, messages: List[Dict]) -> str:
+        """format_messages_for_summary в потоке: отбор сообщений большого окна занимает
+        сотни миллисекунд и не должен останавливать цикл событий"""
+        return await asyncio.to_thread(self.format_messages_for_summary, messages)
+
+    async def summarize_messages(self, messages: List[Dict], time_period: str = "общее",
+                                 on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """Пересказ обсуждения без перехвата ошибок (для кэширования результатов)"""
+        formatted_messages = await self._format(messages)
+
+        # Подсчитываем количество сообщений и участников
+        unique_users = len(set(msg.get('user_id') for msg in messages))
+        total_messages = len(messages)
+
+        prompt = f"""
 Ты - помощник для создания кратких пересказов обсуждений в Telegram-группах.
 
 Создай краткий и информативный пересказ обсуждения за {time_period} период.
@@ -62,36 +273,160 @@ class LLMService:
 
 Пересказ должен быть на русском языке, лаконичным (не более 300-400 слов) и информативным.
 """
-            
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Ты - помощник для создания кратких пересказов обсуждений в Telegram-группах. Отвечай на русском языке."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
-            
-            summary = response.choices[0].message.content.strip()
-            
-            # Добавляем статистику в конец
+
+        summary = await self._complete(
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=500,
+            temperature=0.7,
+            on_text=on_text
+        )
+
+        # Добавляем статистику в конец
+        summary += f"\n\n📊 Статистика: {total_messages} сообщений от {unique_users} участников"
+
+        return summary
+
+    async def summarize_chunk(self, messages: List[Dict]) -> str:
+        """Короткий пересказ фрагмента обсуждения для последующего объединения"""
+        formatted_messages = await self._format(messages)
+
+        prompt = f"""
+Перескажи фрагмент обсуждения в Telegram-группе в виде 3-6 коротких пунктов.
+Сохрани темы, принятые решения, открытые вопросы и кто что предложил.
+
+{formatted_messages}
+"""
+
+        response = await self.chat_completion(
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=250,
+            temperature=0.3
+        )
+        return response.choices[0].message.content.strip()
+
+    async def summarize_topic(self, messages: List[Dict]) -> str:
+        """Пересказ одной темы обсуждения: название темы и несколько пунктов"""
+        formatted_messages = await self._format(messages)
+
+        prompt = f"""
+Ниже сообщения одной темы из обсуждения в Telegram-группе.
+В первой строке назови тему (3-6 слов), затем перескажи её в 2-5 коротких пунктах:
+решения, открытые вопросы и кто что предложил.
+
+{formatted_messages}
+"""
+
+        response = await self.chat_completion(
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=250,
+            temperature=0.3
+        )
+        return response.choices[0].message.content.strip()
+
+    async def combine_topics(self, parts: List[str], time_period: str, total_messages: int,
+                             unique_users: int, on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """Объединение пересказов отдельных тем в один структурированный пересказ"""
+        numbered = "\n\n".join(f"Тема {i}:\n{part}" for i, part in enumerate(parts, 1))
+
+        prompt = f"""
+Обсуждение в Telegram-группе за {time_period} период разбито на темы
+(всего {total_messages} сообщений, участников: {unique_users}). Ниже пересказ каждой темы.
+
+{numbered}
+
+{STRUCTURED_TASK}
+"""
+
+        summary = await self._complete(
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=500,
+            temperature=0.7,
+            on_text=on_text
+        )
+        summary += f"\n\n📊 Статистика: {total_messages} сообщений от {unique_users} участников"
+        return summary
+
+    async def combine_summaries(self, parts: List[str], time_period: str, total_messages: int,
+                                unique_users: int, final: bool = True,
+                                on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """Объединение пересказов последовательных фрагментов (шаг reduce)"""
+        numbered = "\n\n".join(f"Фрагмент {i}:\n{part}" for i, part in enumerate(parts, 1))
+
+        if final:
+            task = STRUCTURED_TASK
+        else:
+            task = "Объедини фрагменты в один пересказ из 5-8 пунктов, сохранив хронологию и ключевые решения."
+
+        prompt = f"""
+Ниже пересказы последовательных фрагментов обсуждения в Telegram-группе за {time_period} период
+(всего {total_messages} сообщений, участников: {unique_users}).
+
+{numbered}
+
+{task}
+"""
+
+        summary = await self._complete(
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=500 if final else 300,
+            temperature=0.7 if final else 0.3,
+            on_text=on_text if final else None
+        )
+        if final:
             summary += f"\n\n📊 Статистика: {total_messages} сообщений от {unique_users} участников"
-            
-            return summary
-            
+        return summary
+
+    async def generate_summary(self, messages: List[Dict], time_period: str = "общее") -> str:
+        """Генерация краткого пересказа обсуждения"""
+        try:
+            if not messages:
+                return "Нет сообщений для анализа в указанный период."
+            return await self.summarize_messages(messages, time_period)
         except Exception as e:
             logger.error(f"Ошибка при генерации пересказа: {e}")
             return f"Произошла ошибка при создании пересказа: {str(e)}"
-    
-    async def generate_group_summary(self, messages: List[Dict], group_title: str, 
+
+    async def generate_group_summary(self, messages: List[Dict], group_title: str,
                                    time_period: str = "общее") -> str:
         """Генерация пересказа с указанием группы"""
         summary = await self.generate_summary(messages, time_period)
-        
-        header = f"📋 Пересказ обсуждения в группе «{group_title}»\n"
-        if time_period != "общее":
-            header += f"⏰ Период: {time_period}\n"
-        header += "─" * 50 + "\n\n"
-        
-        return header + summary 
\ No newline at end of file
+        return group_header(group_title, time_period) + summary
+
+def group_header(group_title: str, time_period: str = "общее") -> str:
+    """Заголовок пересказа с названием группы и периодом"""
+    header = f"📋 Пересказ обсуждения в группе «{group_title}»\n"
+    if time_period != "общее":
+        header += f"⏰ Период: {time_period}\n"
+    header += "─" * 50 + "\n\n"
+    return header
+
+_llm_service: Optional[LLMService] = None
+
+def get_llm_service() -> LLMService:
+    """Общий для процесса клиент LLM (создаётся при первом обращении)"""
+    global _llm_service
+    if _llm_service is None:
+        _llm_service = LLMService()
+    return _llm_service
+
+async def close_llm_service():
+    """Закрытие общего клиента при остановке приложения"""
+    global _llm_service
+    if _llm_service is not None:
+        await _llm_service.close()
+        _llm_service = None
@@ -1,11 +1,24 @@
 import asyncio
 import logging
 import os
+import secrets
+import signal
+import time
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import setup_application
 from aiohttp import web
-from config import BOT_TOKEN
-from handlers import router
+from config import (BOT_TOKEN, BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+                    WEBHOOK_MAX_CONCURRENCY, HEALTH_MAX_LAG_MS, ADMIN_TOKEN, DIGEST_SCHEDULE_ENABLED,
+                    BOT_WORKERS)
+from fsm import create_storage
+from handlers import router, ingestor, summarizer, job_queue, retention, digest_scheduler, hot_buffer, db
+from llm import close_llm_service
+from metrics import REGISTRY, DB_PENDING, INGEST_PENDING, JOB_QUEUE, OUTBOUND_WAITING, WEBHOOK_IN_FLIGHT
+from monitoring import LoopLagMonitor
+from outbound import OutboundSender
+from profiler import Profiler, ProfilerBusyError
+from webhook import LimitedRequestHandler
+from workers import WorkerPool, bypass_hot_buffer
 
 # Настройка логирования
 logging.basicConfig(
@@ -18,14 +31,40 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+loop_lag = LoopLagMonitor()
+profiler = Profiler()
+outbound = OutboundSender()
+
+DB_PENDING.set_function(lambda: db.pending_reads, "read")
+DB_PENDING.set_function(lambda: db.pending_writes, "write")
+INGEST_PENDING.set_function(lambda: ingestor.pending)
+JOB_QUEUE.set_function(lambda: job_queue.depth, "queued")
+JOB_QUEUE.set_function(lambda: job_queue.running, "running")
+OUTBOUND_WAITING.set_function(lambda: outbound.stats()['waiting'])
+
 # Веб-сервер для healthcheck
 async def healthcheck(request):
-    """Эндпоинт для healthcheck Railway"""
+    """Эндпоинт для healthcheck Railway: готовность БД и отзывчивость цикла событий"""
+    try:
+        db_ok = await asyncio.wait_for(db.ping(), timeout=2)
+    except asyncio.TimeoutError:
+        db_ok = False
+    lag_ok = loop_lag.last_ms < HEALTH_MAX_LAG_MS
+    healthy = db_ok and lag_ok
     return web.json_response({
-        "status": "healthy",
+        "status": "healthy" if healthy else "unhealthy",
         "service": "telegram-summary-bot",
-        "version": "1.0.0"
-    })
+        "version": "1.0.0",
+        "checks": {
+            "database": db_ok,
+            "event_loop_lag_ms": round(loop_lag.last_ms, 1),
+            "event_loop_ok": lag_ok
+        }
+    }, status=200 if healthy else 503)
+
+async def metrics(request):
+    """Метрики в текстовом формате Prometheus"""
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
 
 async def root(request):
     """Корневой эндпоинт"""
@@ -34,11 +73,45 @@ async def root(request):
         "status": "active"
     })
 
-async def start_web_server():
-    """Запуск веб-сервера"""
+def is_admin_request(request) -> bool:
+    """Проверка токена администратора из заголовка Authorization: Bearer <ADMIN_TOKEN>"""
+    if not ADMIN_TOKEN:
+        return False
+    header = request.headers.get('Authorization', '')
+    return secrets.compare_digest(header.encode(), f"Bearer {ADMIN_TOKEN}".encode())
+
+async def admin_profile(request):
+    """Профилирование на ?seconds=N секунд; ?format=text - отчёт pstats вместо файла .prof"""
+    if not is_admin_request(request):
+        raise web.HTTPNotFound()
+    try:
+        seconds = float(request.query.get('seconds', '10'))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds должно быть числом")
+    try:
+        profile = await profiler.run(seconds)
+    except ProfilerBusyError:
+        raise web.HTTPConflict(text="Профилирование уже запущено")
+
+    if request.query.get('format') == 'text':
+        return web.Response(text=Profiler.report(profile, sort=request.query.get('sort')))
+    filename = f"profile-{int(time.time())}.prof"
+    return web.Response(body=Profiler.dump(profile), content_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+async def start_web_server(bot: Bot = None, dp: Dispatcher = None, webhook_secret: str = None):
+    """Запуск веб-сервера (и приёма webhook, если передан диспетчер)"""
     app = web.Application()
     app.router.add_get('/', root)
     app.router.add_get('/health', healthcheck)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_post('/admin/profile', admin_profile)
+    
+    if dp is not None:
+        handler = LimitedRequestHandler(dp, bot, WEBHOOK_MAX_CONCURRENCY, secret_token=webhook_secret)
+        handler.register(app, path=WEBHOOK_PATH)
+        WEBHOOK_IN_FLIGHT.set_function(lambda: handler.in_flight)
+        setup_application(app, dp, bot=bot)
     
     port = int(os.environ.get('PORT', 8080))
     runner = web.AppRunner(app)
@@ -48,35 +121,101 @@ async def start_web_server():
     logger.info(f"🌐 Веб-сервер запущен на порту {port}")
     return runner
 
-async def start_bot():
-    """Запуск бота"""
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер с хранилищем состояний и обработчиками"""
+    dp = Dispatcher(storage=create_storage(db))
+    dp.include_router(router)
+    return dp
+
+async def start_bot(bot: Bot, dp: Dispatcher):
+    """Запуск бота в режиме long polling"""
     try:
-        bot = Bot(token=BOT_TOKEN)
-        storage = MemoryStorage()
-        dp = Dispatcher(storage=storage)
-        dp.include_router(router)
-        
         logger.info("🤖 Бот запускается...")
+        await bot.delete_webhook()
         await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
 
+async def start_webhook(bot: Bot, dp: Dispatcher, webhook_secret: str):
+    """Регистрация webhook в Telegram и ожидание сигнала остановки"""
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+        secret_token=webhook_secret,
+        max_connections=min(WEBHOOK_MAX_CONCURRENCY, 100),
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"🤖 Бот получает обновления через webhook {WEBHOOK_BASE_URL}{WEBHOOK_PATH}")
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows
+    await stop.wait()
+
 async def main():
     """Основная функция запуска"""
+    web_runner = None
+    pool = None
     try:
-        # Запуск веб-сервера
-        web_runner = await start_web_server()
+        bot = Bot(token=BOT_TOKEN)
+        # Все ответы, правки и удаления идут через общие лимиты отправки
+        bot.session.middleware(outbound)
+        dp = create_dispatcher()
+        webhook_mode = BOT_MODE == "webhook"
+        
+        webhook_secret = WEBHOOK_SECRET
+        if webhook_mode and not webhook_secret:
+            # Без общего секрета несколько экземпляров за балансировщиком не смогут проверять запросы
+            webhook_secret = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET не задан, используется случайный секрет")
+        
+        # Запуск веб-сервера (в режиме webhook он же принимает обновления)
+        web_runner = await start_web_server(bot, dp if webhook_mode else None, webhook_secret)
         
-        # Запуск бота в отдельной задаче
-        bot_task = asyncio.create_task(start_bot())
+        if BOT_WORKERS > 1:
+            # Обновления обрабатывают процессы-исполнители; здесь остаются приём и фоновые задачи
+            pool = WorkerPool(BOT_WORKERS)
+            pool.start()
+            dp.update.outer_middleware(pool)
+            bypass_hot_buffer(hot_buffer)
+        else:
+            # Запуск конвейера записи сообщений и очереди пересказов
+            await ingestor.start()
+            await summarizer.start()
+            await job_queue.start(bot)
+        retention.start()
+        if DIGEST_SCHEDULE_ENABLED:
+            digest_scheduler.start(bot)
+        loop_lag.start()
         
-        # Ждем завершения бота
-        await bot_task
+        if webhook_mode:
+            await start_webhook(bot, dp, webhook_secret)
+        else:
+            # Запуск бота в отдельной задаче и ожидание его завершения
+            bot_task = asyncio.create_task(start_bot(bot, dp))
+            await bot_task
         
     except Exception as e:
         logger.error(f"Ошибка при запуске: {e}")
     finally:
-        logger.info("Приложение остановлено")
+        if web_runner is not None:
+            await web_runner.cleanup()
+        if pool is not None:
+            await pool.stop()
+        # Незавершённые задачи останутся в базе и продолжатся после перезапуска
+        await job_queue.stop()
+        # Записываем накопленные сообщения перед выходом
+        await ingestor.stop()
+        await summarizer.stop()
+        await retention.stop()
+        await digest_scheduler.stop()
+        await loop_lag.stop()
+        await close_llm_service()
+        db.close()
+        logger.info(f"Приложение остановлено (макс. задержка цикла: {loop_lag.max_ms:.0f} мс)")
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,194 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+# Границы корзин гистограмм задержек, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metric:
+    """Общая часть метрик: имя, описание и имена меток"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}"
+                for key, value in self._values.items()]
+
+class Gauge(Metric):
+    """Значение, которое устанавливается явно или считывается функцией при опросе"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+        self._callbacks: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def set_function(self, func: Callable[[], float], *labels):
+        self._callbacks[labels] = func
+
+    def remove(self, *labels):
+        self._values.pop(labels, None)
+        self._callbacks.pop(labels, None)
+
+    def value(self, *labels) -> float:
+        if labels in self._callbacks:
+            return float(self._callbacks[labels]())
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        keys = list(self._values) + [key for key in self._callbacks if key not in self._values]
+        return [f"{self.name}{_format_labels(self.labels, key)} {self.value(*key)}" for key in keys]
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными корзинами: наблюдение - один bisect и два сложения"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: [счётчики корзин..., +Inf], сумма
+        self._series: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    @contextmanager
+    def time(self, *labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labels, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Метрики процесса в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_LATENCY = REGISTRY.histogram("bot_handler_seconds", "Время обработки обновления обработчиком", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+DB_LATENCY = REGISTRY.histogram("bot_db_seconds", "Время вызова метода Database с ожиданием пула", ("method",))
+DB_PENDING = REGISTRY.gauge("bot_db_pending", "Запросы к БД в очереди и в работе", ("pool",))
+LLM_LATENCY = REGISTRY.histogram("bot_llm_seconds", "Время запроса к LLM", ("model", "outcome"))
+LLM_TOKENS = REGISTRY.counter("bot_llm_tokens_total", "Токены LLM по данным usage", ("model", "kind"))
+LLM_IN_FLIGHT = REGISTRY.gauge("bot_llm_in_flight", "Запросы к LLM в работе")
+LLM_FIRST_TOKEN = REGISTRY.histogram("bot_llm_first_token_seconds", "Время до первого фрагмента потокового ответа LLM",
+                                     ("model",))
+INGEST_MESSAGES = REGISTRY.counter("bot_ingest_messages_total", "Записанные сообщения по группам", ("chat_id",))
+INGEST_DROPPED = REGISTRY.counter("bot_ingest_dropped_total", "Сообщения, не записанные после всех повторов")
+INGEST_PENDING = REGISTRY.gauge("bot_ingest_pending", "Сообщения в очереди на запись")
+LOOP_LAG = REGISTRY.histogram("bot_event_loop_lag_seconds", "Задержка цикла событий")
+JOB_QUEUE = REGISTRY.gauge("bot_summary_jobs", "Задачи на пересказ", ("state",))
+JOB_WAIT = REGISTRY.histogram("bot_summary_job_wait_seconds", "Ожидание задачи в очереди до начала работы")
+HOT_BUFFER_BYTES = REGISTRY.gauge("bot_hot_buffer_bytes", "Память буфера последних сообщений группы", ("chat_id",))
+HOT_BUFFER_HITS = REGISTRY.counter("bot_hot_buffer_reads_total", "Чтения окна из буфера (hit) и из БД (miss)", ("result",))
+WEBHOOK_IN_FLIGHT = REGISTRY.gauge("bot_webhook_in_flight", "Обновления из webhook в обработке")
+OUTBOUND_WAIT = REGISTRY.histogram("bot_outbound_wait_seconds", "Ожидание лимитов отправки в Telegram", ("priority",))
+OUTBOUND_WAITING = REGISTRY.gauge("bot_outbound_waiting", "Запросы к Telegram, ожидающие лимитов отправки")
+OUTBOUND_EVENTS = REGISTRY.counter("bot_outbound_events_total", "Запросы к Telegram: отправлены, слиты, RetryAfter", ("event",))
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Гистограмма времени работы каждого обработчика роутера"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
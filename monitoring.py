@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Optional
+from config import LOOP_LAG_INTERVAL, LOOP_LAG_WARN_MS
+from metrics import LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+class LoopLagMonitor:
+    """Измерение задержки цикла событий.
+
+    Задача засыпает на interval секунд и смотрит, насколько позже она
+    проснулась. Любой блокирующий вызов в обработчиках сразу виден как рост lag.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, warn_ms: float = LOOP_LAG_WARN_MS):
+        self.interval = interval
+        self.warn_ms = warn_ms
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = 0
+        self.total_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.samples if self.samples else 0.0
+
+    def reset(self):
+        """Сброс накопленной статистики"""
+        self.last_ms = self.max_ms = self.total_ms = 0.0
+        self.samples = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def record(self, lag_ms: float):
+        self.last_ms = lag_ms
+        self.max_ms = max(self.max_ms, lag_ms)
+        self.total_ms += lag_ms
+        self.samples += 1
+        LOOP_LAG.observe(lag_ms / 1000)
+        if lag_ms > self.warn_ms:
+            logger.warning(f"Цикл событий заблокирован на {lag_ms:.0f} мс")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, (loop.time() - started - self.interval) * 1000))
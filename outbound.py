@@ -0,0 +1,302 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from config import (OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_CHAT_BURST,
+                    OUTBOUND_MAX_RETRIES)
+from metrics import OUTBOUND_EVENTS, OUTBOUND_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты отправки: меньше - раньше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PROGRESS = 1
+
+# Методы, на которые распространяются лимиты Telegram на отправку в чат
+LIMITED_PREFIXES = ("Send", "Edit", "Delete", "Copy", "Forward")
+
+# Столько простаивающих чатов можно держать, прежде чем их вёдра будут удалены
+MAX_IDLE_CHATS = 10000
+
+_priority: ContextVar[int] = ContextVar('outbound_priority', default=PRIORITY_INTERACTIVE)
+
+@contextmanager
+def outbound_priority(priority: int) -> Iterator[None]:
+    """Приоритет запросов к Telegram внутри блока (и созданных в нём задач)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    """rate запросов в секунду и не больше capacity подряд; pause() запрещает запросы до срока"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд можно будет сделать запрос"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        return self.delay(time.monotonic()) == 0 and self.tokens >= self.capacity
+
+class PriorityGate:
+    """Ожидающие одного ведра выпускаются по приоритету, при равном - по порядку прихода"""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int, seq: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, seq, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._pump())
+        try:
+            await future
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    def promote(self, seq: int, priority: int):
+        """Повышение приоритета ожидающего запроса seq (если он ещё ждёт здесь)"""
+        for i, (current, waiting_seq, future) in enumerate(self._waiters):
+            if waiting_seq == seq:
+                if priority < current:
+                    self._waiters[i] = (priority, seq, future)
+                    heapq.heapify(self._waiters)
+                return
+
+    async def _pump(self):
+        while self._waiters:
+            delay = self.bucket.delay(time.monotonic())
+            if delay > 0:
+                # Пока ждём, может прийти запрос с более высоким приоритетом - выбор после паузы
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.bucket.take()
+            future.set_result(None)
+
+class _MessageEdits:
+    """Правки одного сообщения, ещё не отправленные в Telegram.
+
+    priority - наивысший приоритет среди ожидающих вызовов, seq - номер
+    очереди, в которой сейчас ждёт отправка.
+    """
+
+    __slots__ = ('method', 'waiters', 'task', 'priority', 'seq')
+
+    def __init__(self):
+        self.method: Optional[EditMessageText] = None
+        self.waiters: List[asyncio.Future] = []
+        self.task: Optional[asyncio.Task] = None
+        self.priority: Optional[int] = None
+        self.seq: Optional[int] = None
+
+class OutboundSender(BaseRequestMiddleware):
+    """Центральная отправка запросов к Telegram (middleware сессии бота).
+
+    Все отправки, правки и удаления сообщений проходят через общее ведро
+    токенов (global_rate в секунду) и ведро своего чата (chat_rate для
+    личных чатов, group_rate для групп). Ожидающие выпускаются по
+    приоритету: ответы пользователю раньше правок с ходом работы (см.
+    outbound_priority). Правки одного сообщения отправляются по одной;
+    правка, не успевшая уйти, заменяется более новой, и оба вызова получают
+    один ответ; слитая правка ждёт с наивысшим из их приоритетов. После RetryAfter чат ставится на паузу на retry_after
+    секунд, запрос повторяется до max_retries раз.
+    """
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, chat_rate: float = OUTBOUND_CHAT_RATE,
+                 group_rate: float = OUTBOUND_GROUP_RATE, chat_burst: int = OUTBOUND_CHAT_BURST,
+                 max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.global_gate = PriorityGate(TokenBucket(global_rate, max(1.0, global_rate)))
+        self._chats: Dict[Union[int, str], PriorityGate] = {}
+        self._edits: Dict[Tuple[Union[int, str], int], _MessageEdits] = {}
+        self._seq = itertools.count()
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None or not type(method).__name__.startswith(LIMITED_PREFIXES):
+            return await make_request(bot, method)
+        priority = _priority.get()
+        if isinstance(method, EditMessageText) and method.message_id is not None:
+            return await self._edit(make_request, bot, method, chat_id, priority)
+        return await self._send(make_request, bot, method, chat_id, priority)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+            'waiting': len(self.global_gate) + sum(len(gate) for gate in self._chats.values()),
+            'chats': len(self._chats),
+        }
+
+    def _gate(self, chat_id: Union[int, str]) -> PriorityGate:
+        gate = self._chats.get(chat_id)
+        if gate is None:
+            if len(self._chats) >= MAX_IDLE_CHATS:
+                self._chats = {key: value for key, value in self._chats.items()
+                               if len(value) or not value.bucket.idle}
+            # Группы и каналы имеют отрицательные id (или @username)
+            group = not isinstance(chat_id, int) or chat_id < 0
+            rate = self.group_rate if group else self.chat_rate
+            gate = self._chats[chat_id] = PriorityGate(TokenBucket(rate, self.chat_burst))
+        return gate
+
+    async def _acquire(self, chat_id: Union[int, str], priority: int, edits: Optional[_MessageEdits] = None):
+        """Ожидание очереди чата и общей очереди. Приоритет правки edits может
+        быть повышен, пока она ждёт (см. _edit)"""
+        started = time.perf_counter()
+        seq = next(self._seq)
+        if edits is not None:
+            edits.seq = seq
+        try:
+            await self._gate(chat_id).acquire(priority, seq)
+            if edits is not None and edits.priority is not None:
+                priority = min(priority, edits.priority)
+            await self.global_gate.acquire(priority, seq)
+        finally:
+            if edits is not None:
+                edits.seq = None
+        OUTBOUND_WAIT.observe(time.perf_counter() - started, "interactive" if priority == PRIORITY_INTERACTIVE
+                              else "progress")
+
+    def _retry_after(self, chat_id: Union[int, str], error: TelegramRetryAfter):
+        self._gate(chat_id).bucket.pause(error.retry_after)
+        self.retried += 1
+        OUTBOUND_EVENTS.inc("retry_after")
+        logger.warning(f"Telegram ограничил отправку в чат {chat_id}, пауза {error.retry_after} с")
+
+    async def _send(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                    method: TelegramMethod[TelegramType], chat_id: Union[int, str],
+                    priority: int) -> Response[TelegramType]:
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._retry_after(chat_id, e)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                continue
+            self.sent += 1
+            OUTBOUND_EVENTS.inc("sent")
+            return response
+
+    async def _edit(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                    method: EditMessageText, chat_id: Union[int, str], priority: int) -> Response[TelegramType]:
+        key = (chat_id, method.message_id)
+        edits = self._edits.get(key)
+        if edits is None:
+            edits = self._edits[key] = _MessageEdits()
+        elif edits.method is not None:
+            # Прежняя правка ещё не ушла - она уже не нужна
+            self.coalesced += 1
+            OUTBOUND_EVENTS.inc("coalesced")
+        edits.method = method
+        if edits.priority is None or priority < edits.priority:
+            edits.priority = priority
+            if edits.seq is not None:
+                # Итоговая правка не должна ждать с приоритетом хода работы
+                self._gate(chat_id).promote(edits.seq, priority)
+                self.global_gate.promote(edits.seq, priority)
+        future = asyncio.get_running_loop().create_future()
+        edits.waiters.append(future)
+        if edits.task is None:
+            edits.task = asyncio.create_task(self._edit_worker(make_request, bot, key, edits))
+        return await asyncio.shield(future)
+
+    async def _edit_worker(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                           key: Tuple[Union[int, str], int], edits: _MessageEdits):
+        """Отправка правок сообщения по одной; за время ожидания копится только последняя.
+        Правка отправляется с наивысшим приоритетом среди слитых в неё вызовов"""
+        chat_id = key[0]
+        try:
+            while edits.method is not None:
+                waiters: List[asyncio.Future] = []
+                method: Optional[EditMessageText] = None
+                priority = edits.priority
+                attempt = 0
+                while True:
+                    if edits.priority is not None:
+                        priority = min(priority, edits.priority)
+                    await self._acquire(chat_id, priority, edits)
+                    # Правки, пришедшие за время ожидания, заменяют отправляемую
+                    if edits.method is not None:
+                        method, edits.method = edits.method, None
+                        waiters += edits.waiters
+                        edits.waiters = []
+                        priority = min(priority, edits.priority)
+                        edits.priority = None
+                    try:
+                        result: Any = await make_request(bot, method)
+                    except TelegramRetryAfter as e:
+                        self._retry_after(chat_id, e)
+                        if attempt < self.max_retries:
+                            attempt += 1
+                            continue
+                        result = e
+                    except Exception as e:
+                        result = e
+                    break
+                if not isinstance(result, Exception):
+                    self.sent += 1
+                    OUTBOUND_EVENTS.inc("sent")
+                for waiter in waiters:
+                    if waiter.done():
+                        continue
+                    if isinstance(result, Exception):
+                        waiter.set_exception(result)
+                    else:
+                        waiter.set_result(result)
+        finally:
+            if self._edits.get(key) is edits:
+                del self._edits[key]
+            for waiter in edits.waiters:
+                if not waiter.done():
+                    waiter.cancel()
@@ -0,0 +1,758 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import asyncpg
+from config import DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE
+from db import (Database, LOCAL_TZ, MESSAGE_COLUMNS, SNIPPET_TOKENS, batch_counters, day_bounds,
+                deleted_counters, format_ts, _chunk_from_row, _message_from_row)
+from metrics import DB_LATENCY
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Колонки messages, которые пишет COPY (search_vector вычисляется сервером)
+COPY_COLUMNS = ('id', 'chat_id', 'chat_title', 'user_id', 'username', 'message_text', 'ts')
+
+# Параметры ts_headline: фрагмент с найденными словами в «кавычках», как snippet() в SQLite
+HEADLINE_OPTIONS = (f"StartSel=«, StopSel=», MaxWords={SNIPPET_TOKENS}, MinWords={SNIPPET_TOKENS // 2}, "
+                    "MaxFragments=1, FragmentDelimiter=…")
+
+# Ключ advisory-блокировки для миграций и создания секций: процессы-исполнители
+# стартуют одновременно и не должны менять схему параллельно
+SCHEMA_LOCK = 7340211
+
+PARTITION_RE = re.compile(r"^messages_p(\d{4})(\d{2})$")
+FTS_TERM_RE = re.compile(r'"((?:[^"]|"")*)"(\*?)')
+
+class PostgresDatabase(Database):
+    """Хранилище в PostgreSQL с тем же интерфейсом, что у Database.
+
+    Публичные методы наследуются от Database: меняются только способ
+    выполнения (_read и _write берут соединение из пула asyncpg, запись -
+    в транзакции) и сами запросы. Таблица messages секционирована по
+    месяцам (ts); секции создаются при первой записи в месяц, опустевшие
+    после архивации удаляются вместо VACUUM. Пакеты сообщений пишутся
+    через COPY. Полнотекстовый поиск - tsvector с GIN-индексом.
+
+    Пул создаётся при первом запросе, тогда же применяются миграции.
+    """
+
+    def __init__(self, url: str, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE):
+        self.url = url
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool: Optional[asyncpg.Pool] = None
+        self._pool_lock: Optional[asyncio.Lock] = None
+        self._partitions: Set[str] = set()
+        self.pending_reads = 0
+        self.pending_writes = 0
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._pool is not None:
+            return self._pool
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self._pool is None:
+                pool = await asyncpg.create_pool(self.url, min_size=self.min_size, max_size=self.max_size)
+                async with pool.acquire() as conn:
+                    await self._migrate(conn)
+                self._pool = pool
+        return self._pool
+
+    async def _read(self, func: Callable, *args) -> Any:
+        """Выполнение await func(conn, *args) на соединении из пула"""
+        name = func.__name__.lstrip('_')
+        started = time.perf_counter()
+        self.pending_reads += 1
+        try:
+            with span(f"db.{name}"):
+                async with (await self._get_pool()).acquire() as conn:
+                    return await func(conn, *args)
+        finally:
+            self.pending_reads -= 1
+            DB_LATENCY.observe(time.perf_counter() - started, name)
+
+    async def _write(self, func: Callable, *args) -> Any:
+        """Выполнение await func(conn, *args) одной транзакцией"""
+        name = func.__name__.lstrip('_')
+        started = time.perf_counter()
+        self.pending_writes += 1
+        try:
+            with span(f"db.{name}"):
+                async with (await self._get_pool()).acquire() as conn:
+                    async with conn.transaction():
+                        return await func(conn, *args)
+        finally:
+            self.pending_writes -= 1
+            DB_LATENCY.observe(time.perf_counter() - started, name)
+
+    def close(self):
+        """Закрытие соединений пула (вызывается после остановки всех задач)"""
+        if self._pool is not None:
+            try:
+                self._pool.terminate()
+            except RuntimeError:
+                # Цикл событий пула уже закрыт: соединения закроет сервер
+                pass
+            self._pool = None
+
+    def init_database(self):
+        """Схема создаётся при первом запросе, см. _migrate"""
+
+    async def _migrate(self, conn: asyncpg.Connection):
+        async with conn.transaction():
+            # Блокировка берётся до создания таблицы версий: иначе параллельно
+            # стартующие процессы столкнулись бы на CREATE TABLE IF NOT EXISTS
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK)
+            await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            version = await conn.fetchval("SELECT MAX(version) FROM schema_version") or 0
+            for target, migration in PG_MIGRATIONS:
+                if target <= version:
+                    continue
+                logger.info(f"Применение миграции схемы PostgreSQL {target}: {migration.__doc__}")
+                await migration(conn)
+                await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", target)
+                version = target
+        logger.info(f"База данных PostgreSQL инициализирована (версия схемы {version})")
+
+    @staticmethod
+    async def _ping(conn: asyncpg.Connection) -> bool:
+        return await conn.fetchval("SELECT 1") == 1
+
+    # Запись сообщений
+
+    async def save_message(self, chat_id: int, chat_title: str, user_id: int,
+                           username: str, message_text: str):
+        """Сохранение сообщения в базу данных"""
+        try:
+            await self.save_messages_batch([(chat_id, chat_title, user_id, username, message_text,
+                                             int(time.time()))])
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении сообщения: {e}")
+
+    async def save_messages_batch(self, rows: List[Tuple]) -> List[int]:
+        if not rows:
+            return []
+        await self._ensure_partitions(rows)
+        try:
+            return await self._write(self._save_messages_batch, rows)
+        except asyncpg.CheckViolationError:
+            # Секцию удалил другой процесс (incremental_vacuum) после того, как она попала в кэш
+            self._partitions.clear()
+            await self._ensure_partitions(rows)
+            return await self._write(self._save_messages_batch, rows)
+
+    async def _ensure_partitions(self, rows: List[Tuple]):
+        # Секции нужны до COPY; уже созданные в этом процессе не проверяются повторно
+        missing = {_partition(row[5])[0] for row in rows} - self._partitions
+        if missing:
+            await self._write(_create_partitions, [row[5] for row in rows])
+            self._partitions |= missing
+
+    @staticmethod
+    async def _save_messages_batch(conn: asyncpg.Connection, rows: List[Tuple]) -> List[int]:
+        groups, members = batch_counters(rows)
+        # id выдаются заранее: COPY не возвращает значения по умолчанию
+        ids = sorted(row[0] for row in await conn.fetch(
+            "SELECT nextval('messages_id_seq') FROM generate_series(1, $1)", len(rows)))
+        await conn.copy_records_to_table('messages', columns=COPY_COLUMNS,
+                                         records=[(message_id, *row) for message_id, row in zip(ids, rows)])
+        await conn.executemany('''
+            INSERT INTO groups (chat_id, chat_title, last_activity, message_count)
+            VALUES ($1, $2, to_timestamp($3) AT TIME ZONE 'UTC', $4)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                chat_title = excluded.chat_title,
+                last_activity = GREATEST(groups.last_activity, excluded.last_activity),
+                message_count = groups.message_count + excluded.message_count
+        ''', groups)
+        await conn.executemany('''
+            INSERT INTO user_chats (user_id, chat_id, message_count, last_seen)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (user_id, chat_id) DO UPDATE SET
+                message_count = user_chats.message_count + excluded.message_count,
+                last_seen = GREATEST(COALESCE(user_chats.last_seen, 0), excluded.last_seen)
+        ''', members)
+        return ids
+
+    # Чтение сообщений
+
+    @staticmethod
+    async def _get_user_groups(conn: asyncpg.Connection, user_id: int) -> List[Dict]:
+        rows = await conn.fetch('''
+            SELECT g.chat_id, g.chat_title, to_char(g.last_activity, 'YYYY-MM-DD HH24:MI:SS'), g.message_count
+            FROM user_chats uc
+            JOIN groups g ON g.chat_id = uc.chat_id
+            WHERE uc.user_id = $1
+            ORDER BY g.last_activity DESC
+        ''', user_id)
+        return [{
+            'chat_id': row[0],
+            'chat_title': row[1],
+            'last_activity': row[2],
+            'message_count': row[3]
+        } for row in rows]
+
+    @staticmethod
+    async def _get_recent_messages(conn: asyncpg.Connection, chat_id: int, limit: int,
+                                   hours: Optional[int]) -> List[Dict]:
+        since = int(time.time()) - hours * 3600 if hours else None
+        rows = await conn.fetch(f'''
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE chat_id = $1 AND ($2::bigint IS NULL OR ts >= $2)
+            ORDER BY ts DESC
+            LIMIT $3
+        ''', chat_id, since, limit)
+        return [_message_from_row(row) for row in reversed(rows)]
+
+    @staticmethod
+    async def _get_today_messages(conn: asyncpg.Connection, chat_id: int) -> List[Dict]:
+        start, end = day_bounds(datetime.now(LOCAL_TZ).date())
+        return await PostgresDatabase._get_window_messages(conn, chat_id, start, end, None)
+
+    @staticmethod
+    async def _get_chat_ids(conn: asyncpg.Connection) -> List[int]:
+        return [row[0] for row in await conn.fetch("SELECT chat_id FROM groups")]
+
+    @staticmethod
+    async def _get_window_stats(conn: asyncpg.Connection, chat_ids: List[int], since_ts: int,
+                                until_ts: int) -> Dict[int, Dict]:
+        rows = await conn.fetch('''
+            SELECT chat_id, COUNT(*), MAX(id)
+            FROM messages
+            WHERE chat_id = ANY($1::bigint[]) AND ts >= $2 AND ts < $3
+            GROUP BY chat_id
+        ''', chat_ids, since_ts, until_ts)
+        return {row[0]: {'message_count': row[1], 'max_message_id': row[2]} for row in rows}
+
+    @staticmethod
+    async def _get_window_messages(conn: asyncpg.Connection, chat_id: int, since_ts: int, until_ts: int,
+                                   skip_ids: Optional[Tuple[int, int]]) -> List[Dict]:
+        if skip_ids is None:
+            skip_ids = (0, -1)
+        rows = await conn.fetch(f'''
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE chat_id = $1 AND ts >= $2 AND ts < $3 AND (id < $4 OR id > $5)
+            ORDER BY ts ASC, id ASC
+        ''', chat_id, since_ts, until_ts, skip_ids[0], skip_ids[1])
+        return [_message_from_row(row) for row in rows]
+
+    @staticmethod
+    async def _get_chats_window_messages(conn: asyncpg.Connection, chat_ids: List[int], since_ts: int,
+                                         until_ts: int, skip_ids: Dict[int, Tuple[int, int]]) -> Dict[int, List[Dict]]:
+        ranges = [skip_ids.get(chat_id, (0, -1)) for chat_id in chat_ids]
+        rows = await conn.fetch('''
+            SELECT m.chat_id, m.id, m.chat_title, m.user_id, m.username, m.message_text, m.ts
+            FROM unnest($1::bigint[], $2::bigint[], $3::bigint[]) AS s (chat_id, low, high)
+            JOIN messages m ON m.chat_id = s.chat_id AND m.ts >= $4 AND m.ts < $5
+            WHERE m.id < s.low OR m.id > s.high
+            ORDER BY m.chat_id, m.ts ASC, m.id ASC
+        ''', chat_ids, [low for low, _ in ranges], [high for _, high in ranges], since_ts, until_ts)
+        messages: Dict[int, List[Dict]] = {}
+        for row in rows:
+            messages.setdefault(row[0], []).append(_message_from_row(row[1:]))
+        return messages
+
+    @staticmethod
+    async def _get_messages_after(conn: asyncpg.Connection, chat_id: int, after_id: int,
+                                  since_ts: int, limit: int) -> List[Dict]:
+        rows = await conn.fetch(f'''
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE chat_id = $1 AND ts >= $2 AND id > $3
+            ORDER BY id ASC
+            LIMIT $4
+        ''', chat_id, since_ts, after_id, limit)
+        return [_message_from_row(row) for row in rows]
+
+    @staticmethod
+    async def _get_messages_before(conn: asyncpg.Connection, chat_id: int, before_ts: int,
+                                   limit: int) -> List[Dict]:
+        rows = await conn.fetch(f'''
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE chat_id = $1 AND ts < $2
+            ORDER BY ts ASC, id ASC
+            LIMIT $3
+        ''', chat_id, before_ts, limit)
+        return [_message_from_row(row) for row in rows]
+
+    @staticmethod
+    async def _delete_messages(conn: asyncpg.Connection, message_ids: List[int]):
+        counts = await conn.fetch('''
+            WITH deleted AS (DELETE FROM messages WHERE id = ANY($1::bigint[]) RETURNING chat_id, user_id)
+            SELECT chat_id, user_id, COUNT(*) FROM deleted GROUP BY chat_id, user_id
+        ''', message_ids)
+        groups, members = deleted_counters([tuple(row) for row in counts])
+        await conn.executemany("UPDATE groups SET message_count = GREATEST(0, message_count - $1) WHERE chat_id = $2",
+                               [(count, chat_id) for chat_id, count in groups])
+        await conn.executemany('''
+            UPDATE user_chats SET message_count = GREATEST(0, message_count - $1)
+            WHERE user_id = $2 AND chat_id = $3
+        ''', [(count, user_id, chat_id) for user_id, chat_id, count in members])
+
+    # Поиск
+
+    @staticmethod
+    async def _search_messages(conn: asyncpg.Connection, chat_ids: List[int], match: str, limit: int,
+                               offset: int) -> List[Dict]:
+        rows = await conn.fetch(f'''
+            SELECT m.id, m.chat_id, m.chat_title, m.username, m.ts,
+                   ts_headline('simple', {_search_text('m.message_text')}, q, $5)
+            FROM messages m, to_tsquery('simple', $2) q
+            WHERE m.chat_id = ANY($1::bigint[]) AND m.search_vector @@ q
+            ORDER BY ts_rank(m.search_vector, q) DESC, m.id DESC
+            LIMIT $3 OFFSET $4
+        ''', chat_ids, fts_to_tsquery(match), limit, offset, HEADLINE_OPTIONS)
+        return [{
+            'id': row[0],
+            'chat_id': row[1],
+            'chat_title': row[2],
+            'username': row[3],
+            'ts': row[4],
+            'timestamp': format_ts(row[4]),
+            'snippet': row[5]
+        } for row in rows]
+
+    @staticmethod
+    async def _search_window_messages(conn: asyncpg.Connection, chat_id: int, match: str,
+                                      since_ts: Optional[int], until_ts: Optional[int],
+                                      limit: int) -> List[Dict]:
+        rows = await conn.fetch(f'''
+            SELECT {MESSAGE_COLUMNS}
+            FROM messages
+            WHERE chat_id = $1 AND search_vector @@ to_tsquery('simple', $2)
+              AND ($3::bigint IS NULL OR ts >= $3) AND ($4::bigint IS NULL OR ts < $4)
+            ORDER BY id DESC
+            LIMIT $5
+        ''', chat_id, fts_to_tsquery(match), since_ts, until_ts, limit)
+        return [_message_from_row(row) for row in reversed(rows)]
+
+    # Кэш и фрагменты пересказов
+
+    @staticmethod
+    async def _get_cached_summary(conn: asyncpg.Connection, key: str,
+                                  now: float) -> Optional[Tuple[str, float]]:
+        row = await conn.fetchrow('''
+            SELECT summary, expires_at FROM summary_cache
+            WHERE cache_key = $1 AND expires_at > $2
+        ''', key, now)
+        return (row[0], row[1]) if row else None
+
+    @staticmethod
+    async def _save_cached_summary(conn: asyncpg.Connection, key: str, chat_id: int,
+                                   summary: str, expires_at: float):
+        await conn.execute("DELETE FROM summary_cache WHERE expires_at <= $1", time.time())
+        await conn.execute('''
+            INSERT INTO summary_cache (cache_key, chat_id, summary, created_at, expires_at)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                chat_id = excluded.chat_id, summary = excluded.summary,
+                created_at = excluded.created_at, expires_at = excluded.expires_at
+        ''', key, chat_id, summary, time.time(), expires_at)
+
+    @staticmethod
+    async def _delete_expired_summaries(conn: asyncpg.Connection, now: float) -> int:
+        return _rowcount(await conn.execute("DELETE FROM summary_cache WHERE expires_at <= $1", now))
+
+    @staticmethod
+    async def _get_last_chunk(conn: asyncpg.Connection, chat_id: int) -> Tuple[int, int]:
+        row = await conn.fetchrow('''
+            SELECT last_message_id, start_ts FROM chunk_summaries
+            WHERE chat_id = $1
+            ORDER BY last_message_id DESC
+            LIMIT 1
+        ''', chat_id)
+        return (row[0], row[1]) if row else (0, 0)
+
+    @staticmethod
+    async def _save_chunk_summary(conn: asyncpg.Connection, chat_id: int, messages: List[Dict],
+                                  summary: str):
+        user_ids = sorted({msg['user_id'] for msg in messages if msg.get('user_id') is not None})
+        await conn.execute('''
+            INSERT INTO chunk_summaries
+                (chat_id, first_message_id, last_message_id, start_ts, end_ts,
+                 message_count, user_ids, summary, created_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            ON CONFLICT (chat_id, first_message_id) DO UPDATE SET
+                last_message_id = excluded.last_message_id, start_ts = excluded.start_ts,
+                end_ts = excluded.end_ts, message_count = excluded.message_count,
+                user_ids = excluded.user_ids, summary = excluded.summary, created_at = excluded.created_at
+        ''', chat_id, messages[0]['id'], messages[-1]['id'],
+            min(msg['ts'] for msg in messages), max(msg['ts'] for msg in messages),
+            len(messages), ",".join(map(str, user_ids)), summary, int(time.time()))
+
+    @staticmethod
+    async def _delete_chunk_summaries(conn: asyncpg.Connection, chat_id: int):
+        await conn.execute("DELETE FROM chunk_summaries WHERE chat_id = $1", chat_id)
+
+    @staticmethod
+    async def _get_chunk_summaries(conn: asyncpg.Connection, chat_id: int, since_ts: int,
+                                   until_ts: int) -> List[Dict]:
+        rows = await conn.fetch('''
+            SELECT first_message_id, last_message_id, start_ts, end_ts,
+                   message_count, user_ids, summary
+            FROM chunk_summaries
+            WHERE chat_id = $1 AND start_ts >= $2 AND end_ts < $3
+            ORDER BY first_message_id ASC
+        ''', chat_id, since_ts, until_ts)
+        return [_chunk_from_row(row) for row in rows]
+
+    @staticmethod
+    async def _get_chats_chunk_summaries(conn: asyncpg.Connection, chat_ids: List[int], since_ts: int,
+                                         until_ts: int) -> Dict[int, List[Dict]]:
+        rows = await conn.fetch('''
+            SELECT chat_id, first_message_id, last_message_id, start_ts, end_ts,
+                   message_count, user_ids, summary
+            FROM chunk_summaries
+            WHERE chat_id = ANY($1::bigint[]) AND start_ts >= $2 AND end_ts < $3
+            ORDER BY chat_id, first_message_id ASC
+        ''', chat_ids, since_ts, until_ts)
+        chunks: Dict[int, List[Dict]] = {}
+        for row in rows:
+            chunks.setdefault(row[0], []).append(_chunk_from_row(row[1:]))
+        return chunks
+
+    # Очередь задач
+
+    @staticmethod
+    async def _create_summary_job(conn: asyncpg.Connection, user_id: int, chat_id: int, window: str,
+                                  group_title: Optional[str], reply_chat_id: int, message_id: int) -> int:
+        return await conn.fetchval('''
+            INSERT INTO summary_jobs (user_id, chat_id, "window", group_title, reply_chat_id,
+                                      message_id, status, created_at)
+            VALUES ($1, $2, $3, $4, $5, $6, 'queued', $7)
+            RETURNING id
+        ''', user_id, chat_id, window, group_title, reply_chat_id, message_id, time.time())
+
+    @staticmethod
+    async def _mark_summary_job_running(conn: asyncpg.Connection, job_id: int):
+        await conn.execute("UPDATE summary_jobs SET status = 'running', started_at = $1 WHERE id = $2",
+                           time.time(), job_id)
+
+    @staticmethod
+    async def _delete_summary_jobs(conn: asyncpg.Connection, job_ids: List[int]):
+        await conn.execute("DELETE FROM summary_jobs WHERE id = ANY($1::bigint[])", job_ids)
+
+    @staticmethod
+    async def _get_unfinished_summary_jobs(conn: asyncpg.Connection) -> List[Dict]:
+        rows = await conn.fetch('''
+            SELECT id, user_id, chat_id, "window", group_title, reply_chat_id, message_id, created_at
+            FROM summary_jobs
+            ORDER BY id ASC
+        ''')
+        return [{
+            'id': row[0],
+            'user_id': row[1],
+            'chat_id': row[2],
+            'window': row[3],
+            'group_title': row[4],
+            'reply_chat_id': row[5],
+            'message_id': row[6],
+            'created_at': row[7]
+        } for row in rows]
+
+    # Хранение
+
+    async def incremental_vacuum(self) -> int:
+        """Удаление пустых секций messages за прошедшие месяцы; возвращает их число.
+
+        Место в PostgreSQL возвращает autovacuum, а секция, из которой
+        архивация перенесла все сообщения, удаляется целиком.
+        """
+        dropped = await self._write(self._drop_empty_partitions, _partition(int(time.time()))[1])
+        self._partitions -= set(dropped)
+        return len(dropped)
+
+    @staticmethod
+    async def _drop_empty_partitions(conn: asyncpg.Connection, current_start: int) -> List[str]:
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK)
+        dropped = []
+        for name in await _partition_names(conn):
+            if _partition_bounds(name)[1] > current_start:
+                continue
+            if await conn.fetchval(f"SELECT EXISTS (SELECT 1 FROM {name})"):
+                continue
+            await conn.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+        if dropped:
+            logger.info(f"Удалены пустые секции сообщений: {', '.join(dropped)}")
+        return dropped
+
+    @staticmethod
+    async def _get_retention_policies(conn: asyncpg.Connection) -> Dict[int, int]:
+        return {row[0]: row[1] for row in await conn.fetch("SELECT chat_id, days FROM retention_policies")}
+
+    @staticmethod
+    async def _set_retention_days(conn: asyncpg.Connection, chat_id: int, days: Optional[int]):
+        if days is None:
+            await conn.execute("DELETE FROM retention_policies WHERE chat_id = $1", chat_id)
+        else:
+            await conn.execute('''
+                INSERT INTO retention_policies (chat_id, days) VALUES ($1, $2)
+                ON CONFLICT (chat_id) DO UPDATE SET days = excluded.days
+            ''', chat_id, days)
+
+    # Пересказы по расписанию
+
+    @staticmethod
+    async def _get_active_chat_ids(conn: asyncpg.Connection, since_ts: int) -> List[int]:
+        rows = await conn.fetch('''
+            SELECT chat_id FROM groups
+            WHERE last_activity >= to_timestamp($1) AT TIME ZONE 'UTC'
+            ORDER BY last_activity DESC
+        ''', since_ts)
+        return [row[0] for row in rows]
+
+    @staticmethod
+    async def _get_precomputed_summary(conn: asyncpg.Connection, chat_id: int, day: str) -> Optional[Dict]:
+        row = await conn.fetchrow('''
+            SELECT chat_title, last_message_id, message_count, summary, created_at
+            FROM precomputed_summaries
+            WHERE chat_id = $1 AND day = $2
+        ''', chat_id, day)
+        if row is None:
+            return None
+        return {
+            'chat_title': row[0],
+            'last_message_id': row[1],
+            'message_count': row[2],
+            'summary': row[3],
+            'created_at': row[4]
+        }
+
+    @staticmethod
+    async def _save_precomputed_summary(conn: asyncpg.Connection, chat_id: int, day: str,
+                                        chat_title: Optional[str], last_message_id: int,
+                                        message_count: int, summary: str):
+        await conn.execute('''
+            INSERT INTO precomputed_summaries
+                (chat_id, day, chat_title, last_message_id, message_count, summary, created_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (chat_id, day) DO UPDATE SET
+                chat_title = excluded.chat_title, last_message_id = excluded.last_message_id,
+                message_count = excluded.message_count, summary = excluded.summary,
+                created_at = excluded.created_at
+        ''', chat_id, day, chat_title, last_message_id, message_count, summary, time.time())
+
+    @staticmethod
+    async def _delete_precomputed_summaries_before(conn: asyncpg.Connection, day: str) -> int:
+        return _rowcount(await conn.execute("DELETE FROM precomputed_summaries WHERE day < $1", day))
+
+    @staticmethod
+    async def _get_digest_subscriptions(conn: asyncpg.Connection) -> Dict[int, Optional[str]]:
+        rows = await conn.fetch("SELECT chat_id, last_pushed_day FROM digest_subscriptions")
+        return {row[0]: row[1] for row in rows}
+
+    @staticmethod
+    async def _set_digest_subscription(conn: asyncpg.Connection, chat_id: int, enabled: bool):
+        if enabled:
+            await conn.execute("INSERT INTO digest_subscriptions (chat_id) VALUES ($1) ON CONFLICT DO NOTHING",
+                               chat_id)
+        else:
+            await conn.execute("DELETE FROM digest_subscriptions WHERE chat_id = $1", chat_id)
+
+    @staticmethod
+    async def _mark_digest_pushed(conn: asyncpg.Connection, chat_id: int, day: str):
+        await conn.execute("UPDATE digest_subscriptions SET last_pushed_day = $1 WHERE chat_id = $2",
+                           day, chat_id)
+
+    # Состояния FSM
+
+    @staticmethod
+    async def _get_fsm_record(conn: asyncpg.Connection, key: str) -> Tuple[Optional[str], Dict]:
+        row = await conn.fetchrow("SELECT state, data FROM fsm_states WHERE key = $1", key)
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    @staticmethod
+    async def _set_fsm_state(conn: asyncpg.Connection, key: str, state: Optional[str]):
+        await conn.execute('''
+            INSERT INTO fsm_states (key, state, updated_at) VALUES ($1, $2, $3)
+            ON CONFLICT (key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        ''', key, state, time.time())
+        await conn.execute("DELETE FROM fsm_states WHERE key = $1 AND state IS NULL AND data = '{}'", key)
+
+    @staticmethod
+    async def _set_fsm_data(conn: asyncpg.Connection, key: str, data: str):
+        await conn.execute('''
+            INSERT INTO fsm_states (key, data, updated_at) VALUES ($1, $2, $3)
+            ON CONFLICT (key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        ''', key, data, time.time())
+        await conn.execute("DELETE FROM fsm_states WHERE key = $1 AND state IS NULL AND data = '{}'", key)
+
+    @staticmethod
+    async def _delete_fsm_states_before(conn: asyncpg.Connection, updated_before: float) -> int:
+        return _rowcount(await conn.execute("DELETE FROM fsm_states WHERE updated_at < $1", updated_before))
+
+def fts_to_tsquery(match: str) -> str:
+    """Запрос FTS5 из search.build_match_query в синтаксисе to_tsquery: "деплой"* AND "база" -> 'деплой':* & 'база'"""
+    terms = []
+    for text, prefix in FTS_TERM_RE.findall(match):
+        lexeme = text.replace('""', '"').replace("\\", "\\\\").replace("'", "''")
+        terms.append(f"'{lexeme}'" + (":*" if prefix else ""))
+    return " & ".join(terms)
+
+def _search_text(column: str) -> str:
+    # "ё" и "е" не различаются, как в индексе SQLite
+    return f"replace(replace(COALESCE({column}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+def _rowcount(status: str) -> int:
+    """Число строк из статуса команды asyncpg ("DELETE 3")"""
+    return int(status.split()[-1])
+
+def _partition(ts: int) -> Tuple[str, int, int]:
+    """(имя секции, начало, конец) месяца UTC, в который попадает ts"""
+    moment = datetime.fromtimestamp(ts, timezone.utc)
+    start = datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+    end = datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return f"messages_p{moment.year:04d}{moment.month:02d}", int(start.timestamp()), int(end.timestamp())
+
+def _partition_bounds(name: str) -> Tuple[int, int]:
+    year, month = PARTITION_RE.match(name).groups()
+    _, start, end = _partition(int(datetime(int(year), int(month), 1, tzinfo=timezone.utc).timestamp()))
+    return start, end
+
+async def _partition_names(conn: asyncpg.Connection) -> List[str]:
+    rows = await conn.fetch('''
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+        ORDER BY c.relname
+    ''')
+    return [row[0] for row in rows if PARTITION_RE.match(row[0])]
+
+async def _create_partitions(conn: asyncpg.Connection, timestamps: List[int]):
+    """Создание месячных секций messages для ts пакета"""
+    await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK)
+    for name, start, end in sorted({_partition(ts) for ts in timestamps}):
+        # Имя и границы вычислены из чисел, поэтому подстановка в DDL безопасна
+        await conn.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages "
+                           f"FOR VALUES FROM ({start}) TO ({end})")
+
+# Миграции схемы PostgreSQL. Применённые версии хранятся в schema_version;
+# миграции выполняются в одной транзакции под advisory-блокировкой.
+
+async def _pg_migration_base_schema(conn: asyncpg.Connection):
+    """таблицы бота с секционированием messages по месяцам"""
+    await conn.execute("CREATE SEQUENCE IF NOT EXISTS messages_id_seq")
+    # Первичный ключ секционированной таблицы обязан включать ключ секционирования
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS messages (
+            id BIGINT NOT NULL DEFAULT nextval('messages_id_seq'),
+            chat_id BIGINT NOT NULL,
+            chat_title TEXT,
+            user_id BIGINT,
+            username TEXT,
+            message_text TEXT,
+            ts BIGINT NOT NULL,
+            search_vector tsvector GENERATED ALWAYS AS
+                (to_tsvector('simple', {_search_text('message_text')})) STORED,
+            PRIMARY KEY (id, ts)
+        ) PARTITION BY RANGE (ts)
+    ''')
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_ts ON messages (chat_id, ts)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (search_vector)")
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS groups (
+            chat_id BIGINT PRIMARY KEY,
+            chat_title TEXT,
+            member_count INTEGER,
+            last_activity TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
+            message_count BIGINT NOT NULL DEFAULT 0
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_chats (
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            message_count BIGINT NOT NULL DEFAULT 0,
+            last_seen BIGINT,
+            PRIMARY KEY (user_id, chat_id)
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS summary_cache (
+            cache_key TEXT PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at DOUBLE PRECISION NOT NULL,
+            expires_at DOUBLE PRECISION NOT NULL
+        )
+    ''')
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_summary_cache_expires ON summary_cache (expires_at)")
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS chunk_summaries (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            first_message_id BIGINT NOT NULL,
+            last_message_id BIGINT NOT NULL,
+            start_ts BIGINT NOT NULL,
+            end_ts BIGINT NOT NULL,
+            message_count INTEGER NOT NULL,
+            user_ids TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at BIGINT NOT NULL,
+            UNIQUE (chat_id, first_message_id)
+        )
+    ''')
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_summaries_chat_start ON chunk_summaries (chat_id, start_ts)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_summaries_chat_last ON chunk_summaries (chat_id, last_message_id)")
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS summary_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            "window" TEXT NOT NULL,
+            group_title TEXT,
+            reply_chat_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            status TEXT NOT NULL,
+            created_at DOUBLE PRECISION NOT NULL,
+            started_at DOUBLE PRECISION
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS retention_policies (
+            chat_id BIGINT PRIMARY KEY,
+            days INTEGER NOT NULL
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS precomputed_summaries (
+            chat_id BIGINT NOT NULL,
+            day TEXT NOT NULL,
+            chat_title TEXT,
+            last_message_id BIGINT NOT NULL,
+            message_count INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            created_at DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (chat_id, day)
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS digest_subscriptions (
+            chat_id BIGINT PRIMARY KEY,
+            last_pushed_day TEXT
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at DOUBLE PRECISION NOT NULL
+        )
+    ''')
+
+PG_MIGRATIONS = [
+    (1, _pg_migration_base_schema),
+]
@@ -0,0 +1,60 @@
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+from typing import Optional
+from config import PROFILE_MAX_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class ProfilerBusyError(Exception):
+    """Профилирование уже запущено"""
+
+class Profiler:
+    """Профилирование цикла событий по запросу.
+
+    cProfile включается на seconds секунд в потоке цикла событий, где
+    выполняются обработчики. Одновременно идёт только один сеанс, длительность
+    ограничена max_seconds, поэтому включать его можно и в продакшене.
+    """
+
+    def __init__(self, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def run(self, seconds: float) -> cProfile.Profile:
+        if self._running:
+            raise ProfilerBusyError()
+        seconds = max(0.1, min(seconds, self.max_seconds))
+        self._running = True
+        profile = cProfile.Profile()
+        logger.info(f"Профилирование запущено на {seconds:.0f} с")
+        try:
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+        finally:
+            self._running = False
+        profile.create_stats()
+        return profile
+
+    @staticmethod
+    def dump(profile: cProfile.Profile) -> bytes:
+        """Статистика в формате .prof (pstats, snakeviz)"""
+        return marshal.dumps(profile.stats)
+
+    @staticmethod
+    def report(profile: cProfile.Profile, limit: int = 60, sort: Optional[str] = None) -> str:
+        """Текстовый отчёт pstats, отсортированный по суммарному времени"""
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats(sort or "cumulative").print_stats(limit)
+        return stream.getvalue()
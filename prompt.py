@@ -0,0 +1,182 @@
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import PROMPT_TOKEN_BUDGET, PROMPT_MAX_MESSAGE_CHARS, PROMPT_COLLAPSE_SECONDS
+from db import LOCAL_TZ
+
+# Сообщения без содержания: реакции, короткие согласия, одиночные ссылки и эмодзи
+NOISE_RE = re.compile(
+    r"^(?:\+\d*|-1|ок|окей|ok|okay|да|нет|ага|угу|спс|спасибо|thx|thanks|лол|lol|\)+|\(+|\.+)$"
+)
+LINK_RE = re.compile(r"^(?:https?://|www\.)\S+$")
+SYMBOLS_RE = re.compile(r"^[\W_]+$")
+SPACES_RE = re.compile(r"\s+")
+
+# Доля бюджета для отобранных сообщений; остальное - заголовок и псевдонимы
+SELECTION_SHARE = 0.85
+
+def estimate_tokens(text: str) -> int:
+    """Грубая локальная оценка числа токенов.
+
+    Для BPE-словарей OpenAI латиница даёт ~4 байта UTF-8 на токен,
+    кириллица (2 байта на символ) - примерно столько же, поэтому
+    считаем по длине в байтах.
+    """
+    return len(text.encode('utf-8')) // 4 + 1
+
+def is_noise(text: str) -> bool:
+    """Стикеры, "+1", одиночные эмодзи и ссылки без подписи"""
+    lowered = text.lower().strip(" !.")
+    return bool(not lowered or NOISE_RE.match(lowered) or LINK_RE.match(lowered)
+                or SYMBOLS_RE.match(lowered))
+
+class PromptReport:
+    """Что компилятор сделал с обсуждением, чтобы уложиться в бюджет"""
+
+    def __init__(self):
+        self.input_messages = 0
+        self.noise = 0
+        self.duplicates = 0
+        self.collapsed = 0
+        self.truncated = 0
+        self.dropped_for_budget = 0
+        self.extracted_out = 0
+        self.lines = 0
+        self.tokens = 0
+        self.raw_tokens = 0
+        # Результат предварительного отбора (extract.Selection), если он был
+        self.selection: Any = None
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: value for name, value in vars(self).items() if isinstance(value, int)}
+
+    def __str__(self) -> str:
+        return (f"{self.input_messages} сообщ. -> {self.lines} строк, ~{self.tokens} токенов "
+                f"(без сжатия ~{self.raw_tokens}); шум: {self.noise}, повторы: {self.duplicates}, "
+                f"склеено: {self.collapsed}, обрезано: {self.truncated}, "
+                f"отсеяно отбором: {self.extracted_out}, снято по бюджету: {self.dropped_for_budget}")
+
+class PromptCompiler:
+    """Компактное представление обсуждения для LLM.
+
+    За один проход по сообщениям: отбрасывает шум и повторы, склеивает
+    подряд идущие сообщения одного автора, заменяет время на смещение в
+    минутах от начала обсуждения, а имена - на короткие псевдонимы.
+    Если результат не помещается в token_budget, длинные сообщения
+    обрезаются, затем строки равномерно прореживаются. С selector
+    (см. extract.select_messages) слишком большое обсуждение сначала
+    сокращается до самых информативных сообщений.
+    """
+
+    def __init__(self, token_budget: int = PROMPT_TOKEN_BUDGET,
+                 max_message_chars: int = PROMPT_MAX_MESSAGE_CHARS,
+                 collapse_seconds: int = PROMPT_COLLAPSE_SECONDS,
+                 selector: Optional[Callable[[List[Dict], int], Any]] = None):
+        self.token_budget = token_budget
+        self.max_message_chars = max_message_chars
+        self.collapse_seconds = collapse_seconds
+        self.selector = selector
+
+    def compile(self, messages: List[Dict]) -> Tuple[str, PromptReport]:
+        report = PromptReport()
+        report.input_messages = len(messages)
+
+        if self.selector is not None:
+            estimate = sum(estimate_tokens(msg.get('message_text') or '') for msg in messages)
+            if estimate > self.token_budget:
+                # Часть бюджета оставляем на заголовок со списком участников
+                report.selection = self.selector(messages, int(self.token_budget * SELECTION_SHARE))
+                report.extracted_out = len(messages) - len(report.selection.messages)
+                messages = report.selection.messages
+
+        aliases: Dict[str, str] = {}
+        seen = set()
+        # Строка: [начало в секундах, псевдоним, тексты, время последнего сообщения]
+        lines: List[list] = []
+        start_ts: Optional[int] = None
+        raw_bytes = 0
+
+        for msg in messages:
+            text = (msg.get('message_text') or '').strip()
+            username = msg.get('username') or f"User{msg.get('user_id', 'Unknown')}"
+            raw_bytes += len(text.encode('utf-8')) + len(username) + 24
+
+            if not text or is_noise(text):
+                report.noise += 1
+                continue
+            text = SPACES_RE.sub(' ', text)
+            fingerprint = text.lower()
+            if fingerprint in seen:
+                report.duplicates += 1
+                continue
+            seen.add(fingerprint)
+
+            if len(text) > self.max_message_chars:
+                text = text[:self.max_message_chars].rstrip() + "…"
+                report.truncated += 1
+
+            alias = aliases.get(username)
+            if alias is None:
+                alias = aliases[username] = f"U{len(aliases) + 1}"
+
+            ts = msg.get('ts')
+            if ts is None:
+                ts = start_ts or 0
+            if start_ts is None:
+                start_ts = ts
+
+            last = lines[-1] if lines else None
+            if last is not None and last[1] == alias and ts - last[3] <= self.collapse_seconds:
+                last[2].append(text)
+                last[3] = ts
+                report.collapsed += 1
+            else:
+                lines.append([ts, alias, [text], ts])
+
+        report.raw_tokens = raw_bytes // 4 + 1
+        if not lines:
+            return "Нет сообщений для анализа.", report
+
+        header = self._header(start_ts, aliases)
+        rendered = [f"[+{(line[0] - start_ts) // 60}] {line[1]}: {' / '.join(line[2])}" for line in lines]
+        rendered = self._fit_budget(header, rendered, report)
+
+        text = header + "\n".join(rendered)
+        report.lines = len(rendered)
+        report.tokens = estimate_tokens(text)
+        return text, report
+
+    @staticmethod
+    def _header(start_ts: int, aliases: Dict[str, str]) -> str:
+        started = datetime.fromtimestamp(start_ts, LOCAL_TZ).strftime('%Y-%m-%d %H:%M') if start_ts else ""
+        legend = ", ".join(f"{alias}={name}" for name, alias in aliases.items())
+        return (f"Обсуждение в группе (начало {started}, [+N] - минуты от начала).\n"
+                f"Участники: {legend}\n\n")
+
+    def _fit_budget(self, header: str, rendered: List[str], report: PromptReport) -> List[str]:
+        budget = self.token_budget - estimate_tokens(header)
+        costs = [estimate_tokens(line) for line in rendered]
+        total = sum(costs)
+        if total <= budget:
+            return rendered
+
+        # Равномерно прореживаем строки, сохраняя начало и конец обсуждения
+        keep_ratio = budget / total
+        kept = []
+        acc = 0.0
+        used = 0
+        for i, (line, cost) in enumerate(zip(rendered, costs)):
+            acc += keep_ratio
+            last = i == len(rendered) - 1
+            if (acc >= 1.0 or i == 0 or last) and used + cost <= budget:
+                kept.append(line)
+                used += cost
+                acc -= 1.0
+        report.dropped_for_budget = len(rendered) - len(kept)
+        return kept
+
+_default_compiler = PromptCompiler()
+
+def compile_prompt(messages: List[Dict]) -> Tuple[str, PromptReport]:
+    """Компиляция обсуждения компилятором с настройками по умолчанию"""
+    return _default_compiler.compile(messages)
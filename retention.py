@@ -0,0 +1,176 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from config import RETENTION_DAYS, RETENTION_INTERVAL, RETENTION_BATCH_SIZE, ARCHIVE_DIR, FSM_STATE_TTL
+from db import Database, format_ts
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_RE = re.compile(r"^(\d{4})-(\d{2})\.jsonl\.gz$")
+ARCHIVE_FIELDS = ('id', 'chat_title', 'user_id', 'username', 'message_text', 'ts')
+
+class MessageArchive:
+    """Холодный архив сообщений.
+
+    Сообщения группы раскладываются по сегментам - по одному сжатому
+    gzip-файлу JSON Lines на календарный месяц (UTC):
+    <root>/<chat_id>/<YYYY-MM>.jsonl.gz. Новые порции дописываются в
+    сегмент отдельным gzip-блоком, поэтому файл не переписывается целиком.
+    """
+
+    def __init__(self, root: str = ARCHIVE_DIR):
+        self.root = root
+
+    def segment_path(self, chat_id: int, month: str) -> str:
+        return os.path.join(self.root, str(chat_id), f"{month}.jsonl.gz")
+
+    @staticmethod
+    def month_of(ts: int) -> str:
+        return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m')
+
+    @staticmethod
+    def month_bounds(month: str) -> Tuple[int, int]:
+        """Границы месяца [начало, конец) в секундах Unix"""
+        year, number = int(month[:4]), int(month[5:7])
+        start = datetime(year, number, 1, tzinfo=timezone.utc)
+        end = datetime(year + number // 12, number % 12 + 1, 1, tzinfo=timezone.utc)
+        return int(start.timestamp()), int(end.timestamp())
+
+    def append(self, chat_id: int, messages: List[Dict]) -> int:
+        """Запись сообщений в сегменты (блокирующая); данные сбрасываются на диск"""
+        by_month: Dict[str, List[Dict]] = {}
+        for msg in messages:
+            by_month.setdefault(self.month_of(msg['ts']), []).append(msg)
+
+        os.makedirs(os.path.join(self.root, str(chat_id)), exist_ok=True)
+        for month, batch in by_month.items():
+            payload = "".join(
+                json.dumps({field: msg.get(field) for field in ARCHIVE_FIELDS}, ensure_ascii=False) + "\n"
+                for msg in batch
+            ).encode('utf-8')
+            with open(self.segment_path(chat_id, month), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as segment:
+                    segment.write(payload)
+                raw.flush()
+                os.fsync(raw.fileno())
+        return len(messages)
+
+    def segments(self, chat_id: int, since_ts: int, until_ts: int) -> List[str]:
+        """Месяцы группы в архиве, пересекающиеся с [since_ts, until_ts)"""
+        directory = os.path.join(self.root, str(chat_id))
+        if not os.path.isdir(directory):
+            return []
+        months = []
+        for name in os.listdir(directory):
+            match = SEGMENT_RE.match(name)
+            if not match:
+                continue
+            month = f"{match.group(1)}-{match.group(2)}"
+            start, end = self.month_bounds(month)
+            if start < until_ts and end > since_ts:
+                months.append(month)
+        return sorted(months)
+
+    def read_segment(self, chat_id: int, month: str, since_ts: int, until_ts: int) -> List[Dict]:
+        """Сообщения сегмента за [since_ts, until_ts) в хронологическом порядке (блокирующее)"""
+        messages = {}
+        with gzip.open(self.segment_path(chat_id, month), 'rt', encoding='utf-8') as segment:
+            for line in segment:
+                msg = json.loads(line)
+                if since_ts <= msg['ts'] < until_ts:
+                    # Повтор возможен, если процесс упал между записью в архив и удалением из БД
+                    messages[msg['id']] = msg
+        result = sorted(messages.values(), key=lambda msg: (msg['ts'], msg['id']))
+        for msg in result:
+            msg['timestamp'] = format_ts(msg['ts'])
+        return result
+
+    async def iter_messages(self, chat_id: int, since_ts: int, until_ts: int) -> AsyncIterator[List[Dict]]:
+        """Чтение архива за окно по одному сегменту, не блокируя цикл событий"""
+        for month in self.segments(chat_id, since_ts, until_ts):
+            batch = await asyncio.to_thread(self.read_segment, chat_id, month, since_ts, until_ts)
+            if batch:
+                yield batch
+
+    async def get_messages(self, chat_id: int, since_ts: int, until_ts: int) -> List[Dict]:
+        messages = []
+        async for batch in self.iter_messages(chat_id, since_ts, until_ts):
+            messages.extend(batch)
+        return messages
+
+class RetentionManager:
+    """Перенос старых сообщений в архив и сжатие горячей БД.
+
+    Раз в interval секунд для каждой группы сообщения старше её срока
+    хранения (retention_policies или default_days) переносятся в архив
+    порциями по batch_size: сначала запись в сегмент, затем удаление из
+    БД. После прохода освобождённые страницы возвращаются incremental
+    VACUUM, чтобы горячая БД оставалась в пределах кэша страниц.
+    """
+
+    def __init__(self, db: Database, archive: Optional[MessageArchive] = None,
+                 default_days: int = RETENTION_DAYS, interval: float = RETENTION_INTERVAL,
+                 batch_size: int = RETENTION_BATCH_SIZE):
+        self.db = db
+        self.archive = archive or MessageArchive()
+        self.default_days = default_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.archived = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка при архивации сообщений: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[float] = None) -> int:
+        """Один проход по всем группам; возвращает число перенесённых сообщений"""
+        now = now or time.time()
+        policies = await self.db.get_retention_policies()
+        moved = 0
+        for chat_id in await self.db.get_chat_ids():
+            days = policies.get(chat_id, self.default_days)
+            if days <= 0:
+                continue
+            moved += await self.archive_chat(chat_id, int(now - days * 86400))
+
+        await self.db.delete_expired_summaries(now)
+        await self.db.delete_fsm_states_before(now - FSM_STATE_TTL)
+        freed = await self.db.incremental_vacuum()
+        if moved:
+            logger.info(f"В архив перенесено {moved} сообщений, освобождено страниц БД: {freed}")
+        self.archived += moved
+        return moved
+
+    async def archive_chat(self, chat_id: int, before_ts: int) -> int:
+        moved = 0
+        while True:
+            messages = await self.db.get_messages_before(chat_id, before_ts, self.batch_size)
+            if not messages:
+                return moved
+            await asyncio.to_thread(self.archive.append, chat_id, messages)
+            await self.db.delete_messages([msg['id'] for msg in messages])
+            moved += len(messages)
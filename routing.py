@@ -0,0 +1,132 @@
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from config import LLM_ROUTES, LLM_SLO_SECONDS, LLM_ERROR_BUDGET, LLM_MIN_OUTPUT_TOKENS
+from prompt import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Наблюдения старше стольких секунд не учитываются
+OBSERVATION_TTL = 300
+# Сколько последних запросов к модели помнить
+OBSERVATION_WINDOW = 50
+# Доля ошибок оценивается не меньше чем по стольким запросам
+MIN_SAMPLES = 5
+# Модель, исчерпавшая бюджет ошибок, получает пробный запрос не чаще раза в столько секунд
+PROBE_INTERVAL = 30
+# Ответ до такой доли от размера входа (пересказ короче обсуждения)
+OUTPUT_RATIO = 0.5
+# Запас контекста на служебные токены разметки сообщений
+CONTEXT_MARGIN = 64
+
+class LLMUnavailableError(Exception):
+    """Ни одна модель не подходит: все исчерпали бюджет ошибок или вход не помещается в контекст"""
+
+class ModelStats:
+    """Время и исход последних запросов к одной модели"""
+
+    __slots__ = ('observations', 'last_probe')
+
+    def __init__(self):
+        # (время наблюдения, длительность, успех)
+        self.observations: Deque[Tuple[float, float, bool]] = deque(maxlen=OBSERVATION_WINDOW)
+        self.last_probe = 0.0
+
+    def recent(self, now: float) -> List[Tuple[float, float, bool]]:
+        return [item for item in self.observations if now - item[0] <= OBSERVATION_TTL]
+
+    def error_rate(self, now: float) -> float:
+        recent = self.recent(now)
+        if len(recent) < MIN_SAMPLES:
+            return 0.0
+        return sum(1 for _, _, ok in recent if not ok) / len(recent)
+
+    def p90(self, now: float) -> Optional[float]:
+        durations = sorted(duration for _, duration, ok in self.recent(now) if ok)
+        if not durations:
+            return None
+        return durations[min(len(durations) - 1, int(len(durations) * 0.9))]
+
+class ModelRouter:
+    """Выбор модели и лимита ответа для запроса к LLM.
+
+    routes - модели в порядке предпочтения с размером контекста. Берётся
+    первая модель, в контекст которой помещается запрос, не исчерпавшая
+    бюджет ошибок error_budget и отвечающая (p90 за последние минуты) не
+    дольше slo_seconds; если таких нет - самая быстрая из исправных. Модель
+    с исчерпанным бюджетом получает пробный запрос раз в PROBE_INTERVAL
+    секунд. Лимит ответа уменьшается для коротких обсуждений.
+    """
+
+    def __init__(self, routes: str = LLM_ROUTES, slo_seconds: float = LLM_SLO_SECONDS,
+                 error_budget: float = LLM_ERROR_BUDGET, min_output_tokens: int = LLM_MIN_OUTPUT_TOKENS):
+        self.routes = parse_routes(routes)
+        self.slo_seconds = slo_seconds
+        self.error_budget = error_budget
+        self.min_output_tokens = min_output_tokens
+        self._stats: Dict[str, ModelStats] = {name: ModelStats() for name, _ in self.routes}
+
+    def _model_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats()
+        return stats
+
+    def observe(self, model: str, seconds: float, ok: bool):
+        self._model_stats(model).observations.append((time.monotonic(), seconds, ok))
+
+    def output_tokens(self, input_tokens: int, requested: int) -> int:
+        """Лимит ответа по размеру входа: не больше запрошенного и не меньше минимума"""
+        return min(requested, max(self.min_output_tokens, int(input_tokens * OUTPUT_RATIO)))
+
+    def route(self, messages: List[Dict], max_tokens: int) -> Tuple[str, int]:
+        """Модель и лимит ответа для запроса; LLMUnavailableError, если подходящей модели нет"""
+        now = time.monotonic()
+        input_tokens = sum(estimate_tokens(message.get('content') or '') for message in messages)
+        output = self.output_tokens(input_tokens, max_tokens)
+
+        fitting = [name for name, context in self.routes if input_tokens + output + CONTEXT_MARGIN <= context]
+        if not fitting:
+            raise LLMUnavailableError(f"Запрос (~{input_tokens} токенов) не помещается в контекст моделей")
+
+        healthy = []
+        for name in fitting:
+            stats = self._model_stats(name)
+            if stats.error_rate(now) <= self.error_budget:
+                healthy.append(name)
+            elif now - stats.last_probe >= PROBE_INTERVAL:
+                # Пробный запрос: если модель восстановилась, она снова начнёт получать трафик
+                stats.last_probe = now
+                logger.info(f"Пробный запрос к модели {name} после ошибок")
+                return name, output
+        if not healthy:
+            raise LLMUnavailableError("Все модели исчерпали бюджет ошибок")
+
+        for name in healthy:
+            p90 = self._model_stats(name).p90(now)
+            if p90 is None or p90 <= self.slo_seconds:
+                return name, output
+        # Все медленнее цели - берём самую быструю
+        return min(healthy, key=lambda name: self._model_stats(name).p90(now)), output
+
+    def snapshot(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        return {name: {'p90_seconds': stats.p90(now), 'error_rate': round(stats.error_rate(now), 3),
+                       'samples': len(stats.recent(now))}
+                for name, stats in self._stats.items()}
+
+def parse_routes(value: str) -> List[Tuple[str, int]]:
+    """Разбор "gpt-4o-mini:128000,gpt-3.5-turbo:16385" в список (модель, контекст)"""
+    routes = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, context = item.rpartition(':')
+        if not name or not context.isdigit():
+            raise ValueError(f"Неверный маршрут модели: {item!r} (ожидается модель:контекст)")
+        routes.append((name, int(context)))
+    if not routes:
+        raise ValueError("Не задано ни одной модели в LLM_ROUTES")
+    return routes
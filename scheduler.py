@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, time as dtime, timedelta
+from typing import List, Optional
+from aiogram import Bot
+from config import (DIGEST_TIMES, DIGEST_PUSH_TIME, DIGEST_JITTER, DIGEST_PRECOMPUTE_CONCURRENCY)
+from db import Database, LOCAL_TZ, day_bounds
+from llm import group_header
+from outbound import PRIORITY_PROGRESS, outbound_priority
+from streaming import split_text
+from summary import SummaryService
+from tracing import trace
+
+logger = logging.getLogger(__name__)
+
+class DigestScheduler:
+    """Построение пересказов "за сегодня" заранее, вне часов пик.
+
+    В каждое время из times (местное время) для групп, где сегодня были
+    сообщения (groups.last_activity), строится пересказ за день и
+    сохраняется в БД - /summary today отдаёт его сразу и досказывает
+    только новые сообщения. Старт каждой группы сдвигается на случайное
+    время до jitter секунд, одновременно строится не больше concurrency
+    пересказов. В push_time пересказ ещё и отправляется в группы,
+    подписанные командой /digest on (не чаще раза в день).
+    """
+
+    def __init__(self, db: Database, summary_service: SummaryService, times: str = DIGEST_TIMES,
+                 push_time: str = DIGEST_PUSH_TIME, jitter: float = DIGEST_JITTER,
+                 concurrency: int = DIGEST_PRECOMPUTE_CONCURRENCY):
+        self.db = db
+        self.summary_service = summary_service
+        self.push_time = parse_time(push_time)
+        self.times = sorted(set(parse_times(times)) | {self.push_time})
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self.precomputed = 0
+        self.pushed = 0
+
+    def start(self, bot: Bot):
+        self.bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def next_run(self, now: datetime) -> datetime:
+        """Ближайшее время запуска после now (now - с часовым поясом)"""
+        now = now.astimezone(LOCAL_TZ)
+        for day in (now.date(), now.date() + timedelta(days=1)):
+            for at in self.times:
+                candidate = datetime.combine(day, at, LOCAL_TZ)
+                if candidate > now:
+                    return candidate
+        raise ValueError("Не задано ни одного времени запуска")
+
+    async def _run(self):
+        while True:
+            at = self.next_run(datetime.now(LOCAL_TZ))
+            await asyncio.sleep(max(0.0, (at - datetime.now(LOCAL_TZ)).total_seconds()))
+            try:
+                with trace("job:digest", push=at.time() == self.push_time):
+                    await self.run_once(push=at.time() == self.push_time)
+            except Exception as e:
+                logger.error(f"Ошибка при построении пересказов по расписанию: {e}")
+
+    async def run_once(self, push: bool = False) -> int:
+        """Один проход по активным сегодня группам; возвращает число новых пересказов"""
+        today = datetime.now(LOCAL_TZ).date()
+        day = today.isoformat()
+        await self.db.delete_precomputed_summaries_before(day)
+        chat_ids = await self.db.get_active_chat_ids(day_bounds(today)[0])
+        subscriptions = await self.db.get_digest_subscriptions() if push else {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process(chat_id: int) -> bool:
+            # Случайный сдвиг разносит запросы к LLM по времени
+            await asyncio.sleep(random.uniform(0, self.jitter))
+            async with semaphore:
+                try:
+                    created = await self.summary_service.precompute_today(chat_id)
+                except Exception as e:
+                    logger.error(f"Не удалось заранее построить пересказ группы {chat_id}: {e}")
+                    return False
+                if chat_id in subscriptions and subscriptions[chat_id] != day:
+                    await self._push(chat_id, day)
+                return created
+
+        results = await asyncio.gather(*[process(chat_id) for chat_id in chat_ids])
+        created = sum(results)
+        self.precomputed += created
+        logger.info(f"Заранее построено пересказов: {created} из {len(chat_ids)} активных групп")
+        return created
+
+    async def _push(self, chat_id: int, day: str):
+        """Отправка готового пересказа в подписанную группу"""
+        stored = await self.db.get_precomputed_summary(chat_id, day)
+        if stored is None or self.bot is None:
+            return
+        text = group_header(stored['chat_title'] or f"Группа {chat_id}", "сегодня") + stored['summary']
+        try:
+            with outbound_priority(PRIORITY_PROGRESS):
+                for part in split_text(text):
+                    await self.bot.send_message(chat_id, part)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить ежедневный пересказ в группу {chat_id}: {e}")
+            return
+        await self.db.mark_digest_pushed(chat_id, day)
+        self.pushed += 1
+
+def parse_time(value: str) -> dtime:
+    """Разбор времени "ЧЧ:ММ" """
+    try:
+        hours, minutes = value.strip().split(':')
+        return dtime(int(hours), int(minutes))
+    except ValueError:
+        raise ValueError(f"Неверное время: {value!r} (ожидается ЧЧ:ММ)")
+
+def parse_times(value: str) -> List[dtime]:
+    """Разбор списка "10:00,14:00" """
+    return [parse_time(item) for item in value.split(',') if item.strip()]
@@ -0,0 +1,56 @@
+import re
+from typing import Dict, List, Optional
+
+WORD_RE = re.compile(r"\w+")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Слов запроса учитывается не больше стольких
+MAX_QUERY_TERMS = 8
+# Более короткие слова ищутся целиком: префиксный поиск по ним слишком широк
+MIN_PREFIX_LENGTH = 4
+
+# Окончания русских слов, самые длинные первыми: запрос "деплоя" находит "деплой" и "деплоить"
+ENDINGS = tuple(sorted("""
+ами ями ого его ому ему ыми ими ией ием иям иях ать ять ить еть ешь ете ишь ите ут ют ат ят
+ой ей ий ый ая яя ое ее ые ие ую юю ом ем ам ям ах ях ов ев ть ся сь
+а я о е и ы у ю ь
+""".split(), key=len, reverse=True))
+
+def stem(word: str) -> str:
+    """Основа слова для префиксного поиска: нижний регистр, "ё" как "е", без окончания"""
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_PREFIX_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+def build_match_query(text: str) -> Optional[str]:
+    """Запрос FTS5 из текста пользователя: все слова (по основе) должны встретиться.
+
+    Синтаксис FTS5 в тексте не интерпретируется - каждое слово берётся в
+    кавычки. None, если в тексте нет слов.
+    """
+    terms = []
+    for word in WORD_RE.findall(text):
+        term = stem(word)
+        if term not in terms:
+            terms.append(term)
+    if not terms:
+        return None
+    return " AND ".join(f'"{term}"*' if len(term) >= MIN_PREFIX_LENGTH else f'"{term}"'
+                        for term in terms[:MAX_QUERY_TERMS])
+
+def format_results(query: str, results: List[Dict], page: int) -> str:
+    """Текст страницы результатов /search"""
+    if not results:
+        if page == 0:
+            return f"🔍 По запросу «{query}» ничего не найдено."
+        return f"🔍 По запросу «{query}» больше ничего не найдено."
+    lines = [f"🔍 Результаты по запросу «{query}» (страница {page + 1}):"]
+    for result in results:
+        chat_title = result['chat_title'] or f"Группа {result['chat_id']}"
+        author = result['username'] or "участник"
+        lines.append(f"\n📋 {chat_title} · {author} · {result['timestamp']}\n{result['snippet']}")
+    return "\n".join(lines)
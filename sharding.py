@@ -0,0 +1,28 @@
+from typing import Optional
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+
+def shard_for(key: int, shards: int) -> int:
+    """Номер исполнителя для чата или пользователя"""
+    return key % shards
+
+def update_shard_key(update: Update) -> Optional[int]:
+    """Ключ распределения обновления: id чата, а без чата - id пользователя.
+
+    Сообщения группы попадают к одному исполнителю - его буфер и фрагменты
+    пересказов группы остаются полными. Личные команды и нажатия кнопок
+    пользователя тоже идут к одному исполнителю: в личке chat_id равен
+    user_id, а у нажатия кнопки берётся чат сообщения с кнопкой.
+    """
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        return None
+    chat = getattr(event, 'chat', None)
+    if chat is None:
+        message = getattr(event, 'message', None)
+        chat = getattr(message, 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    return user.id if user is not None else None
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from config import STREAM_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Сколько правок подряд можно сделать без паузы: статус "создаю пересказ" и
+# первый текст пересказа показываются сразу, дальше - не чаще раза в interval
+EDIT_BURST = 2
+
+def split_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Разбиение текста на части не длиннее limit: по абзацам, строкам или словам"""
+    parts = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, 0, limit)
+            # Слишком короткая часть хуже разреза посреди строки
+            if cut > limit // 2:
+                break
+        if cut <= limit // 2:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    parts.append(text)
+    return parts
+
+class MessageStream:
+    """Сообщение бота, которое обновляется по мере появления текста.
+
+    update() принимает текст целиком на текущий момент и не ждёт Telegram:
+    правки сливаются, сообщение редактируется в среднем не чаще раза в
+    interval секунд (с запасом на EDIT_BURST правок подряд), промежуточные
+    версии пропускаются. Текст длиннее 4096 символов
+    продолжается в следующих сообщениях. finish() сразу показывает итоговый
+    текст. Повторы при RetryAfter выполняет OutboundSender; если Telegram так
+    и не принял итоговый текст, finish() выбрасывает TelegramRetryAfter.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, message_id: int,
+                 interval: float = STREAM_EDIT_INTERVAL, limit: int = TELEGRAM_MESSAGE_LIMIT):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_ids = [message_id]
+        self.interval = interval
+        self.limit = limit
+        self.edits = 0
+        self._shown: List[str] = [""]
+        self._pending: Optional[str] = None
+        self._allowance = float(EDIT_BURST)
+        self._refilled = time.monotonic()
+        self._retry_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def update(self, text: str):
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def finish(self, text: str):
+        self._pending = None
+        if self._task is not None:
+            # Ожидающая правка не нужна; уже начатая дойдёт до конца под блокировкой
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        async with self._lock:
+            await self._render(text, final=True)
+
+    def _delay(self) -> float:
+        """Сколько ждать до следующей правки (корзина токенов на EDIT_BURST правок)"""
+        now = time.monotonic()
+        if self.interval > 0:
+            self._allowance = min(EDIT_BURST, self._allowance + (now - self._refilled) / self.interval)
+        else:
+            self._allowance = EDIT_BURST
+        self._refilled = now
+        wait = (1 - self._allowance) * self.interval if self._allowance < 1 else 0.0
+        return max(wait, self._retry_until - now)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._delay())
+        await asyncio.shield(self._flush())
+
+    async def _flush(self):
+        async with self._lock:
+            text, self._pending = self._pending, None
+            if text is not None:
+                self._delay()
+                self._allowance -= 1
+                await self._render(text)
+        if self._pending is not None:
+            # Текст обновился, пока шла правка
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _render(self, text: str, final: bool = False):
+        parts = split_text(text, self.limit)
+        try:
+            for i, part in enumerate(parts):
+                if i >= len(self.message_ids):
+                    if not await self._send(part):
+                        # Без этой части следующие оказались бы не на своём месте
+                        break
+                elif self._shown[i] != part:
+                    await self._edit(i, part)
+        except TelegramRetryAfter:
+            if final:
+                raise
+            # Промежуточный текст догонит следующая правка
+            return
+        if final:
+            # Итог оказался короче промежуточного текста - лишние продолжения удаляются
+            for message_id in self.message_ids[len(parts):]:
+                try:
+                    await self.bot.delete_message(self.chat_id, message_id)
+                except Exception as e:
+                    logger.debug(f"Не удалось удалить сообщение {message_id}: {e}")
+            del self.message_ids[len(parts):]
+            del self._shown[len(parts):]
+
+    async def _edit(self, index: int, text: str):
+        message_id = self.message_ids[index]
+        try:
+            await self._request(self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=message_id))
+        except TelegramRetryAfter:
+            raise
+        except Exception as e:
+            # Например, "message is not modified" или сообщение удалено пользователем
+            logger.debug(f"Не удалось обновить сообщение {message_id}: {e}")
+            return
+        self._shown[index] = text
+        self.edits += 1
+
+    async def _send(self, text: str) -> bool:
+        try:
+            message = await self._request(self.bot.send_message(self.chat_id, text))
+        except TelegramRetryAfter:
+            raise
+        except Exception as e:
+            logger.warning(f"Не удалось отправить продолжение в чат {self.chat_id}: {e}")
+            return False
+        self.message_ids.append(message.message_id)
+        self._shown.append(text)
+        return True
+
+    async def _request(self, request):
+        """Запрос к Telegram. RetryAfter, оставшийся после повторов OutboundSender,
+        откладывает следующие правки и передаётся дальше: промежуточный текст
+        догонит следующая правка, итоговый - ошибка для вызывающего finish()"""
+        try:
+            return await request
+        except TelegramRetryAfter as e:
+            self._retry_until = time.monotonic() + e.retry_after
+            logger.warning(f"Telegram ограничил отправку в чат {self.chat_id}, пауза {e.retry_after} с")
+            raise
@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from config import (CHUNK_SIZE, CHUNK_REDUCE_FANIN, CHUNK_BACKFILL_HOURS, CHUNK_SUMMARIES_ENABLED, TOPIC_SEGMENTATION_ENABLED,
+                    TOPIC_MIN_MESSAGES)
+from db import Database
+from llm import LLMService, get_llm_service
+from retention import MessageArchive
+from topics import TopicSegmenter
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Запас по времени при поиске следующего фрагмента: сообщения из одного пакета
+# могут прийти в БД не строго по возрастанию времени
+CHUNK_TS_SLACK = 3600
+
+class WindowPlan:
+    """Из чего собирается пересказ окна: готовые фрагменты и непокрытые сообщения"""
+
+    def __init__(self, chunks: List[Dict], head: List[Dict], tail: List[Dict]):
+        self.chunks = chunks
+        self.head = head
+        self.tail = tail
+
+    @property
+    def raw(self) -> List[Dict]:
+        return self.head + self.tail
+
+    @property
+    def empty(self) -> bool:
+        return not self.chunks and not self.head and not self.tail
+
+    @property
+    def max_message_id(self) -> int:
+        ids = [msg['id'] for msg in self.raw] + [chunk['last_message_id'] for chunk in self.chunks]
+        return max(ids) if ids else 0
+
+    @property
+    def message_count(self) -> int:
+        return len(self.head) + len(self.tail) + sum(chunk['message_count'] for chunk in self.chunks)
+
+    @property
+    def user_ids(self) -> Set[int]:
+        users = {msg.get('user_id') for msg in self.raw}
+        for chunk in self.chunks:
+            users |= chunk['user_ids']
+        return users
+
+    @property
+    def chat_title(self) -> Optional[str]:
+        return self.raw[-1].get('chat_title') if self.raw else None
+
+class ChunkSummarizer:
+    """Инкрементальный иерархический пересказ.
+
+    По мере записи сообщений каждая группа нарезается на фрагменты по
+    chunk_size сообщений; каждый фрагмент пересказывается один раз и
+    сохраняется в chunk_summaries. Пересказ окна собирается из готовых
+    фрагментов (map-reduce), заново обрабатываются только сообщения,
+    ещё не попавшие во фрагменты. Сообщения, перенесённые в архив,
+    дочитываются из archive, если он передан.
+
+    Фоновый пересказ не уходит дальше backfill_hours в прошлое: окна
+    длиннее собираются из уже готовых фрагментов и непокрытых сообщений.
+
+    Окно без готовых фрагментов из topic_min_messages и более сообщений
+    разбивается на темы (TopicSegmenter); темы пересказываются параллельно
+    и объединяются одним запросом, поэтому время ответа определяется самой
+    большой темой, а не всем окном.
+    """
+
+    def __init__(self, db: Database, llm_provider: Callable[[], LLMService] = get_llm_service,
+                 chunk_size: int = CHUNK_SIZE, reduce_fanin: int = CHUNK_REDUCE_FANIN,
+                 background: bool = CHUNK_SUMMARIES_ENABLED,
+                 archive: Optional[MessageArchive] = None, hot_buffer=None,
+                 topics: bool = TOPIC_SEGMENTATION_ENABLED, topic_min_messages: int = TOPIC_MIN_MESSAGES,
+                 backfill_hours: int = CHUNK_BACKFILL_HOURS):
+        self.db = db
+        # Окна читаются из буфера последних сообщений (HotBuffer), если он есть
+        self.messages = hot_buffer or db
+        self.archive = archive
+        self.llm_provider = llm_provider
+        self.chunk_size = chunk_size
+        self.reduce_fanin = reduce_fanin
+        self.background = background
+        self.backfill_hours = backfill_hours
+        self.segmenter = TopicSegmenter() if topics else None
+        self.topic_min_messages = topic_min_messages
+        self.owns: Optional[Callable[[int], bool]] = None
+        self._pending: Dict[int, int] = {}
+        self._dirty: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def on_flush(self, rows: List[Tuple], ids: List[int]):
+        """Слушатель конвейера приёма: учёт новых сообщений по группам"""
+        for row in rows:
+            chat_id = row[0]
+            if self.owns is not None and not self.owns(chat_id):
+                continue
+            self._pending[chat_id] = self._pending.get(chat_id, 0) + 1
+            if self._pending[chat_id] >= self.chunk_size:
+                self._dirty.add(chat_id)
+        if self._dirty and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self, owns: Optional[Callable[[int], bool]] = None):
+        """Запуск фонового пересказа фрагментов.
+
+        owns - для процесса-исполнителя: фрагменты пересказываются только для
+        чатов, которые он обслуживает, иначе каждый процесс пересказывал бы
+        все группы.
+        """
+        self.owns = owns
+        if not self.background or (self._task is not None and not self._task.done()):
+            return
+        self._wakeup = asyncio.Event()
+        # После перезапуска счётчики неизвестны - проверяем все свои группы один раз
+        self._dirty.update(chat_id for chat_id in await self.db.get_chat_ids()
+                           if owns is None or owns(chat_id))
+        self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._dirty:
+                chat_id = self._dirty.pop()
+                try:
+                    await self.summarize_pending(chat_id)
+                except Exception as e:
+                    logger.error(f"Ошибка при пересказе фрагментов группы {chat_id}: {e}")
+
+    async def summarize_pending(self, chat_id: int, now: Optional[float] = None) -> int:
+        """Пересказ полных фрагментов группы за последние backfill_hours часов;
+        возвращает число новых фрагментов"""
+        horizon = int(now if now is not None else time.time()) - self.backfill_hours * 3600
+        last_id, last_start = await self.db.get_last_chunk(chat_id)
+        if last_id and last_start - CHUNK_TS_SLACK < horizon:
+            # plan_window считает фрагменты непрерывными: если между последним фрагментом
+            # и горизонтом есть непересказанные сообщения, старые фрагменты группы удаляются
+            skipped = await self.db.get_messages_after(
+                chat_id, last_id, max(0, last_start - CHUNK_TS_SLACK), 1)
+            if skipped and skipped[0]['ts'] < horizon:
+                logger.info(f"Фрагменты группы {chat_id} старше {self.backfill_hours} ч удалены: "
+                            f"история после них не пересказывается")
+                await self.db.delete_chunk_summaries(chat_id)
+        created = 0
+        while True:
+            last_id, last_start = await self.db.get_last_chunk(chat_id)
+            # Без фрагментов нарезка начинается с горизонта, иначе продолжает последний фрагмент
+            since = max(0, last_start - CHUNK_TS_SLACK) if last_id else horizon
+            messages = await self.db.get_messages_after(chat_id, last_id, since, self.chunk_size)
+            if len(messages) < self.chunk_size:
+                self._pending[chat_id] = len(messages)
+                return created
+            summary = await self.llm_provider().summarize_chunk(messages)
+            await self.db.save_chunk_summary(chat_id, messages, summary)
+            created += 1
+
+    async def plan_window(self, chat_id: int, since_ts: int, until_ts: int) -> WindowPlan:
+        """Готовые фрагменты окна и сообщения до первого / после последнего из них"""
+        chunks = await self.db.get_chunk_summaries(chat_id, since_ts, until_ts)
+        skip_ids = (chunks[0]['first_message_id'], chunks[-1]['last_message_id']) if chunks else None
+        raw = await self.messages.get_window_messages(chat_id, since_ts, until_ts, skip_ids)
+        return await self._make_plan(chat_id, since_ts, until_ts, chunks, raw)
+
+    async def plan_windows(self, chat_ids: List[int], since_ts: int, until_ts: int) -> Dict[int, WindowPlan]:
+        """Планы окна для нескольких групп: фрагменты и непокрытые сообщения всех групп
+        читаются двумя запросами (для дайджеста)"""
+        chunks = await self.db.get_chats_chunk_summaries(chat_ids, since_ts, until_ts)
+        skip_ids = {chat_id: (group[0]['first_message_id'], group[-1]['last_message_id'])
+                    for chat_id, group in chunks.items()}
+        raw = await self.db.get_chats_window_messages(chat_ids, since_ts, until_ts, skip_ids)
+        return {chat_id: await self._make_plan(chat_id, since_ts, until_ts, chunks.get(chat_id, []),
+                                               raw.get(chat_id, []))
+                for chat_id in chat_ids}
+
+    async def _make_plan(self, chat_id: int, since_ts: int, until_ts: int, chunks: List[Dict],
+                         raw: List[Dict]) -> WindowPlan:
+        skip_ids = (chunks[0]['first_message_id'], chunks[-1]['last_message_id']) if chunks else None
+        if self.archive is not None:
+            raw = await self._with_archived(raw, chat_id, since_ts, until_ts, skip_ids)
+        if not chunks:
+            return WindowPlan([], [], raw)
+        head = [msg for msg in raw if msg['id'] < skip_ids[0]]
+        tail = [msg for msg in raw if msg['id'] > skip_ids[1]]
+        return WindowPlan(chunks, head, tail)
+
+    async def _with_archived(self, raw: List[Dict], chat_id: int, since_ts: int, until_ts: int,
+                             skip_ids: Optional[Tuple[int, int]]) -> List[Dict]:
+        """Добавление к окну сообщений из архива (кроме покрытых фрагментами)"""
+        hot_ids = {msg['id'] for msg in raw}
+        archived = []
+        async for batch in self.archive.iter_messages(chat_id, since_ts, until_ts):
+            archived.extend(msg for msg in batch if msg['id'] not in hot_ids
+                            and not (skip_ids and skip_ids[0] <= msg['id'] <= skip_ids[1]))
+        if not archived:
+            return raw
+        return sorted(archived + raw, key=lambda msg: (msg['ts'], msg['id']))
+
+    async def summarize_messages(self, messages: List[Dict], time_period: str,
+                                 on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """Пересказ списка сообщений: по темам, если их несколько, иначе одним запросом.
+
+        on_text получает текст итогового пересказа по мере генерации.
+        """
+        topics = await self._topics(messages)
+        if topics:
+            return await self._summarize_topics(topics, time_period, on_text)
+        return await self.llm_provider().summarize_messages(messages, time_period, on_text=on_text)
+
+    async def summarize_plan(self, plan: WindowPlan, time_period: str,
+                             on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        llm = self.llm_provider()
+        if not plan.chunks:
+            topics = await self._topics(plan.raw)
+            if topics:
+                return await self._summarize_topics(topics, time_period, on_text)
+            if len(plan.raw) <= self.chunk_size:
+                # Короткое окно - обычный пересказ одним запросом
+                return await llm.summarize_messages(plan.raw, time_period, on_text=on_text)
+
+        # map: непокрытые сообщения пересказываются параллельно кусками по chunk_size
+        head_pieces = self._split(plan.head)
+        tail_pieces = self._split(plan.tail)
+        with span("summary.map", pieces=len(head_pieces) + len(tail_pieces)):
+            fresh = await asyncio.gather(*[llm.summarize_chunk(piece) for piece in head_pieces + tail_pieces])
+        parts = (list(fresh[:len(head_pieces)])
+                 + [chunk['summary'] for chunk in plan.chunks]
+                 + list(fresh[len(head_pieces):]))
+
+        # reduce: при большом числе фрагментов объединяем их в несколько уровней
+        total_messages = plan.message_count
+        unique_users = len(plan.user_ids)
+        while len(parts) > self.reduce_fanin:
+            groups = [parts[i:i + self.reduce_fanin] for i in range(0, len(parts), self.reduce_fanin)]
+            parts = list(await asyncio.gather(*[
+                llm.combine_summaries(group, time_period, total_messages, unique_users, final=False)
+                for group in groups
+            ]))
+        with span("summary.reduce", parts=len(parts)):
+            return await llm.combine_summaries(parts, time_period, total_messages, unique_users,
+                                               on_text=on_text)
+
+    async def _topics(self, messages: List[Dict]) -> Optional[List[List[Dict]]]:
+        """Темы окна или None, если окно мало или в нём одна тема. Разбиение
+        большого окна занимает до сотен миллисекунд, поэтому идёт в потоке"""
+        if self.segmenter is None or len(messages) < self.topic_min_messages:
+            return None
+        with span("summary.segment", messages=len(messages)) as current:
+            topics = await asyncio.to_thread(self.segmenter.segment, messages)
+            if current is not None:
+                current.attrs['topics'] = len(topics)
+        return topics if len(topics) > 1 else None
+
+    async def _summarize_topics(self, topics: List[List[Dict]], time_period: str,
+                                on_text: Optional[Callable[[str], Awaitable[None]]]) -> str:
+        llm = self.llm_provider()
+        # Большая тема пересказывается кусками по chunk_size, куски идут под одним номером
+        pieces = [(number, piece) for number, topic in enumerate(topics) for piece in self._split(topic)]
+        with span("summary.topics", topics=len(topics), pieces=len(pieces)):
+            results = await asyncio.gather(*[llm.summarize_topic(piece) for _, piece in pieces])
+        parts: List[List[str]] = [[] for _ in topics]
+        for (number, _), result in zip(pieces, results):
+            parts[number].append(result)
+
+        total_messages = sum(len(topic) for topic in topics)
+        unique_users = len({msg.get('user_id') for topic in topics for msg in topic})
+        with span("summary.reduce", parts=len(parts)):
+            return await llm.combine_topics(["\n".join(part) for part in parts], time_period,
+                                            total_messages, unique_users, on_text=on_text)
+
+    def _split(self, messages: List[Dict]) -> List[List[Dict]]:
+        return [messages[i:i + self.chunk_size] for i in range(0, len(messages), self.chunk_size)]
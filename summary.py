@@ -0,0 +1,351 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from cache import SummaryCache
+from config import SUMMARY_DEADLINE, SEARCH_SUMMARY_LIMIT, DIGEST_CONCURRENCY, DIGEST_TAIL_LIMIT
+from db import Database, LOCAL_TZ, day_bounds
+from fallback import LocalSummarizer
+from llm import LLMService, get_llm_service, group_header
+from routing import LLMUnavailableError
+from search import build_match_query
+from summarizer import ChunkSummarizer, WindowPlan
+
+logger = logging.getLogger(__name__)
+
+RECENT_LIMIT = 200
+
+class SummaryWindow:
+    """Период, за который строится пересказ: последние сообщения, сегодня или N часов.
+
+    query - тема: в пересказ попадают только сообщения, найденные по ней
+    полнотекстовым поиском.
+    """
+
+    def __init__(self, kind: str, hours: Optional[int] = None, query: Optional[str] = None):
+        self.kind = kind
+        self.hours = hours
+        self.query = query
+
+    @property
+    def title(self) -> str:
+        if self.kind == "recent":
+            title = f"последние {RECENT_LIMIT} сообщений"
+        elif self.kind == "today":
+            title = "сегодня"
+        else:
+            title = f"последние {self.hours} часов"
+        if self.query:
+            title += f", тема «{self.query}»"
+        return title
+
+    @property
+    def match(self) -> Optional[str]:
+        """Запрос к полнотекстовому индексу по теме"""
+        return build_match_query(self.query) if self.query else None
+
+    def bounds(self) -> Optional[Tuple[int, int]]:
+        """Границы окна [since, until) в секундах Unix; None для последних N сообщений"""
+        if self.kind == "today":
+            return day_bounds(datetime.now(LOCAL_TZ).date())
+        if self.kind == "hours":
+            now = int(time.time())
+            # Небольшой запас сверху на расхождение часов с серверами Telegram
+            return now - self.hours * 3600, now + 60
+        return None
+
+    def cache_key(self) -> str:
+        """Часть ключа кэша; для "сегодня" включает дату, чтобы не пережить полночь"""
+        if self.kind == "today":
+            key = f"today:{datetime.now(LOCAL_TZ).date().isoformat()}"
+        elif self.kind == "hours":
+            key = f"{self.hours}h"
+        else:
+            key = self.kind
+        if self.query:
+            key += f":about:{self.match}"
+        return key
+
+def parse_window(option: str) -> SummaryWindow:
+    """Разбор периода из кнопки или аргумента команды: recent, today, 3h,
+    с необязательной темой: "today about деплой", "about деплой" (последние сообщения)"""
+    words = option.split()
+    query = None
+    if "about" in words:
+        index = words.index("about")
+        query = " ".join(words[index + 1:])
+        if build_match_query(query) is None:
+            raise ValueError("Не указана тема пересказа")
+        words = words[:index]
+    option = words[0].lower() if words else "recent"
+    if option in ("recent", "today"):
+        return SummaryWindow(option, query=query)
+    if option.endswith('h'):
+        hours = int(option[:-1])
+        if hours <= 0:
+            raise ValueError("Количество часов должно быть положительным")
+        return SummaryWindow("hours", hours, query)
+    raise ValueError(f"Неизвестный период: {option}")
+
+class SummaryService:
+    """Построение пересказа группы за период с кэшированием результата.
+
+    Окна по времени собираются из сохранённых пересказов фрагментов
+    (см. ChunkSummarizer), поэтому их размер не ограничен числом сообщений.
+    Если LLM не ответила за deadline секунд или недоступна, пользователь
+    получает локальную выжимку (см. LocalSummarizer), а пересказ LLM
+    достраивается в фоне и попадает в кэш для следующего запроса.
+    Пересказ за сегодня берётся из построенного заранее (precompute_today),
+    если после него пришло не больше tail_limit сообщений: пересказываются
+    только они.
+    """
+
+    def __init__(self, db: Database, cache: Optional[SummaryCache] = None,
+                 llm_provider: Callable[[], LLMService] = get_llm_service,
+                 summarizer: Optional[ChunkSummarizer] = None, hot_buffer=None,
+                 deadline: Optional[float] = SUMMARY_DEADLINE, fallback: Optional[LocalSummarizer] = None,
+                 digest_concurrency: int = DIGEST_CONCURRENCY, tail_limit: int = DIGEST_TAIL_LIMIT):
+        self.db = db
+        self.messages = hot_buffer or db
+        self.cache = cache or SummaryCache()
+        self.llm_provider = llm_provider
+        self.summarizer = summarizer or ChunkSummarizer(db, llm_provider, background=False)
+        self.deadline = deadline or None
+        self.fallback = fallback or LocalSummarizer()
+        self.digest_concurrency = digest_concurrency
+        self.tail_limit = tail_limit
+        # Пересказы, не уложившиеся в срок: держим ссылки, пока они достраиваются
+        self._background: Set[asyncio.Task] = set()
+
+    async def load_messages(self, chat_id: int, window: SummaryWindow) -> List[Dict]:
+        """Все сообщения окна (для окон по времени - без ограничения количества);
+        для окна с темой - только найденные по ней"""
+        bounds = window.bounds()
+        if window.query:
+            limit = RECENT_LIMIT if bounds is None else SEARCH_SUMMARY_LIMIT
+            since_ts, until_ts = bounds or (None, None)
+            try:
+                return await self.db.search_window_messages(chat_id, window.match, since_ts, until_ts, limit)
+            except Exception as e:
+                logger.error(f"Ошибка при поиске сообщений по теме: {e}")
+                return []
+        if bounds is None:
+            return await self.messages.get_recent_messages(chat_id, limit=RECENT_LIMIT)
+        try:
+            return await self.messages.get_window_messages(chat_id, *bounds)
+        except Exception as e:
+            logger.error(f"Ошибка при получении сообщений: {e}")
+            return []
+
+    async def summarize(self, chat_id: int, window: SummaryWindow,
+                        group_title: Optional[str] = None,
+                        progress: Optional[Callable[[str], Awaitable[None]]] = None,
+                        on_text: Optional[Callable[[str], Awaitable[None]]] = None,
+                        plan: Optional[WindowPlan] = None) -> Optional[str]:
+        """Пересказ с заголовком группы; None, если за период нет сообщений.
+
+        progress - необязательный обработчик этапов работы (текст для пользователя),
+        on_text - получает пересказ с заголовком по мере генерации (потоковый ответ LLM),
+        plan - уже прочитанный план окна по времени (см. digest).
+        """
+        if progress is None:
+            progress = _no_progress
+        streamed = None
+        degraded = False
+        if on_text is not None:
+            async def streamed(text: str):
+                # После локальной выжимки фоновый пересказ не должен её перезаписывать
+                if not degraded:
+                    await on_text(header + text)
+
+        # Сообщения для локальной выжимки, если LLM не успеет: только уже прочитанные
+        messages: List[Dict] = []
+        fallback_prefix = ""
+        bounds = window.bounds()
+        precomputed = await self._precomputed(chat_id, window)
+        if bounds is None or window.query:
+            # Последние сообщения и сообщения по теме пересказываются напрямую, без фрагментов
+            messages = await self.load_messages(chat_id, window)
+            if not messages:
+                return None
+            max_message_id = max(msg['id'] for msg in messages)
+            title = messages[-1].get('chat_title')
+            message_count = len(messages)
+
+            async def compute() -> str:
+                return await self.summarizer.summarize_messages(messages, window.title, streamed)
+        elif precomputed is not None:
+            stored, tail = precomputed
+            max_message_id = max([stored['last_message_id']] + [msg['id'] for msg in tail])
+            title = stored['chat_title']
+            message_count = stored['message_count'] + len(tail)
+            messages = tail
+            if tail:
+                since = datetime.fromtimestamp(stored['created_at'], LOCAL_TZ).strftime('%H:%M')
+                # Готовая часть остаётся и в локальной выжимке
+                fallback_prefix = f"{stored['summary']}\n\n🆕 Новые сообщения после {since}:\n"
+
+            async def compute() -> str:
+                if not tail:
+                    return stored['summary']
+                text = fallback_prefix
+                tail_streamed = None
+                if streamed is not None:
+                    # Готовая часть показывается сразу, пока пересказываются новые сообщения
+                    await streamed(text)
+
+                    async def tail_streamed(tail_text: str):
+                        await streamed(text + tail_text)
+                return text + await self.summarizer.summarize_messages(tail, window.title, tail_streamed)
+        else:
+            if plan is None:
+                plan = await self.summarizer.plan_window(chat_id, *bounds)
+            if plan.empty:
+                return None
+            max_message_id = plan.max_message_id
+            title = plan.chat_title
+            message_count = plan.message_count
+            messages = plan.raw
+
+            async def compute() -> str:
+                return await self.summarizer.summarize_plan(plan, window.title, streamed)
+
+        group_title = group_title or title or f"Группа {chat_id}"
+        header = group_header(group_title, window.title)
+        key = SummaryCache.make_key(chat_id, window.cache_key(), max_message_id)
+
+        await progress(f"🔄 Создаю пересказ по {message_count} сообщениям...")
+        task = asyncio.ensure_future(self.cache.get_or_compute(key, chat_id, compute))
+        try:
+            summary = await asyncio.wait_for(asyncio.shield(task), self.deadline)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                logger.warning(f"Пересказ для чата {chat_id} не готов за {self.deadline} с, отдаю локальную выжимку")
+                self._background.add(task)
+                task.add_done_callback(self._background_done)
+            elif isinstance(e, LLMUnavailableError):
+                logger.warning(f"LLM недоступна для чата {chat_id}: {e}")
+            else:
+                logger.error(f"Ошибка при генерации пересказа: {e}")
+            degraded = True
+            summary = fallback_prefix + await self._fallback(chat_id, window, messages, e)
+
+        return header + summary
+
+    async def precompute_today(self, chat_id: int) -> bool:
+        """Построение пересказа группы за сегодня заранее (см. DigestScheduler).
+
+        False, если сообщений за день нет или после прошлого пересказа не
+        появилось новых.
+        """
+        window = SummaryWindow("today")
+        day = datetime.now(LOCAL_TZ).date().isoformat()
+        plan = await self.summarizer.plan_window(chat_id, *window.bounds())
+        stored = await self.db.get_precomputed_summary(chat_id, day)
+        if plan.empty or (stored is not None and stored['last_message_id'] >= plan.max_message_id):
+            return False
+        summary = await self.summarizer.summarize_plan(plan, window.title)
+        await self.db.save_precomputed_summary(chat_id, day, plan.chat_title, plan.max_message_id,
+                                               plan.message_count, summary)
+        return True
+
+    async def _precomputed(self, chat_id: int, window: SummaryWindow) -> Optional[Tuple[Dict, List[Dict]]]:
+        """Готовый пересказ за сегодня и сообщения после него; None, если его нет или
+        новых сообщений слишком много"""
+        if window.kind != "today" or window.query:
+            return None
+        day = datetime.now(LOCAL_TZ).date().isoformat()
+        stored = await self.db.get_precomputed_summary(chat_id, day)
+        if stored is None:
+            return None
+        since_ts, until_ts = window.bounds()
+        tail = await self.db.get_messages_after(chat_id, stored['last_message_id'], since_ts, self.tail_limit + 1)
+        tail = [msg for msg in tail if msg['ts'] < until_ts]
+        if len(tail) > self.tail_limit:
+            return None
+        return stored, tail
+
+    async def digest(self, user_id: int, window: SummaryWindow,
+                     progress: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+        """Общий пересказ всех групп пользователя за период; None, если сообщений нет нигде.
+
+        Окна всех групп проверяются одним запросом, группы без сообщений
+        пропускаются; фрагменты и сообщения остальных читаются ещё двумя
+        запросами на все группы сразу, и группы пересказываются параллельно (не больше
+        digest_concurrency одновременно) - общее время близко ко времени
+        самой долгой группы, а не к сумме.
+        """
+        if progress is None:
+            progress = _no_progress
+        groups = await self.db.get_user_groups(user_id)
+        bounds = window.bounds()
+        if bounds is None:
+            raise ValueError("Дайджест строится только за период: сегодня или N часов")
+        stats = await self.db.get_window_stats([group['chat_id'] for group in groups], *bounds)
+        active = sorted((group for group in groups if group['chat_id'] in stats),
+                        key=lambda group: -stats[group['chat_id']]['message_count'])
+        if not active:
+            return None
+        plans = {}
+        if not window.query:
+            plans = await self.summarizer.plan_windows([group['chat_id'] for group in active], *bounds)
+
+        total = len(active)
+        done = 0
+        semaphore = asyncio.Semaphore(self.digest_concurrency)
+        await progress(f"🔄 Создаю пересказы для {total} групп...")
+
+        async def summarize_group(group: Dict) -> Optional[str]:
+            nonlocal done
+            chat_id = group['chat_id']
+            group_title = group['chat_title'] or f"Группа {chat_id}"
+            async with semaphore:
+                try:
+                    summary = await self.summarize(chat_id, window, group_title, plan=plans.get(chat_id))
+                except Exception as e:
+                    logger.error(f"Ошибка при пересказе группы {chat_id} для дайджеста: {e}")
+                    summary = group_header(group_title, window.title) + "Не удалось создать пересказ."
+            done += 1
+            if done < total:
+                await progress(f"🔄 Готово {done} из {total} групп...")
+            return summary
+
+        summaries = [summary for summary in await asyncio.gather(*[summarize_group(group) for group in active])
+                     if summary]
+        if not summaries:
+            return None
+        header = f"📬 Дайджест за {window.title}: групп с сообщениями - {len(summaries)}"
+        skipped = len(groups) - len(summaries)
+        if skipped:
+            header += f", без сообщений - {skipped}"
+        return header + "\n\n" + "\n\n".join(summaries)
+
+    async def _fallback(self, chat_id: int, window: SummaryWindow, messages: List[Dict],
+                        error: Exception) -> str:
+        """Локальная выжимка по последним RECENT_LIMIT сообщениям вместо пересказа LLM;
+        в кэш не попадает"""
+        try:
+            if not messages:
+                # Окно целиком покрыто фрагментами: всё окно не читается, только его конец
+                messages = await self.messages.get_recent_messages(chat_id, limit=RECENT_LIMIT)
+                bounds = window.bounds()
+                if bounds is not None:
+                    messages = [msg for msg in messages if bounds[0] <= msg['ts'] < bounds[1]]
+            return await asyncio.to_thread(self.fallback.summarize, messages[-RECENT_LIMIT:])
+        except Exception as e:
+            logger.error(f"Ошибка при построении локальной выжимки: {e}")
+            return f"Произошла ошибка при создании пересказа: {str(error)}"
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logger.error(f"Фоновый пересказ не удался: {error}")
+        else:
+            logger.info("Фоновый пересказ готов и сохранён в кэше")
+
+async def _no_progress(text: str):
+    pass
@@ -0,0 +1,20 @@
+"""
+Проверка, что набор замеров запускается и выдаёт сравнимые результаты
+"""
+import asyncio
+import json
+import bench
+
+def test_bench_smoke(tmp_path):
+    args = bench.parse_args(["--sizes", "300,600", "--writes", "50", "--queries", "5",
+                             "--history", "300", "--requests", "3", "--llm-delay", "0"])
+    report = asyncio.run(bench.run(args))
+    results = report['results']
+    assert set(results['reads']) == {"300", "600"}
+    assert results['reads']["600"]['get_recent_messages']['count'] == 5
+    assert results['summary']['latency']['count'] == 3
+    assert results['summary']['llm_calls'] >= 1
+
+    path = tmp_path / "bench.json"
+    path.write_text(json.dumps(report))
+    assert any(line.startswith("summary.latency.p50_ms") for line in bench.compare(str(path), str(path)))
@@ -0,0 +1,82 @@
+"""
+Тесты кэша пересказов
+"""
+import asyncio
+from cache import SummaryCache
+from db import Database
+from summary import SummaryService, SummaryWindow
+
+class FakeLLM:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def summarize_messages(self, messages, time_period="общее", on_text=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return f"пересказ {len(messages)} сообщений"
+
+def test_single_flight_and_invalidation_by_new_messages(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = FakeLLM(delay=0.05)
+    service = SummaryService(db, SummaryCache(), llm_provider=lambda: llm)
+    window = SummaryWindow("recent")
+
+    async def scenario():
+        await db.save_message(-1, "Группа", 1, "user", "первое")
+        results = await asyncio.gather(*[service.summarize(-1, window) for _ in range(10)])
+        again = await service.summarize(-1, window)
+        await db.save_message(-1, "Группа", 1, "user", "второе")
+        fresh = await service.summarize(-1, window)
+        return results, again, fresh
+
+    results, again, fresh = asyncio.run(scenario())
+    db.close()
+    assert len(set(results)) == 1 and "пересказ 1 сообщений" in results[0]
+    assert again == results[0]
+    assert "пересказ 2 сообщений" in fresh
+    assert llm.calls == 2
+
+def test_errors_are_not_cached(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    cache = SummaryCache()
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        raise RuntimeError("LLM недоступна")
+
+    async def scenario():
+        for _ in range(2):
+            try:
+                await cache.get_or_compute("k", -1, failing)
+            except RuntimeError:
+                pass
+
+    asyncio.run(scenario())
+    db.close()
+    assert len(attempts) == 2
+    assert len(cache) == 0
+
+def test_lru_ttl_and_persistence(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+
+    async def scenario():
+        cache = SummaryCache(max_entries=2, ttl=60, db=db)
+        for key in ("a", "b", "c"):
+            await cache.set(key, -1, f"значение {key}")
+        in_memory = list(cache._entries)
+
+        # Новый экземпляр (как после перезапуска) читает записи из SQLite
+        restored = SummaryCache(db=db)
+        value = await restored.get("a")
+
+        expired = SummaryCache(ttl=-1)
+        await expired.set("x", -1, "устарело")
+        return in_memory, value, await expired.get("x")
+
+    in_memory, value, stale = asyncio.run(scenario())
+    db.close()
+    assert in_memory == ["b", "c"]
+    assert value == "значение a"
+    assert stale is None
@@ -0,0 +1,168 @@
+"""
+Тесты слоя доступа к базе данных
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+from db import Database, MIGRATIONS, LOCAL_TZ, day_bounds
+from monitoring import LoopLagMonitor
+
+def test_concurrent_reads_and_writes(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+
+    async def scenario():
+        writes = [db.save_message(-1, "Группа", i, f"user{i}", f"сообщение {i}") for i in range(50)]
+        reads = [db.get_recent_messages(-1, limit=10) for _ in range(50)]
+        await asyncio.gather(*writes, *reads)
+        return await db.get_recent_messages(-1, limit=100)
+
+    messages = asyncio.run(scenario())
+    db.close()
+    assert len(messages) == 50
+
+def test_queries_do_not_block_event_loop(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+
+    def slow_query(conn):
+        # Рекурсивный запрос на несколько сотен миллисекунд, SQLite отпускает GIL
+        conn.execute('''
+            WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 3000000)
+            SELECT SUM(x) FROM n
+        ''').fetchone()
+        return threading.current_thread().name
+
+    async def scenario():
+        monitor = LoopLagMonitor(interval=0.01)
+        monitor.start()
+        started = time.monotonic()
+        thread_name = await db._read(slow_query)
+        elapsed = time.monotonic() - started
+        await monitor.stop()
+        return thread_name, elapsed, monitor
+
+    thread_name, elapsed, monitor = asyncio.run(scenario())
+    db.close()
+    assert thread_name.startswith("db-reader")
+    assert monitor.samples > 0
+    assert monitor.max_ms < elapsed * 1000 / 2
+
+def test_connections_are_reused(tmp_path):
+    db = Database(str(tmp_path / "bot.db"), read_workers=1)
+
+    async def scenario():
+        for _ in range(20):
+            await db.get_today_messages(-1)
+
+    asyncio.run(scenario())
+    assert len(db._connections) == 1
+    db.close()
+
+def test_migration_of_legacy_database(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            chat_title TEXT,
+            user_id INTEGER,
+            username TEXT,
+            message_text TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE groups (
+            chat_id INTEGER PRIMARY KEY,
+            chat_title TEXT,
+            member_count INTEGER,
+            last_activity DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO messages (chat_id, chat_title, user_id, username, message_text, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+        [(-1, "Группа", 1, "user", "старое", "2024-01-01 10:00:00"),
+         (-1, "Группа", 1, "user", "новое", "2024-01-01 12:30:00")]
+    )
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    conn = sqlite3.connect(path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    stamps = [row[0] for row in conn.execute("SELECT ts FROM messages ORDER BY id")]
+    members = conn.execute("SELECT user_id, chat_id, message_count, last_seen FROM user_chats").fetchall()
+    plan = " ".join(row[3] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM messages WHERE chat_id = ? AND ts >= ? AND ts < ?", (-1, 0, 1)))
+
+    # Старая версия бота продолжает писать без ts - его заполняет триггер
+    conn.execute("INSERT INTO messages (chat_id, user_id, message_text, timestamp) VALUES (-1, 1, 'x', '2024-01-02 00:00:00')")
+    conn.commit()
+    late = conn.execute("SELECT ts FROM messages ORDER BY id DESC LIMIT 1").fetchone()[0]
+    conn.close()
+    db.close()
+
+    assert version == MIGRATIONS[-1][0]
+    assert stamps == [1704103200, 1704112200]
+    assert members == [(1, -1, 2, 1704112200)]
+    assert "idx_messages_chat_ts" in plan
+    assert late == 1704153600
+
+def test_new_database_uses_incremental_vacuum(tmp_path):
+    path = str(tmp_path / "bot.db")
+    Database(path).close()
+    conn = sqlite3.connect(path)
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.close()
+    assert mode == 2
+
+def test_day_bounds_respect_timezone():
+    moscow = ZoneInfo("Europe/Moscow")
+    start, end = day_bounds(date(2024, 1, 1), moscow)
+    assert start == 1704056400  # 2023-12-31 21:00 UTC
+    assert end - start == 24 * 3600
+
+def test_today_and_hours_windows(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    now = int(time.time())
+    rows = [(-1, "Группа", 1, "user", f"сообщение {age}", now - age * 3600) for age in (30, 5, 2, 0)]
+
+    async def scenario():
+        await db.save_messages_batch(rows)
+        return await db.get_recent_messages(-1, hours=3), await db.get_today_messages(-1)
+
+    recent, today = asyncio.run(scenario())
+    db.close()
+    assert [m['message_text'] for m in recent] == ["сообщение 2", "сообщение 0"]
+    assert recent[0]['chat_title'] == "Группа"
+    assert all(m['ts'] >= day_bounds(datetime.now(LOCAL_TZ).date(), LOCAL_TZ)[0] for m in today)
+    assert "сообщение 30" not in [m['message_text'] for m in today]
+
+def test_user_groups_from_membership_counters(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    rows = [
+        (-1, "Первая", 1, "alice", "привет", 1704103200),
+        (-1, "Первая", 2, "bob", "привет", 1704103300),
+        (-2, "Вторая", 1, "alice", "привет", 1704200000),
+        (-1, "Первая", 1, "alice", "ещё", 1704103400),
+    ]
+
+    async def scenario():
+        await db.save_messages_batch(rows[:2])
+        await db.save_messages_batch(rows[2:])
+        return await db.get_user_groups(1), await db.get_user_groups(2), await db.get_user_groups(3)
+
+    alice, bob, stranger = asyncio.run(scenario())
+    conn = sqlite3.connect(db.db_path)
+    plan = " ".join(row[3] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT chat_id FROM user_chats WHERE user_id = ?", (1,)))
+    conn.close()
+    db.close()
+
+    assert [(g['chat_id'], g['message_count']) for g in alice] == [(-2, 1), (-1, 3)]
+    assert [g['chat_title'] for g in bob] == ["Первая"]
+    assert stranger == []
+    assert "PRIMARY KEY" in plan
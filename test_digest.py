@@ -0,0 +1,114 @@
+"""
+Тесты дайджеста /summary all по всем группам пользователя
+"""
+import asyncio
+import time
+from cache import SummaryCache
+from db import Database
+from jobs import DIGEST_CHAT_ID, SummaryJobQueue
+from summary import SummaryService, parse_window
+
+class SlowLLM:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    async def summarize_messages(self, messages, time_period="общее", on_text=None):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+        return f"пересказ {len(messages)} сообщений"
+
+    async def combine_summaries(self, summaries, time_period="общее", on_text=None):
+        return await self.summarize_messages(summaries, time_period)
+
+class FakeBot:
+    def __init__(self):
+        self.edits = {}
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None):
+        self.edits.setdefault(message_id, []).append(text)
+
+async def _fill(db: Database):
+    now = int(time.time())
+    rows = []
+    for chat in range(1, 6):
+        rows += [(-chat, f"Группа {chat}", 1, "anna", f"сообщение {i}", now - 60) for i in range(chat)]
+    # В шестой группе пользователь есть, но сообщения старые
+    rows.append((-6, "Тихая", 1, "anna", "давно", now - 7 * 86400))
+    await db.save_messages_batch(rows)
+
+def test_digest_summarizes_active_groups_concurrently(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = SlowLLM(delay=0.2)
+    service = SummaryService(db, SummaryCache(), llm_provider=lambda: llm, digest_concurrency=3)
+    progress = []
+
+    async def report(text):
+        progress.append(text)
+
+    async def scenario():
+        await _fill(db)
+        started = time.monotonic()
+        digest = await service.digest(1, parse_window("3h"), report)
+        return digest, time.monotonic() - started
+
+    digest, elapsed = asyncio.run(scenario())
+    db.close()
+    # Пять групп по 0.2 с при трёх одновременных - две волны, а не сумма
+    assert elapsed < 0.7
+    assert llm.max_active == 3
+    assert digest.startswith("📬 Дайджест за последние 3 часов: групп с сообщениями - 5, без сообщений - 1")
+    # Самые активные группы первыми
+    assert digest.index("«Группа 5»") < digest.index("«Группа 1»")
+    assert "Тихая" not in digest
+    assert progress[0] == "🔄 Создаю пересказы для 5 групп..."
+
+def test_digest_loads_all_windows_in_one_query(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    service = SummaryService(db, SummaryCache(), llm_provider=lambda: SlowLLM(delay=0))
+    calls = {'batched': 0, 'single': 0}
+    batched, single = db.get_chats_window_messages, db.get_window_messages
+
+    async def count_batched(*args):
+        calls['batched'] += 1
+        return await batched(*args)
+
+    async def count_single(*args):
+        calls['single'] += 1
+        return await single(*args)
+
+    db.get_chats_window_messages, db.get_window_messages = count_batched, count_single
+
+    async def scenario():
+        await _fill(db)
+        return await service.digest(1, parse_window("3h"))
+
+    digest = asyncio.run(scenario())
+    db.close()
+    assert calls == {'batched': 1, 'single': 0}
+    assert "«Группа 4»" in digest and "пересказ 4 сообщений" in digest
+
+def test_digest_jobs_are_per_user(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = SlowLLM(delay=0.0)
+    service = SummaryService(db, SummaryCache(), llm_provider=lambda: llm)
+    queue = SummaryJobQueue(db, service, workers=2)
+    bot = FakeBot()
+
+    async def scenario():
+        await _fill(db)
+        # Пользователь 2 не состоит ни в одной группе
+        await queue.submit(1, DIGEST_CHAT_ID, "3h", None, 1, 10)
+        await queue.submit(2, DIGEST_CHAT_ID, "3h", None, 2, 20)
+        await queue.start(bot)
+        while queue.depth or queue.running:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+    asyncio.run(scenario())
+    db.close()
+    assert bot.edits[10][-1].startswith("📬 Дайджест за последние 3 часов")
+    assert bot.edits[20][-1] == "❌ Нет сообщений за последние 3 часов ни в одной из ваших групп."
@@ -0,0 +1,71 @@
+"""
+Тесты локального отбора сообщений
+"""
+import time
+from extract import ExtractiveSelector, select_messages
+from prompt import PromptCompiler, estimate_tokens
+
+def _msg(i, user_id, text, ts, username=None):
+    return {'id': i, 'user_id': user_id, 'username': username or f"user{user_id}",
+            'message_text': text, 'ts': ts}
+
+def test_selection_fits_budget_in_order():
+    messages = [_msg(i, i % 7, f"обсуждаем вариант номер {i} деплоя сервиса {'альфа' if i % 2 else 'бета'} "
+                               f"и проблему {i * 37}", i * 600) for i in range(200)]
+    selection = select_messages(messages, 300)
+    assert 0 < len(selection.messages) < len(messages)
+    assert selection.tokens <= 300
+    ids = [msg['id'] for msg in selection.messages]
+    assert ids == sorted(ids)
+    assert "Отобрано" in selection.explain()
+
+def test_near_duplicates_and_noise_skipped():
+    messages = [_msg(0, 1, "завтра релиз новой версии сервера платежей в десять утра", 0),
+                _msg(1, 2, "завтра релиз новой версии сервера платежей в десять утра!!", 1000),
+                _msg(2, 3, "ок", 2000),
+                _msg(3, 4, "https://example.com/page", 3000),
+                _msg(4, 5, "кто проверит миграцию базы перед выкладкой?", 4000)]
+    selection = ExtractiveSelector().select(messages, 1000)
+    statuses = {item.message_id: item.status for item in selection.scored}
+    assert sorted(statuses.values()).count("duplicate") == 1
+    assert statuses[2] == statuses[3] == "noise"
+    assert statuses[4] == "selected"
+
+def test_replies_and_mentions_raise_score():
+    messages = [_msg(0, 1, "предлагаю перенести встречу команды на четверг", 0, "lead"),
+                _msg(1, 2, "согласен перенести встречу команды", 30),
+                _msg(2, 3, "поддерживаю вариант @lead насчёт встречи", 60),
+                _msg(3, 4, "предлагаю перенести встречу отдела на пятницу", 5000),
+                _msg(4, 1, "тогда решено перенести встречу", 9000, "lead")]
+    scored = {item.message_id: item for item in ExtractiveSelector(reply_window=120).select(messages, 1000).scored}
+    assert scored[0].replies > scored[3].replies
+    assert scored[0].mentions > 0 and scored[3].mentions == 0
+    assert scored[0].score > scored[3].score
+
+def test_large_window_is_fast():
+    words = ["релиз", "сервер", "база", "миграция", "тесты", "деплой", "ошибка", "логи", "метрики",
+             "очередь", "кэш", "запрос", "ответ", "клиент", "платёж", "отчёт", "встреча", "задача"]
+    messages = [_msg(i, i % 50, " ".join(words[(i * k) % len(words)] for k in range(1, 2 + i % 9)), i * 5)
+                for i in range(10000)]
+    started = time.perf_counter()
+    selection = select_messages(messages, 2500)
+    elapsed = time.perf_counter() - started
+    assert selection.tokens <= 2500
+    assert elapsed < 1.0
+
+def test_compiler_uses_selector_only_over_budget():
+    messages = [_msg(i, i % 5, f"сообщение про задачу {i} с подробностями номер {i * 13}", 1700000000 + i * 60)
+                for i in range(300)]
+    compiler = PromptCompiler(token_budget=400, selector=select_messages)
+    text, report = compiler.compile(messages)
+    assert report.extracted_out > 0 and report.selection is not None
+    assert estimate_tokens(text) <= 400
+    assert "selection" not in report.as_dict()
+
+    _, small = compiler.compile(messages[:5])
+    assert small.extracted_out == 0 and small.selection is None
+
+def test_band_keys_do_not_depend_on_hash_seed():
+    # Одинаковые ключи в любом процессе, независимо от PYTHONHASHSEED
+    keys = ExtractiveSelector._band_keys({"релиз", "сервер", "платежи"})
+    assert keys == [(0, 623966551, 713400657), (2, 453455311, 1672744878)]
@@ -0,0 +1,94 @@
+"""
+Тесты локальной выжимки и срока ответа на пересказ
+"""
+import asyncio
+import time
+from cache import SummaryCache
+from db import Database
+from fallback import FALLBACK_NOTICE, LocalSummarizer
+from routing import LLMUnavailableError
+from summary import SummaryService, SummaryWindow
+from topics import TopicSegmenter
+
+class SlowLLM:
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def summarize_messages(self, messages, time_period="общее", on_text=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return f"пересказ {len(messages)} сообщений"
+
+def _messages():
+    base = 1700000000
+    texts = ["Когда выкатываем релиз бота?", "Релиз бота в пятницу после тестов",
+             "Тесты релиза ещё падают на сервере", "Кто идёт на футбол в субботу?",
+             "Я на футбол иду, стадион в центре", "Футбол начнётся в семь на стадионе"]
+    return [{'id': i + 1, 'user_id': i % 3, 'username': f"user{i % 3}", 'message_text': text,
+             'timestamp': base + i * 60 if i < 3 else base + 7200 + i * 60}
+            for i, text in enumerate(texts)]
+
+def test_local_summary_lists_topics_and_stats():
+    summary = LocalSummarizer(TopicSegmenter(min_size=2)).summarize(_messages())
+    assert summary.startswith(FALLBACK_NOTICE)
+    assert "Тема 1" in summary and "Тема 2" in summary
+    assert "релиз" in summary and "футбол" in summary
+    assert summary.endswith("📊 Статистика: 6 сообщений от 3 участников")
+
+def test_deadline_returns_local_summary_and_caches_llm_result(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = SlowLLM(delay=0.5)
+    service = SummaryService(db, SummaryCache(), llm_provider=lambda: llm, deadline=0.1)
+    window = SummaryWindow("recent")
+
+    async def scenario():
+        for msg in _messages():
+            await db.save_message(-1, "Группа", msg['user_id'], msg['username'], msg['message_text'])
+        started = time.monotonic()
+        first = await service.summarize(-1, window)
+        elapsed = time.monotonic() - started
+        # Пересказ LLM достраивается в фоне и отдаётся следующему запросу из кэша
+        await asyncio.sleep(0.6)
+        second = await service.summarize(-1, window)
+        return first, elapsed, second
+
+    first, elapsed, second = asyncio.run(scenario())
+    db.close()
+    assert elapsed < 0.4
+    assert FALLBACK_NOTICE in first
+    assert "пересказ 6 сообщений" in second
+    assert llm.calls == 1
+
+def test_unavailable_llm_falls_back_without_caching(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = SlowLLM(error=LLMUnavailableError("Все модели исчерпали бюджет ошибок"))
+    service = SummaryService(db, SummaryCache(), llm_provider=lambda: llm)
+    window = SummaryWindow("recent")
+
+    async def scenario():
+        await db.save_message(-1, "Группа", 1, "user", "Когда релиз?")
+        return [await service.summarize(-1, window) for _ in range(2)]
+
+    results = asyncio.run(scenario())
+    db.close()
+    assert all(FALLBACK_NOTICE in result for result in results)
+    assert llm.calls == 2
+
+def test_fallback_is_bounded_to_recent_limit(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    service = SummaryService(db, SummaryCache(), llm_provider=lambda: SlowLLM(delay=0.5), deadline=0.1)
+    now = int(time.time())
+    rows = [(-1, "Группа", i % 5, f"user{i % 5}", f"сообщение номер {i}", now - 3000 + i) for i in range(250)]
+
+    async def scenario():
+        await db.save_messages_batch(rows)
+        return await service.summarize(-1, SummaryWindow("hours", hours=2))
+
+    summary = asyncio.run(scenario())
+    db.close()
+    assert FALLBACK_NOTICE in summary
+    assert "📊 Статистика: 200 сообщений" in summary
@@ -0,0 +1,63 @@
+"""
+Тесты буфера последних сообщений
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from db import Database
+from hotbuffer import HotBuffer
+from ingest import MessageIngestor
+
+def _ids(messages):
+    return [msg['id'] for msg in messages]
+
+def test_windows_match_database(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    hot = HotBuffer(db, max_messages=5)
+    ingestor = MessageIngestor(db)
+    ingestor.add_listener(hot.on_flush)
+    now = int(time.time())
+
+    async def scenario():
+        # Сообщения из прошлого запуска: буфер дочитает их из базы
+        await db.save_messages_batch([(-1, "Группа", 1, "old", f"старое {i}", now - 7200 + i) for i in range(3)])
+        for i in range(7):
+            await ingestor.submit(-1, "Группа", 2, "new", f"новое {i}",
+                                  date=datetime.fromtimestamp(now - 30 + i, timezone.utc))
+        recent = await hot.get_recent_messages(-1, limit=3)
+        # Буфер прогрет последними 5 сообщениями: полностью покрыто всё, что позже самого раннего из них
+        hours = await hot.get_window_messages(-1, now - 27, now + 60)
+        hits = hot.hits
+        # Окно больше буфера отдаётся из базы
+        everything = await hot.get_recent_messages(-1, limit=10)
+        expected = await db.get_recent_messages(-1, limit=10)
+        return recent, hours, hits, everything, expected
+
+    recent, hours, hits, everything, expected = asyncio.run(scenario())
+    db.close()
+    assert [msg['message_text'] for msg in recent] == ["новое 4", "новое 5", "новое 6"]
+    assert recent[0]['timestamp'] and recent[0].get('username') == "new"
+    assert len(hours) == 4 and all(msg['message_text'].startswith("новое") for msg in hours)
+    assert hits == 2
+    assert _ids(everything) == _ids(expected) and len(everything) == 10
+    assert hot.misses == 1
+
+def test_warm_serves_small_chat_and_memory_cap(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    hot = HotBuffer(db, max_messages=100, max_bytes=2000)
+    now = int(time.time())
+
+    async def scenario():
+        await db.save_messages_batch([(-1, "Группа", 1, "user", "x" * 200, now - 100 + i) for i in range(20)])
+        await db.save_messages_batch([(-2, "Другая", 1, "user", "коротко", now)])
+        small = await hot.get_window_messages(-2, 0, now + 1)
+        large = await hot.get_window_messages(-1, 0, now + 1)
+        return small, large
+
+    small, large = asyncio.run(scenario())
+    db.close()
+    report = hot.memory_report()
+    assert len(small) == 1 and len(large) == 20
+    assert report['per_chat'][-1]['bytes'] <= 2000
+    assert report['per_chat'][-1]['messages'] < 20
+    assert hot.hits == 1 and hot.misses == 1
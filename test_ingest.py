@@ -0,0 +1,93 @@
+"""
+Тесты конвейера пакетной записи сообщений
+"""
+import asyncio
+import sqlite3
+from db import Database
+from ingest import MessageIngestor
+
+def _count(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_batch_flush_by_size(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    ingestor = MessageIngestor(db, queue_size=100, batch_size=10, flush_interval=60)
+
+    async def scenario():
+        await ingestor.start()
+        for i in range(25):
+            await ingestor.submit(-100 - i % 2, "Группа", i, f"user{i}", f"сообщение {i}")
+        # Два полных пакета записываются без ожидания таймера
+        await asyncio.sleep(0.05)
+        flushed = _count(db.db_path, "messages")
+        await ingestor.stop()
+        return flushed
+
+    flushed = asyncio.run(scenario())
+    assert flushed >= 20
+    assert _count(db.db_path, "messages") == 25
+    assert _count(db.db_path, "groups") == 2
+
+def test_flush_by_interval_and_backpressure(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    ingestor = MessageIngestor(db, queue_size=5, batch_size=100, flush_interval=0.01)
+
+    async def scenario():
+        await ingestor.start()
+        # Очередь меньше числа сообщений - submit ждёт, пока пакет запишется
+        for i in range(50):
+            await ingestor.submit(-1, "Группа", 1, "user", f"сообщение {i}")
+        await ingestor.stop()
+
+    asyncio.run(scenario())
+    assert _count(db.db_path, "messages") == 50
+
+def test_batch_returns_sequential_ids(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    rows = [(-1, "Группа", 1, "user", f"текст {i}", 1704103200) for i in range(3)]
+    first = asyncio.run(db.save_messages_batch(rows))
+    second = asyncio.run(db.save_messages_batch(rows))
+    assert first == [1, 2, 3]
+    assert second == [4, 5, 6]
+
+class FlakyDatabase(Database):
+    """Первые failures записей пакетов завершаются ошибкой"""
+
+    def __init__(self, path, failures):
+        super().__init__(path)
+        self.failures = failures
+
+    async def save_messages_batch(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        return await super().save_messages_batch(rows)
+
+def test_failed_batch_is_retried_then_dropped(tmp_path):
+    from metrics import INGEST_DROPPED
+    dropped_before = INGEST_DROPPED.value()
+    flaky = FlakyDatabase(str(tmp_path / "flaky.db"), failures=2)
+    broken = FlakyDatabase(str(tmp_path / "broken.db"), failures=100)
+
+    async def scenario():
+        dropped = []
+        for db in (flaky, broken):
+            ingestor = MessageIngestor(db, queue_size=100, batch_size=10, flush_interval=0.01,
+                                       max_retries=3, retry_delay=0.01)
+            await ingestor.start()
+            for i in range(5):
+                await ingestor.submit(-1, "Группа", 1, "user", f"сообщение {i}")
+            await ingestor.stop()
+            dropped.append(ingestor.dropped)
+        return dropped
+
+    dropped = asyncio.run(scenario())
+    # Временная ошибка переживается повторами; потеря видна в метрике
+    assert dropped == [0, 5]
+    assert _count(flaky.db_path, "messages") == 5
+    assert broken.failures == 100 - 4
+    assert INGEST_DROPPED.value() - dropped_before == 5
@@ -0,0 +1,141 @@
+"""
+Тесты фоновой очереди пересказов
+"""
+import asyncio
+from db import Database
+from jobs import QueueFullError, SummaryJobQueue
+from outbound import PRIORITY_INTERACTIVE, PRIORITY_PROGRESS, _priority
+from streaming import MessageStream
+
+class FakeBot:
+    def __init__(self):
+        self.edits = {}
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None):
+        self.edits.setdefault(message_id, []).append(text)
+
+class FakeService:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def summarize(self, chat_id, window, group_title=None, progress=None, on_text=None):
+        self.calls.append((chat_id, window.cache_key()))
+        await progress("🔄 Создаю пересказ по 1 сообщениям...")
+        await asyncio.sleep(self.delay)
+        return f"пересказ {chat_id}"
+
+def test_fairness_and_dedup(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    service = FakeService(delay=0.01)
+    bot = FakeBot()
+    queue = SummaryJobQueue(db, service, workers=1, max_per_user=10)
+
+    async def scenario():
+        # Пользователь 1 ставит три задачи, затем пользователь 2 - одну
+        for chat_id in (-1, -2, -3):
+            await queue.submit(1, chat_id, "3h", None, 1, chat_id)
+        await queue.submit(2, -4, "3h", None, 2, -4)
+        # Такой же пересказ от другого пользователя не выполняется повторно
+        await queue.submit(3, -1, "3h", None, 3, 100)
+        await queue.start(bot)
+        while queue.depth or queue.running:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return await db.get_unfinished_summary_jobs()
+
+    unfinished = asyncio.run(scenario())
+    db.close()
+    assert [chat_id for chat_id, _ in service.calls] == [-1, -4, -2, -3]
+    assert bot.edits[100][-1] == "пересказ -1"
+    assert bot.edits[-1][0].startswith("🔄")
+    assert unfinished == []
+    assert queue.stats()['completed'] == 4
+
+def test_failed_delivery_releases_user_limit(tmp_path, monkeypatch):
+    async def fail(self, text):
+        raise RuntimeError("Telegram недоступен")
+
+    monkeypatch.setattr(MessageStream, "finish", fail)
+    db = Database(str(tmp_path / "bot.db"))
+    queue = SummaryJobQueue(db, FakeService(), workers=1, max_per_user=1)
+
+    async def scenario():
+        await queue.submit(1, -1, "3h", None, 1, 1)
+        await queue.start(FakeBot())
+        while queue.depth or queue.running:
+            await asyncio.sleep(0.01)
+        # Лимит освобождён: пользователь может поставить следующую задачу
+        await queue.submit(1, -2, "3h", None, 1, 2)
+        while queue.depth or queue.running:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return await db.get_unfinished_summary_jobs()
+
+    unfinished = asyncio.run(scenario())
+    db.close()
+    assert unfinished == []
+    assert queue.stats()['completed'] == 2
+
+def test_final_result_is_sent_at_reply_priority(tmp_path):
+    class PriorityBot(FakeBot):
+        async def edit_message_text(self, text, chat_id=None, message_id=None):
+            await super().edit_message_text((_priority.get(), text), chat_id, message_id)
+
+    db = Database(str(tmp_path / "bot.db"))
+    bot = PriorityBot()
+    queue = SummaryJobQueue(db, FakeService(delay=0.05), workers=1)
+
+    async def scenario():
+        await queue.submit(1, -1, "3h", None, 1, 1)
+        await queue.start(bot)
+        while queue.depth or queue.running:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+    asyncio.run(scenario())
+    db.close()
+    # Ход работы уступает ответам, итоговый пересказ - нет
+    assert bot.edits[1] == [(PRIORITY_PROGRESS, "🔄 Создаю пересказ по 1 сообщениям..."),
+                            (PRIORITY_INTERACTIVE, "пересказ -1")]
+
+def test_per_user_limit(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    queue = SummaryJobQueue(db, FakeService(), max_per_user=2)
+
+    async def scenario():
+        await queue.submit(1, -1, "today", None, 1, 1)
+        await queue.submit(1, -2, "today", None, 1, 2)
+        try:
+            await queue.submit(1, -3, "today", None, 1, 3)
+        except QueueFullError:
+            return True
+        return False
+
+    rejected = asyncio.run(scenario())
+    db.close()
+    assert rejected
+
+def test_jobs_survive_restart(tmp_path):
+    path = str(tmp_path / "bot.db")
+    db = Database(path)
+    asyncio.run(SummaryJobQueue(db, FakeService()).submit(1, -1, "recent", "Группа", 1, 7))
+    db.close()
+
+    db = Database(path)
+    service = FakeService()
+    bot = FakeBot()
+    queue = SummaryJobQueue(db, service)
+
+    async def scenario():
+        await queue.start(bot)
+        while queue.depth or queue.running:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return await db.get_unfinished_summary_jobs()
+
+    unfinished = asyncio.run(scenario())
+    db.close()
+    assert service.calls == [(-1, "recent")]
+    assert bot.edits[7][-1] == "пересказ -1"
+    assert unfinished == []
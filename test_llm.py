@@ -0,0 +1,142 @@
+"""
+Тесты клиента LLM на локальной заглушке OpenAI
+"""
+import asyncio
+import time
+from aiohttp import web
+from bench import FakeOpenAI
+from llm import LLMService
+
+def _completion(content: str) -> dict:
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "stub",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+async def _start_stub(delay: float = 0.0, failures: int = 0):
+    """Заглушка /v1/chat/completions: первые failures ответов - 429"""
+    state = {"calls": 0}
+
+    async def completions(request):
+        state["calls"] += 1
+        if state["calls"] <= failures:
+            return web.json_response({"error": {"message": "rate limit"}}, status=429)
+        await asyncio.sleep(delay)
+        return web.json_response(_completion("Краткий пересказ"))
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/v1", state
+
+def test_retries_on_rate_limit():
+    async def scenario():
+        runner, url, state = await _start_stub(failures=2)
+        llm = LLMService(base_url=url, backoff_base=0.01)
+        try:
+            summary = await llm.generate_summary([{"user_id": 1, "username": "u", "message_text": "текст"}])
+        finally:
+            await llm.close()
+            await runner.cleanup()
+        return summary, state["calls"]
+
+    summary, calls = asyncio.run(scenario())
+    assert summary.startswith("Краткий пересказ")
+    assert calls == 3
+
+def test_concurrent_requests_do_not_serialize():
+    async def scenario():
+        runner, url, _ = await _start_stub(delay=0.3)
+        llm = LLMService(base_url=url, concurrency=10)
+        try:
+            started = time.monotonic()
+            await asyncio.gather(*[
+                llm.chat_completion([{"role": "user", "content": "привет"}]) for _ in range(5)
+            ])
+            return time.monotonic() - started
+        finally:
+            await llm.close()
+            await runner.cleanup()
+
+    assert asyncio.run(scenario()) < 1.0
+
+def test_concurrency_limit():
+    async def scenario():
+        runner, url, _ = await _start_stub(delay=0.2)
+        llm = LLMService(base_url=url, concurrency=1)
+        try:
+            started = time.monotonic()
+            await asyncio.gather(*[
+                llm.chat_completion([{"role": "user", "content": "привет"}]) for _ in range(3)
+            ])
+            return time.monotonic() - started
+        finally:
+            await llm.close()
+            await runner.cleanup()
+
+    assert asyncio.run(scenario()) >= 0.6
+
+def test_streamed_summary_reports_partial_text():
+    async def scenario():
+        fake = FakeOpenAI(delay=0.5)
+        url = await fake.start()
+        llm = LLMService(base_url=url, streaming=True)
+        partial = []
+        started = time.monotonic()
+
+        async def on_text(text):
+            partial.append((time.monotonic() - started, text))
+
+        try:
+            summary = await llm.summarize_messages([{"user_id": 1, "username": "u", "message_text": "текст"}],
+                                                   on_text=on_text)
+        finally:
+            await llm.close()
+            await fake.stop()
+        return summary, partial
+
+    summary, partial = asyncio.run(scenario())
+    assert summary.startswith(FakeOpenAI.CONTENT) and "📊 Статистика" in summary
+    # Первый фрагмент приходит задолго до конца ответа, текст накапливается
+    assert partial[0][0] < 0.3 and len(partial) > 1
+    assert partial[-1][1] == FakeOpenAI.CONTENT
+    assert all(later.startswith(earlier) for (_, earlier), (_, later) in zip(partial, partial[1:]))
+
+def test_prompt_compilation_does_not_block_event_loop():
+    messages = [{"id": i, "user_id": i % 50, "username": f"u{i % 50}", "ts": 1700000000 + i,
+                 "message_text": f"обсуждаем релиз номер {i} сервиса {i * 37} и миграцию базы {i % 13}"}
+                for i in range(10000)]
+
+    async def scenario():
+        llm = LLMService(base_url="http://127.0.0.1:9/v1")
+        gaps = []
+
+        async def ticker():
+            last = time.monotonic()
+            while True:
+                await asyncio.sleep(0.005)
+                now = time.monotonic()
+                gaps.append(now - last)
+                last = now
+
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0.02)
+        try:
+            prompt = await llm._format(messages)
+            await asyncio.sleep(0.02)
+        finally:
+            task.cancel()
+            await llm.close()
+        return prompt, max(gaps)
+
+    # Отбор и сжатие большого окна идут в потоке: цикл событий продолжает работать
+    prompt, max_gap = asyncio.run(scenario())
+    assert prompt and max_gap < 0.05
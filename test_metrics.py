@@ -0,0 +1,35 @@
+"""
+Тесты реестра метрик
+"""
+import asyncio
+from db import Database
+from metrics import DB_LATENCY, MetricsRegistry
+
+def test_histogram_render():
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_seconds", "Задержка", ("method",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value, 'get "x"')
+    registry.gauge("test_depth", "Глубина").set_function(lambda: 7)
+
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{method="get \\"x\\"",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{method="get \\"x\\"",le="1.0"} 3' in text
+    assert 'test_seconds_bucket{method="get \\"x\\"",le="+Inf"} 4' in text
+    assert 'test_seconds_count{method="get \\"x\\""} 4' in text
+    assert 'test_depth 7.0' in text
+
+def test_database_methods_are_timed(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    before = DB_LATENCY.count("get_recent_messages")
+
+    async def scenario():
+        await db.save_message(-1, "Группа", 1, "user", "текст")
+        await db.get_recent_messages(-1)
+        return await db.ping()
+
+    assert asyncio.run(scenario())
+    db.close()
+    assert DB_LATENCY.count("get_recent_messages") == before + 1
+    assert DB_LATENCY.count("save_messages_batch") >= 1
@@ -0,0 +1,115 @@
+"""
+Тесты центральной отправки запросов к Telegram
+"""
+import asyncio
+import time
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage
+from outbound import PRIORITY_PROGRESS, OutboundSender, outbound_priority
+
+class FakeTelegram:
+    """make_request с лимитом на чат: чаще раза в min_interval - RetryAfter"""
+
+    def __init__(self, min_interval: float = 0.0, retry_after: int = 1, delay: float = 0.0):
+        self.min_interval = min_interval
+        self.retry_after = retry_after
+        self.delay = delay
+        self.calls = []
+        self.last = {}
+        self.flood = 0
+
+    async def __call__(self, bot, method):
+        now = time.monotonic()
+        if self.min_interval and now - self.last.get(method.chat_id, -1e9) < self.min_interval * 0.9:
+            self.flood += 1
+            raise TelegramRetryAfter(method, "Too Many Requests", self.retry_after)
+        self.last[method.chat_id] = now
+        await asyncio.sleep(self.delay)
+        self.calls.append(method)
+        return getattr(method, 'text', None)
+
+def test_interactive_replies_go_first():
+    telegram = FakeTelegram()
+    sender = OutboundSender(global_rate=20, chat_rate=1000, chat_burst=10)
+
+    async def scenario():
+        with outbound_priority(PRIORITY_PROGRESS):
+            progress = [asyncio.create_task(sender(telegram, None, EditMessageText(
+                chat_id=i, message_id=1, text=f"ход {i}"))) for i in range(1, 41)]
+        await asyncio.sleep(0.06)
+        reply = asyncio.create_task(sender(telegram, None, SendMessage(chat_id=99, text="ответ")))
+        await asyncio.gather(reply, *progress)
+
+    asyncio.run(scenario())
+    texts = [method.text for method in telegram.calls]
+    # Запас ведра (20 запросов) уходит сразу, дальше ответ обгоняет правки, ждавшие раньше него
+    assert texts.index("ответ") <= 22
+    assert len(texts) == 41
+
+def test_coalesced_edit_takes_highest_priority():
+    telegram = FakeTelegram()
+    sender = OutboundSender(global_rate=20, chat_rate=1000, chat_burst=10)
+
+    async def scenario():
+        with outbound_priority(PRIORITY_PROGRESS):
+            progress = [asyncio.create_task(sender(telegram, None, EditMessageText(
+                chat_id=i, message_id=1, text=f"ход {i}"))) for i in range(1, 41)]
+        await asyncio.sleep(0.06)
+        # Итог сливается с ещё не ушедшей правкой хода работы того же сообщения
+        final = asyncio.create_task(sender(telegram, None, EditMessageText(
+            chat_id=40, message_id=1, text="итог")))
+        return await asyncio.gather(final, *progress)
+
+    results = asyncio.run(scenario())
+    texts = [method.text for method in telegram.calls]
+    assert "ход 40" not in texts and results[0] == results[-1] == "итог"
+    assert texts.index("итог") <= 22
+
+def test_superseded_edits_are_coalesced():
+    telegram = FakeTelegram(delay=0.01)
+    sender = OutboundSender(global_rate=100, chat_rate=5, chat_burst=1)
+
+    async def scenario():
+        calls = []
+        for i in range(10):
+            calls.append(asyncio.create_task(sender(telegram, None, EditMessageText(
+                chat_id=1, message_id=7, text=f"версия {i}"))))
+            await asyncio.sleep(0.03)
+        return await asyncio.gather(*calls)
+
+    results = asyncio.run(scenario())
+    sent = [method.text for method in telegram.calls]
+    # 0.3 с правок при 5 в секунду: уходят первая и последняя, остальные слиты
+    assert len(sent) <= 3 and sent[-1] == "версия 9"
+    assert results[-1] == "версия 9" and all(result is not None for result in results)
+    assert sender.coalesced >= 6
+
+def test_retry_after_is_honored():
+    telegram = FakeTelegram(min_interval=0.5, retry_after=1)
+    # Лимит на чат выше, чем позволяет "Telegram": вторая отправка получит RetryAfter
+    sender = OutboundSender(global_rate=100, chat_rate=100, chat_burst=5)
+
+    async def scenario():
+        started = time.monotonic()
+        await asyncio.gather(*[sender(telegram, None, SendMessage(chat_id=1, text=str(i))) for i in range(2)])
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    assert [method.text for method in telegram.calls] == ["0", "1"]
+    assert telegram.flood == 1 and sender.retried == 1
+    assert elapsed >= 1.0
+
+def test_throughput_near_limits_without_flood():
+    telegram = FakeTelegram(min_interval=0.1)
+    sender = OutboundSender(global_rate=100, chat_rate=10, chat_burst=1)
+
+    async def scenario():
+        started = time.monotonic()
+        await asyncio.gather(*[sender(telegram, None, SendMessage(chat_id=i % 20, text=str(i)))
+                               for i in range(100)])
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    # 20 чатов по 5 сообщений при 10 в секунду на чат - около 0.4 с
+    assert len(telegram.calls) == 100 and telegram.flood == 0
+    assert elapsed < 1.0
@@ -0,0 +1,41 @@
+"""
+Тесты компилятора промпта
+"""
+from prompt import PromptCompiler, estimate_tokens, is_noise
+
+def _msg(ts, username, text):
+    return {'ts': ts, 'username': username, 'user_id': hash(username), 'message_text': text}
+
+def test_compaction_aliases_and_collapse():
+    messages = [
+        _msg(1000, "ivan_petrov", "Когда релиз?"),
+        _msg(1030, "ivan_petrov", "Нужно успеть до пятницы"),
+        _msg(1100, "maria", "+1"),
+        _msg(1200, "maria", "https://example.com/issue/1"),
+        _msg(1300, "maria", "Давайте в четверг"),
+        _msg(1400, "olga", "Давайте в четверг"),
+        _msg(4600, "ivan_petrov", "Договорились, четверг"),
+    ]
+    text, report = PromptCompiler(token_budget=1000).compile(messages)
+
+    assert "U1=ivan_petrov" in text and "U2=maria" in text
+    assert "[+0] U1: Когда релиз? / Нужно успеть до пятницы" in text
+    assert "[+60] U1: Договорились, четверг" in text
+    assert "example.com" not in text and "+1" not in text
+    assert (report.noise, report.duplicates, report.collapsed) == (2, 1, 1)
+    assert report.lines == 3
+
+def test_budget_is_respected_and_reported():
+    messages = [_msg(i * 600, f"user{i % 5}", f"Сообщение номер {i} про архитектуру сервиса") for i in range(300)]
+    text, report = PromptCompiler(token_budget=500).compile(messages)
+
+    assert estimate_tokens(text) <= 520
+    assert report.dropped_for_budget > 0
+    assert report.lines + report.dropped_for_budget == 300
+    # Начало и конец обсуждения сохраняются
+    assert "номер 0 " in text and "номер 299 " in text
+    assert report.tokens < report.raw_tokens
+
+def test_noise_detection():
+    assert is_noise("+1") and is_noise("Ок!") and is_noise("👍👍") and is_noise("https://t.me/x")
+    assert not is_noise("ок, берём второй вариант")
@@ -0,0 +1,63 @@
+"""
+Тесты архивации старых сообщений
+"""
+import asyncio
+import sqlite3
+import time
+from db import Database
+from retention import MessageArchive, RetentionManager
+from summarizer import ChunkSummarizer
+
+DAY = 86400
+
+def test_old_messages_move_to_archive(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    archive = MessageArchive(str(tmp_path / "archive"))
+    retention = RetentionManager(db, archive, default_days=30, batch_size=7)
+    now = int(time.time())
+    rows = [(-1, "Группа", 1, "user", f"старое {i}", now - 40 * DAY + i) for i in range(20)]
+    rows += [(-1, "Группа", 2, "other", f"новое {i}", now - DAY + i) for i in range(5)]
+    rows += [(-2, "Другая", 1, "user", "старое", now - 40 * DAY)]
+
+    async def scenario():
+        await db.save_messages_batch(rows)
+        # Для второй группы срок хранения не ограничен
+        await db.set_retention_days(-2, 0)
+        moved = await retention.run_once(now)
+        hot = await db.get_window_messages(-1, 0, now + 1)
+        other = await db.get_window_messages(-2, 0, now + 1)
+        archived = await archive.get_messages(-1, now - 50 * DAY, now)
+        return moved, hot, other, archived, await db.get_user_groups(1), await db.get_user_groups(2)
+
+    moved, hot, other, archived, groups, other_groups = asyncio.run(scenario())
+    members = dict(sqlite3.connect(db.db_path).execute(
+        "SELECT user_id, message_count FROM user_chats WHERE chat_id = -1").fetchall())
+    db.close()
+    assert moved == 20
+    # Счётчики групп и участников не учитывают перенесённые в архив сообщения
+    assert {group['chat_id']: group['message_count'] for group in groups} == {-1: 5, -2: 1}
+    assert [group['message_count'] for group in other_groups] == [5]
+    assert members == {1: 0, 2: 5}
+    assert [msg['message_text'] for msg in hot] == [f"новое {i}" for i in range(5)]
+    assert len(other) == 1
+    assert [msg['message_text'] for msg in archived] == [f"старое {i}" for i in range(20)]
+    assert archived[0]['timestamp']
+
+def test_long_window_reads_archive(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    archive = MessageArchive(str(tmp_path / "archive"))
+    retention = RetentionManager(db, archive, default_days=30)
+    summarizer = ChunkSummarizer(db, background=False, archive=archive)
+    now = int(time.time())
+
+    async def scenario():
+        await db.save_messages_batch([(-1, "Группа", 1, "user", "давно", now - 60 * DAY),
+                                      (-1, "Группа", 1, "user", "вчера", now - DAY)])
+        await retention.run_once(now)
+        # Повторная запись того же сообщения в архив не даёт дублей
+        archive.append(-1, await archive.get_messages(-1, 0, now))
+        return await summarizer.plan_window(-1, now - 90 * DAY, now)
+
+    plan = asyncio.run(scenario())
+    db.close()
+    assert [msg['message_text'] for msg in plan.raw] == ["давно", "вчера"]
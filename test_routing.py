@@ -0,0 +1,60 @@
+"""
+Тесты выбора модели по размеру запроса, задержкам и ошибкам
+"""
+import pytest
+import routing
+from routing import LLMUnavailableError, ModelRouter, parse_routes
+
+def _request(tokens: int):
+    # estimate_tokens считает примерно 4 символа на токен
+    return [{"role": "user", "content": "слово " * (tokens * 4 // 6)}]
+
+def test_parse_routes():
+    assert parse_routes("gpt-4o-mini:128000, gpt-3.5-turbo:16385") == [("gpt-4o-mini", 128000),
+                                                                      ("gpt-3.5-turbo", 16385)]
+    with pytest.raises(ValueError):
+        parse_routes("gpt-4o-mini")
+
+def test_output_limit_follows_input_size():
+    router = ModelRouter("fast:16000", min_output_tokens=150)
+    assert router.route(_request(40), 500) == ("fast", 150)
+    assert router.route(_request(2000), 500) == ("fast", 500)
+
+def test_large_requests_go_to_model_with_larger_context():
+    router = ModelRouter("small:4000,large:128000")
+    assert router.route(_request(100), 500)[0] == "small"
+    assert router.route(_request(10000), 500)[0] == "large"
+    with pytest.raises(LLMUnavailableError):
+        router.route(_request(200000), 500)
+
+def test_slow_model_is_skipped_until_it_recovers():
+    router = ModelRouter("primary:16000,backup:16000", slo_seconds=5)
+    for _ in range(10):
+        router.observe("primary", 12.0, True)
+        router.observe("backup", 2.0, True)
+    assert router.route(_request(100), 500)[0] == "backup"
+    # Обе медленнее цели - берётся самая быстрая
+    for _ in range(50):
+        router.observe("backup", 20.0, True)
+    assert router.route(_request(100), 500)[0] == "primary"
+
+def test_error_budget_and_probe(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(routing.time, "monotonic", lambda: clock[0])
+    router = ModelRouter("primary:16000,backup:16000", error_budget=0.5)
+    for _ in range(10):
+        router.observe("primary", 1.0, False)
+    # Первый запрос после исчерпания бюджета - пробный, следующие идут в резерв
+    assert router.route(_request(100), 500)[0] == "primary"
+    assert router.route(_request(100), 500)[0] == "backup"
+    clock[0] += routing.PROBE_INTERVAL
+    assert router.route(_request(100), 500)[0] == "primary"
+
+    for _ in range(10):
+        router.observe("backup", 1.0, False)
+    assert router.route(_request(100), 500)[0] == "backup"
+    with pytest.raises(LLMUnavailableError):
+        router.route(_request(100), 500)
+    # Старые ошибки забываются
+    clock[0] += routing.OBSERVATION_TTL + 1
+    assert router.route(_request(100), 500)[0] == "primary"
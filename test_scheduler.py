@@ -0,0 +1,91 @@
+"""
+Тесты построения пересказов за день по расписанию
+"""
+import asyncio
+import time
+from datetime import datetime
+import pytest
+from cache import SummaryCache
+from db import Database, LOCAL_TZ
+from llm import group_header
+from scheduler import DigestScheduler, parse_times
+from summarizer import ChunkSummarizer
+from summary import SummaryService, parse_window
+
+class CountingLLM:
+    def __init__(self):
+        self.calls = []
+
+    async def summarize_messages(self, messages, time_period="общее", on_text=None):
+        self.calls.append(len(messages))
+        return f"пересказ {len(messages)} сообщений"
+
+    async def combine_summaries(self, summaries, time_period="общее", on_text=None):
+        return await self.summarize_messages(summaries, time_period)
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+def _service(db: Database, llm: CountingLLM) -> SummaryService:
+    summarizer = ChunkSummarizer(db, llm_provider=lambda: llm)
+    return SummaryService(db, SummaryCache(), llm_provider=lambda: llm, summarizer=summarizer)
+
+async def _add(db: Database, chat_id: int, count: int, text: str):
+    # Сообщения "сейчас", чтобы они попали в окно за сегодня и около полуночи
+    now = int(time.time())
+    await db.save_messages_batch([(chat_id, f"Группа {chat_id}", 1, "anna", f"{text} {i}", now)
+                                  for i in range(count)])
+
+def test_next_run_includes_push_time_and_wraps_to_next_day():
+    scheduler = DigestScheduler(None, None, times="14:00,10:00", push_time="21:00")
+    assert scheduler.next_run(datetime(2024, 5, 1, 9, 0, tzinfo=LOCAL_TZ)) == datetime(2024, 5, 1, 10, 0, tzinfo=LOCAL_TZ)
+    assert scheduler.next_run(datetime(2024, 5, 1, 14, 0, tzinfo=LOCAL_TZ)) == datetime(2024, 5, 1, 21, 0, tzinfo=LOCAL_TZ)
+    assert scheduler.next_run(datetime(2024, 5, 1, 22, 0, tzinfo=LOCAL_TZ)) == datetime(2024, 5, 2, 10, 0, tzinfo=LOCAL_TZ)
+    with pytest.raises(ValueError):
+        parse_times("10:00,полдень")
+
+def test_run_once_precomputes_active_groups_and_pushes_once(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = CountingLLM()
+    scheduler = DigestScheduler(db, _service(db, llm), jitter=0)
+    bot = FakeBot()
+    scheduler.bot = bot
+    day = datetime.now(LOCAL_TZ).date().isoformat()
+
+    async def scenario():
+        await _add(db, -1, 3, "сообщение")
+        await _add(db, -2, 2, "сообщение")
+        await db.set_digest_subscription(-1, True)
+        first = await scheduler.run_once(push=True)
+        # Без новых сообщений пересказ не перестраивается и не отправляется повторно
+        second = await scheduler.run_once(push=True)
+        return first, second, await db.get_precomputed_summary(-2, day)
+
+    first, second, stored = asyncio.run(scenario())
+    db.close()
+    assert (first, second) == (2, 0)
+    assert stored['message_count'] == 2
+    assert stored['summary'] == "пересказ 2 сообщений"
+    assert bot.sent == [(-1, group_header("Группа -1", "сегодня") + "пересказ 3 сообщений")]
+
+def test_today_summary_reuses_precomputed_and_summarizes_only_tail(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = CountingLLM()
+    service = _service(db, llm)
+
+    async def scenario():
+        await _add(db, -1, 5, "утро")
+        await service.precompute_today(-1)
+        await _add(db, -1, 2, "вечер")
+        llm.calls.clear()
+        return await service.summarize(-1, parse_window("today"))
+
+    summary = asyncio.run(scenario())
+    db.close()
+    assert llm.calls == [2]
+    assert "пересказ 5 сообщений\n\n🆕 Новые сообщения после " in summary
+    assert summary.endswith("пересказ 2 сообщений")
@@ -0,0 +1,129 @@
+"""
+Тесты полнотекстового поиска и пересказа по теме
+"""
+import asyncio
+import sqlite3
+import db as db_module
+from cache import SummaryCache
+from db import Database
+from search import build_match_query, format_results, stem
+from summary import SummaryService, parse_window
+
+def test_query_terms_are_stemmed_and_quoted():
+    assert stem("Деплоя") == "депло"
+    assert stem("серверами") == "сервер"
+    assert stem("ёлка") == "елка"
+    assert stem("kubernetes") == "kubernetes"
+    assert build_match_query('деплой OR "x" NEAR') == '"депл"* AND "or" AND "x" AND "near"*'
+    assert build_match_query("?!") is None
+
+def _fill(db: Database):
+    rows = [(-1, "Команда", 1, "anna", "Когда деплой на прод?", 1000),
+            (-1, "Команда", 2, "boris", "Деплоим после обеда, сервер готов", 1100),
+            (-1, "Команда", 1, "anna", "Ещё раз про деплой: откат не нужен", 1200),
+            (-1, "Команда", 3, "vera", "Идём на обед", 1300),
+            (-2, "Друзья", 1, "anna", "Деплой игры в субботу?", 1400),
+            (-3, "Чужая", 9, "oleg", "Деплой без нас", 1500)]
+    return db.save_messages_batch(rows)
+
+def test_search_is_scoped_ranked_and_paginated(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+
+    async def scenario():
+        await _fill(db)
+        found = await db.search_messages([-1, -2], build_match_query("деплоя"), 10)
+        pages = [await db.search_messages([-1, -2], build_match_query("деплой"), 2, offset)
+                 for offset in (0, 2, 4)]
+        yo = await db.search_messages([-1], build_match_query("еще"), 10)
+        return found, pages, yo
+
+    found, pages, yo = asyncio.run(scenario())
+    db.close()
+    assert {result['chat_id'] for result in found} == {-1, -2}
+    assert len(found) == 4
+    assert "«Деплоим»" in " ".join(result['snippet'] for result in found)
+    assert [len(page) for page in pages] == [2, 2, 0]
+    assert len({result['id'] for page in pages for result in page}) == 4
+    assert len(yo) == 1 and yo[0]['username'] == "anna"
+    assert "Команда" in format_results("деплой", found, 0)
+
+def test_index_follows_inserts_and_deletes(tmp_path):
+    path = str(tmp_path / "bot.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, "
+                 "chat_title TEXT, user_id INTEGER, username TEXT, message_text TEXT, "
+                 "timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    conn.execute("INSERT INTO messages (chat_id, user_id, message_text, timestamp) "
+                 "VALUES (-1, 1, 'старый релиз', '2024-01-01 10:00:00')")
+    conn.commit()
+    conn.close()
+    db = Database(path)
+
+    async def scenario():
+        # Сообщения до миграции индексируются при её применении
+        before = await db.search_messages([-1], build_match_query("релиз"), 10)
+        ids = await db.save_messages_batch([(-1, "Группа", 1, "user", "новый релиз", 2000)])
+        after = await db.search_messages([-1], build_match_query("релиз"), 10)
+        await db.delete_messages([before[0]['id']])
+        deleted = await db.search_messages([-1], build_match_query("релиз"), 10)
+        return before, ids, after, deleted
+
+    before, ids, after, deleted = asyncio.run(scenario())
+    conn = sqlite3.connect(path)
+    # Проверка целостности падает, если индекс разошёлся с таблицей
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('integrity-check')")
+    conn.close()
+    db.close()
+    assert len(before) == 1
+    assert len(after) == 2
+    assert [result['id'] for result in deleted] == ids
+
+def test_index_backfill_is_batched_and_restartable(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_module, "MIGRATION_BATCH_SIZE", 2)
+    path = str(tmp_path / "bot.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, "
+                 "chat_title TEXT, user_id INTEGER, username TEXT, message_text TEXT, "
+                 "timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    conn.executemany("INSERT INTO messages (chat_id, user_id, message_text, timestamp) VALUES (-1, 1, ?, ?)",
+                     [(f"релиз {i}", "2024-01-01 10:00:00") for i in range(5)])
+    conn.commit()
+    conn.close()
+    Database(path).close()
+
+    conn = sqlite3.connect(path)
+    # Повтор прерванной миграции не дублирует записи индекса
+    db_module._migration_search_index(conn)
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('integrity-check')")
+    found = conn.execute("SELECT COUNT(*) FROM messages_fts WHERE messages_fts MATCH 'релиз'").fetchone()[0]
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.close()
+    assert found == 5
+    # Существующая БД не переводится в incremental полным VACUUM при запуске
+    assert auto_vacuum == 0
+
+class RecordingLLM:
+    def __init__(self):
+        self.messages = None
+
+    async def summarize_messages(self, messages, time_period="общее", on_text=None):
+        self.messages = messages
+        return f"пересказ {len(messages)} сообщений"
+
+def test_focused_summary_uses_only_matching_messages(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = RecordingLLM()
+    service = SummaryService(db, SummaryCache(), llm_provider=lambda: llm)
+
+    async def scenario():
+        await _fill(db)
+        focused = await service.summarize(-1, parse_window("about деплой"))
+        missing = await service.summarize(-1, parse_window("about футбол"))
+        return focused, missing
+
+    focused, missing = asyncio.run(scenario())
+    db.close()
+    assert "тема «деплой»" in focused
+    assert [msg['message_text'] for msg in llm.messages] == [
+        "Когда деплой на прод?", "Деплоим после обеда, сервер готов", "Ещё раз про деплой: откат не нужен"]
+    assert missing is None
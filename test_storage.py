@@ -0,0 +1,183 @@
+"""
+Общие тесты движков хранения: SQLite и PostgreSQL (при заданном TEST_DATABASE_URL)
+"""
+import asyncio
+import time
+import pytest
+from db import batch_counters, open_database
+from search import build_match_query
+
+NOW = int(time.time())
+
+def test_batch_counters_merge_rows_per_key():
+    rows = [(-1, "Старое", 7, "anna", "a", 100), (-1, "Новое", 7, "anna", "b", 90),
+            (-1, "Новое", None, None, "c", 110), (-2, "Другая", 7, "anna", "d", 50)]
+    groups, members = batch_counters(rows)
+    assert groups == [(-1, "Новое", 110, 3), (-2, "Другая", 50, 1)]
+    assert members == [(7, -1, 2, 100), (7, -2, 1, 50)]
+
+def test_open_database_selects_engine_by_url(tmp_path):
+    db = open_database(f"sqlite:///{tmp_path / 'bot.db'}")
+    assert asyncio.run(db.ping())
+    db.close()
+    with pytest.raises(ValueError):
+        open_database("mysql://localhost/bot")
+
+def test_messages_batch_and_groups(database):
+    rows = [(-100, "Группа", user_id % 3, f"user{user_id % 3}", f"сообщение {user_id}", NOW - 100 + user_id)
+            for user_id in range(30)]
+    # Сообщение прошлого месяца попадает в другую секцию PostgreSQL
+    rows.append((-200, "Архив", 1, "user1", "старое сообщение", NOW - 40 * 86400))
+
+    async def scenario():
+        ids = await database.save_messages_batch(rows)
+        await database.save_message(-100, "Группа (новое имя)", 1, "user1", "ещё одно")
+        return (ids, await database.get_user_groups(1), await database.get_recent_messages(-100, limit=5),
+                await database.get_window_stats([-100, -200, -300], NOW - 3600, NOW + 3600),
+                await database.get_messages_after(-100, ids[27], 0, 10),
+                await database.get_messages_before(-200, NOW - 86400, 10))
+
+    ids, groups, recent, stats, after, before = asyncio.run(scenario())
+    assert len(ids) == 31 and ids == sorted(ids) and len(set(ids)) == 31
+    assert [group['chat_id'] for group in groups] == [-100, -200]
+    assert groups[0]['chat_title'] == "Группа (новое имя)" and groups[0]['message_count'] == 31
+    assert [msg['message_text'] for msg in recent] == [f"сообщение {i}" for i in range(26, 30)] + ["ещё одно"]
+    assert recent[-1]['timestamp']
+    assert list(stats) == [-100] and stats[-100]['message_count'] == 31
+    assert stats[-100]['max_message_id'] > ids[-1]
+    assert [msg['id'] for msg in after][:2] == [ids[28], ids[29]]
+    assert [msg['message_text'] for msg in before] == ["старое сообщение"]
+
+def test_window_messages_and_chunks(database):
+    rows = [(-1, "Группа", 5, "anna", f"сообщение {i}", NOW - 600 + i) for i in range(10)]
+
+    async def scenario():
+        ids = await database.save_messages_batch(rows)
+        window = await database.get_window_messages(-1, NOW - 600, NOW - 595)
+        await database.save_chunk_summary(-1, window[:3], "начало")
+        await database.save_chunk_summary(-1, window[:3], "начало, заново")
+        chunks = await database.get_chunk_summaries(-1, NOW - 3600, NOW)
+        last = await database.get_last_chunk(-1)
+        skipped = await database.get_window_messages(-1, NOW - 600, NOW, (ids[0], ids[2]))
+        batched = (await database.get_chats_chunk_summaries([-1, -9], NOW - 3600, NOW),
+                   await database.get_chats_window_messages([-1, -9], NOW - 600, NOW, {-1: (ids[0], ids[2])}))
+        await database.delete_chunk_summaries(-1)
+        return ids, window, chunks, last, skipped, batched, await database.get_last_chunk(-1)
+
+    ids, window, chunks, last, skipped, batched, cleared = asyncio.run(scenario())
+    assert [msg['id'] for msg in window] == ids[:5]
+    assert len(chunks) == 1 and chunks[0]['summary'] == "начало, заново" and chunks[0]['user_ids'] == {5}
+    assert last == (ids[2], NOW - 600)
+    assert [msg['id'] for msg in skipped] == ids[3:]
+    assert batched == ({-1: chunks}, {-1: skipped})
+    assert cleared == (0, 0)
+
+def test_search_matches_word_prefixes(database):
+    rows = [(-1, "Работа", 1, "anna", "Вчера упал деплой на проде", NOW - 30),
+            (-1, "Работа", 2, "ivan", "Ёлку ставим в пятницу", NOW - 20),
+            (-1, "Работа", 1, "anna", "деплоим снова после обеда", NOW - 10),
+            (-2, "Чужая", 3, "oleg", "деплой в чужой группе", NOW - 5)]
+
+    async def scenario():
+        await database.save_messages_batch(rows)
+        deploy = await database.search_messages([-1], build_match_query("деплой"), limit=10)
+        tree = await database.search_messages([-1, -2], build_match_query("ёлку"), limit=10)
+        page = await database.search_messages([-1], build_match_query("деплой"), limit=1, offset=1)
+        topic = await database.search_window_messages(-1, build_match_query("деплой"), NOW - 25, None, 10)
+        return deploy, tree, page, topic
+
+    deploy, tree, page, topic = asyncio.run(scenario())
+    assert sorted(result['username'] for result in deploy) == ["anna", "anna"]
+    assert all(result['chat_id'] == -1 and "«" in result['snippet'] for result in deploy)
+    assert [result['snippet'] for result in tree] == ["«Елку» ставим в пятницу"]
+    assert len(page) == 1 and page[0]['id'] != deploy[0]['id']
+    assert [msg['message_text'] for msg in topic] == ["деплоим снова после обеда"]
+
+def test_jobs_cache_and_schedule(database):
+    async def scenario():
+        first = await database.create_summary_job(7, -1, "day", "Группа", 7, 10)
+        second = await database.create_summary_job(7, -2, "1h", None, 7, 11)
+        await database.mark_summary_job_running(first)
+        await database.delete_summary_jobs([first])
+        jobs = await database.get_unfinished_summary_jobs()
+
+        await database.save_cached_summary("a", -1, "старый", time.time() - 1)
+        await database.save_cached_summary("b", -1, "свежий", time.time() + 60)
+        await database.save_cached_summary("b", -1, "ещё свежее", time.time() + 60)
+        cached = await database.get_cached_summary("a", time.time()), await database.get_cached_summary("b", time.time())
+
+        await database.save_messages_batch([(-1, "Группа", 1, "anna", "привет", NOW)])
+        await database.save_precomputed_summary(-1, "2026-01-02", "Группа", 5, 3, "итоги")
+        await database.save_precomputed_summary(-1, "2026-01-03", "Группа", 6, 4, "новые итоги")
+        removed = await database.delete_precomputed_summaries_before("2026-01-03")
+        await database.set_digest_subscription(-1, True)
+        await database.set_digest_subscription(-1, True)
+        await database.set_digest_subscription(-2, True)
+        await database.set_digest_subscription(-2, False)
+        await database.mark_digest_pushed(-1, "2026-01-03")
+        return (jobs, second, cached, await database.get_active_chat_ids(NOW - 60), removed,
+                await database.get_precomputed_summary(-1, "2026-01-03"), await database.get_digest_subscriptions())
+
+    jobs, second, cached, active, removed, precomputed, subscriptions = asyncio.run(scenario())
+    assert [(job['id'], job['window'], job['group_title']) for job in jobs] == [(second, "1h", None)]
+    assert cached[0] is None and cached[1][0] == "ещё свежее"
+    assert active == [-1]
+    assert removed == 1
+    assert precomputed['summary'] == "новые итоги" and precomputed['last_message_id'] == 6
+    assert subscriptions == {-1: "2026-01-03"}
+
+def test_retention_and_fsm(database):
+    async def scenario():
+        ids = await database.save_messages_batch([(-1, "Группа", 1, "anna", "старое", NOW - 40 * 86400),
+                                                  (-1, "Группа", 1, "anna", "новое", NOW)])
+        await database.delete_messages(ids[:1])
+        groups = await database.get_user_groups(1)
+        freed = await database.incremental_vacuum()
+        await database.set_retention_days(-1, 7)
+        await database.set_retention_days(-1, 14)
+        await database.set_retention_days(-2, 3)
+        await database.set_retention_days(-2, None)
+        expired = await database.delete_expired_summaries(time.time())
+
+        await database.set_fsm_state("1:7:7::default", "SummaryStates:waiting_for_time_period")
+        await database.set_fsm_data("1:7:7::default", {'selected_group_id': -1, 'title': 'Ёлка'})
+        saved = await database.get_fsm_record("1:7:7::default")
+        await database.set_fsm_state("1:8:8::default", "SummaryStates:waiting_for_group_selection")
+        await database.set_fsm_state("1:8:8::default", None)
+        cleared = await database.get_fsm_record("1:8:8::default")
+        stale = await database.delete_fsm_states_before(time.time() + 1)
+        return (await database.get_recent_messages(-1), groups, freed, await database.get_retention_policies(),
+                expired, saved, cleared, stale, await database.ping())
+
+    messages, groups, freed, policies, expired, saved, cleared, stale, alive = asyncio.run(scenario())
+    assert [msg['message_text'] for msg in messages] == ["новое"]
+    assert [group['message_count'] for group in groups] == [1]
+    assert freed >= 0
+    assert policies == {-1: 14}
+    assert expired == 0
+    assert saved == ("SummaryStates:waiting_for_time_period", {'selected_group_id': -1, 'title': 'Ёлка'})
+    assert cleared == (None, {})
+    assert stale == 1
+    assert alive
+
+def test_migrations_wait_for_schema_lock(database):
+    if not hasattr(database, 'url'):
+        pytest.skip("миграции SQLite выполняются в конструкторе")
+    import asyncpg
+    from pgdb import SCHEMA_LOCK
+
+    async def scenario():
+        # Пока блокировку держит другой процесс, стартующий не трогает схему
+        holder = await asyncpg.connect(database.url)
+        try:
+            await holder.execute("SELECT pg_advisory_lock($1)", SCHEMA_LOCK)
+            startup = asyncio.create_task(database.ping())
+            await asyncio.sleep(0.3)
+            created = await holder.fetchval("SELECT to_regclass('schema_version') IS NOT NULL")
+            await holder.execute("SELECT pg_advisory_unlock($1)", SCHEMA_LOCK)
+            return created, await startup
+        finally:
+            await holder.close()
+
+    created, alive = asyncio.run(scenario())
+    assert not created and alive
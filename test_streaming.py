@@ -0,0 +1,88 @@
+"""
+Тесты постепенного показа текста в сообщении Telegram
+"""
+import asyncio
+from types import SimpleNamespace
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText
+from streaming import MessageStream, split_text
+
+class FakeBot:
+    def __init__(self):
+        self.texts = {1: ""}
+        self.edits = 0
+        self.deleted = []
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None):
+        self.edits += 1
+        self.texts[message_id] = text
+
+    async def send_message(self, chat_id, text):
+        message_id = max(self.texts) + 1
+        self.texts[message_id] = text
+        return SimpleNamespace(message_id=message_id)
+
+    async def delete_message(self, chat_id, message_id):
+        self.deleted.append(message_id)
+        del self.texts[message_id]
+
+def test_split_text_prefers_paragraphs():
+    text = "а" * 3000 + "\n\n" + "б" * 3000 + " " + "в" * 100
+    parts = split_text(text)
+    assert parts[0] == "а" * 3000
+    assert parts[1] == "б" * 3000 + " " + "в" * 100
+    assert all(len(part) <= 4096 for part in split_text("г" * 10000))
+    assert "".join(split_text("г" * 10000)) == "г" * 10000
+
+def test_updates_are_coalesced():
+    bot = FakeBot()
+
+    async def scenario():
+        stream = MessageStream(bot, 0, 1, interval=0.1)
+        text = ""
+        for i in range(50):
+            text += f"слово{i} "
+            await stream.update(text)
+            await asyncio.sleep(0.01)
+        await stream.finish("итог")
+
+    asyncio.run(scenario())
+    # 0.5 с обновлений при interval=0.1: около 5 правок вместо 50
+    assert 2 <= bot.edits <= 9
+    assert bot.texts == {1: "итог"}
+
+def test_long_text_continues_in_new_messages():
+    bot = FakeBot()
+
+    async def scenario():
+        stream = MessageStream(bot, 0, 1, interval=0.0, limit=100)
+        await stream.update("x" * 250)
+        await asyncio.sleep(0.01)
+        grown = dict(bot.texts)
+        # Итог короче промежуточного текста - лишнее продолжение удаляется
+        await stream.finish("y" * 150)
+        return grown, stream.message_ids
+
+    grown, message_ids = asyncio.run(scenario())
+    assert [len(text) for text in grown.values()] == [100, 100, 50]
+    assert message_ids == [1, 2]
+    assert bot.texts == {1: "y" * 100, 2: "y" * 50} and bot.deleted == [3]
+
+def test_throttled_final_text_is_not_retried_forever():
+    class ThrottledBot(FakeBot):
+        async def edit_message_text(self, text, chat_id=None, message_id=None):
+            self.edits += 1
+            method = EditMessageText(chat_id=chat_id, message_id=message_id, text=text)
+            raise TelegramRetryAfter(method, "Too Many Requests", 30)
+
+    bot = ThrottledBot()
+
+    async def scenario():
+        stream = MessageStream(bot, 0, 1, interval=0.0)
+        # Повторы - забота OutboundSender: исполнитель задач не ждёт чат бесконечно
+        await asyncio.wait_for(stream.finish("итог"), 1)
+
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(scenario())
+    assert bot.edits == 1
@@ -0,0 +1,179 @@
+"""
+Тесты иерархического пересказа по фрагментам
+"""
+import asyncio
+import threading
+import time
+from db import Database
+from summarizer import ChunkSummarizer
+
+class FakeLLM:
+    def __init__(self):
+        self.chunk_calls = []
+        self.combine_calls = []
+        self.direct_calls = 0
+        self.topic_calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def summarize_chunk(self, messages):
+        self.chunk_calls.append(len(messages))
+        return f"фрагмент {messages[0]['id']}-{messages[-1]['id']}"
+
+    async def combine_summaries(self, parts, time_period, total_messages, unique_users, final=True,
+                                on_text=None):
+        self.combine_calls.append((len(parts), final))
+        return f"итог из {len(parts)} частей, {total_messages} сообщений, {unique_users} участников"
+
+    async def summarize_topic(self, messages):
+        self.topic_calls.append(len(messages))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return f"тема {messages[0]['message_text'].split()[0]}"
+
+    async def combine_topics(self, parts, time_period, total_messages, unique_users, on_text=None):
+        self.combine_calls.append((len(parts), "topics"))
+        return " | ".join(parts) + f" ({total_messages} сообщений)"
+
+    async def summarize_messages(self, messages, time_period="общее", on_text=None):
+        self.direct_calls += 1
+        return "короткий пересказ"
+
+def _rows(count, start_ts, chat_id=-1):
+    return [(chat_id, "Группа", i % 3, f"user{i % 3}", f"сообщение {i}", start_ts + i) for i in range(count)]
+
+def test_chunks_are_summarized_once_and_reused(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = FakeLLM()
+    summarizer = ChunkSummarizer(db, lambda: llm, chunk_size=50, reduce_fanin=20, background=False)
+    now = int(time.time())
+
+    async def scenario():
+        ids = await db.save_messages_batch(_rows(260, now - 1000))
+        summarizer.on_flush(_rows(260, now - 1000), ids)
+        created = await summarizer.summarize_pending(-1)
+        again = await summarizer.summarize_pending(-1)
+        plan = await summarizer.plan_window(-1, now - 3600, now + 60)
+        text = await summarizer.summarize_plan(plan, "последние 1 часов")
+        return created, again, plan, text
+
+    created, again, plan, text = asyncio.run(scenario())
+    db.close()
+    assert (created, again) == (5, 0)
+    assert len(plan.chunks) == 5 and len(plan.tail) == 10 and not plan.head
+    assert plan.message_count == 260 and plan.user_ids == {0, 1, 2}
+    # 5 фрагментов при записи + 1 для свежего хвоста при запросе
+    assert llm.chunk_calls == [50] * 5 + [10]
+    assert llm.combine_calls == [(6, True)]
+    assert "260 сообщений" in text
+
+def test_backfill_is_limited_to_recent_history(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = FakeLLM()
+    summarizer = ChunkSummarizer(db, lambda: llm, chunk_size=50, background=False, backfill_hours=24)
+    now = int(time.time())
+
+    async def scenario():
+        # Неделя истории до первого запуска: фрагменты строятся только за последние сутки
+        await db.save_messages_batch(_rows(500, now - 7 * 86400))
+        await db.save_messages_batch(_rows(120, now - 3600))
+        first = await summarizer.summarize_pending(-1, now=now)
+        # Простой дольше суток: пропущенная история не пересказывается, старые фрагменты удаляются
+        await db.save_messages_batch(_rows(100, now + 86400))
+        await db.save_messages_batch(_rows(60, now + 3 * 86400))
+        second = await summarizer.summarize_pending(-1, now=now + 3 * 86400 + 100)
+        chunks = await db.get_chunk_summaries(-1, 0, now + 4 * 86400)
+        return first, second, chunks
+
+    first, second, chunks = asyncio.run(scenario())
+    db.close()
+    assert (first, second) == (2, 1)
+    assert llm.chunk_calls == [50] * 3
+    assert [chunk['start_ts'] for chunk in chunks] == [now + 3 * 86400]
+
+def test_window_starting_inside_a_chunk_and_multilevel_reduce(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = FakeLLM()
+    summarizer = ChunkSummarizer(db, lambda: llm, chunk_size=10, reduce_fanin=3, background=False)
+    now = int(time.time())
+
+    async def scenario():
+        await db.save_messages_batch(_rows(100, now - 1000))
+        await summarizer.summarize_pending(-1)
+        # Окно начинается с 5-го сообщения: первый фрагмент покрыт частично
+        plan = await summarizer.plan_window(-1, now - 995, now + 60)
+        await summarizer.summarize_plan(plan, "сегодня")
+        return plan
+
+    plan = asyncio.run(scenario())
+    db.close()
+    assert len(plan.chunks) == 9
+    assert [m['message_text'] for m in plan.head] == [f"сообщение {i}" for i in range(5, 10)]
+    assert plan.message_count == 95
+    # 10 частей -> 4 промежуточных объединения -> 2 -> финальное
+    assert [final for _, final in llm.combine_calls].count(True) == 1
+    assert llm.combine_calls[-1] == (2, True)
+
+def test_short_window_uses_single_request(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = FakeLLM()
+    summarizer = ChunkSummarizer(db, lambda: llm, chunk_size=50, background=False)
+    now = int(time.time())
+
+    async def scenario():
+        await db.save_messages_batch(_rows(20, now - 100))
+        plan = await summarizer.plan_window(-1, now - 3600, now + 60)
+        return await summarizer.summarize_plan(plan, "сегодня")
+
+    assert asyncio.run(scenario()) == "короткий пересказ"
+    db.close()
+    assert llm.direct_calls == 1 and not llm.chunk_calls
+
+def test_window_with_several_topics_is_summarized_in_parallel(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = FakeLLM()
+    summarizer = ChunkSummarizer(db, lambda: llm, chunk_size=20, background=False, topic_min_messages=40)
+    now = int(time.time())
+    vocab = ["релиз сервер деплой миграция".split(), "отпуск море билеты отель".split(),
+             "пицца обед кафе доставка".split()]
+    rows = [(-1, "Группа", i % 5, f"user{i % 5}", " ".join(vocab[i % 3][(i + k) % 4] for k in range(3)),
+             now - 3000 + i * 30) for i in range(90)]
+
+    async def scenario():
+        await db.save_messages_batch(rows)
+        plan = await summarizer.plan_window(-1, now - 3600, now + 60)
+        return await summarizer.summarize_plan(plan, "сегодня")
+
+    text = asyncio.run(scenario())
+    db.close()
+    # Три темы по 30 сообщений, каждая пересказывается двумя кусками по chunk_size, все одновременно
+    assert sorted(llm.topic_calls) == [10, 10, 10, 20, 20, 20]
+    assert llm.max_in_flight == 6
+    assert llm.combine_calls == [(3, "topics")] and not llm.chunk_calls and not llm.direct_calls
+    assert "90 сообщений" in text
+
+def test_topic_segmentation_runs_off_event_loop(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = FakeLLM()
+    summarizer = ChunkSummarizer(db, lambda: llm, chunk_size=20, background=False, topic_min_messages=40)
+    segment = summarizer.segmenter.segment
+    threads = []
+
+    def recording_segment(messages):
+        threads.append(threading.current_thread())
+        return segment(messages)
+
+    summarizer.segmenter.segment = recording_segment
+    now = int(time.time())
+
+    async def scenario():
+        await db.save_messages_batch(_rows(60, now - 600))
+        plan = await summarizer.plan_window(-1, now - 3600, now + 60)
+        return await summarizer.summarize_plan(plan, "сегодня")
+
+    asyncio.run(scenario())
+    db.close()
+    # Разбиение на темы не занимает цикл событий
+    assert threads and threading.main_thread() not in threads
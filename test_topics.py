@@ -0,0 +1,49 @@
+"""
+Тесты разбиения обсуждения на темы
+"""
+from topics import TopicSegmenter
+
+RELEASE = "релиз сервер деплой миграция база откат версия".split()
+TRAVEL = "отпуск море билеты отель самолёт пляж виза".split()
+
+def _msg(i, user_id, text, ts, username=None):
+    return {'id': i, 'user_id': user_id, 'username': username or f"user{user_id}",
+            'message_text': text, 'ts': ts}
+
+def _words(i, vocab):
+    return " ".join(vocab[(i + k) % len(vocab)] for k in range(3))
+
+def test_interleaved_threads_are_separated():
+    messages = []
+    for i in range(40):
+        vocab = RELEASE if i % 2 else TRAVEL
+        messages.append(_msg(i, i % 6, _words(i, vocab), i * 30))
+    # Реплика без слов продолжает тему предыдущего сообщения
+    messages.append(_msg(40, 1, "ок", 40 * 30 - 10))
+    topics = TopicSegmenter(min_size=3).segment(messages)
+    assert len(topics) == 2
+    for topic in topics:
+        words = {word for msg in topic for word in msg['message_text'].split()}
+        assert not (words & set(RELEASE) and words & set(TRAVEL))
+    assert sum(len(topic) for topic in topics) == 41
+    assert all([msg['ts'] for msg in topic] == sorted(msg['ts'] for msg in topic) for topic in topics)
+
+def test_time_gap_and_mentions():
+    # Одни и те же слова после долгой паузы - уже другое обсуждение
+    morning = [_msg(i, i % 3, _words(i, RELEASE), i * 60) for i in range(10)]
+    evening = [_msg(10 + i, i % 3, _words(i, RELEASE), 20000 + i * 60) for i in range(10)]
+    topics = TopicSegmenter(gap_seconds=1800, min_size=3).segment(morning + evening)
+    assert [len(topic) for topic in topics] == [10, 10]
+
+    # Упоминание участника темы присоединяет сообщение без общих слов
+    thread = [_msg(i, 1 + i % 2, _words(i, RELEASE), i * 60, "lead" if i % 2 == 0 else None) for i in range(6)]
+    thread.append(_msg(6, 3, "@lead согласен полностью", 1000))
+    topics = TopicSegmenter(min_size=1).segment(thread)
+    assert len(topics) == 1
+
+def test_small_topics_merged_and_count_limited():
+    messages = [_msg(i, i % 4, _words(i, RELEASE), i * 30) for i in range(20)]
+    messages += [_msg(20 + i, 9, f"совсем другое слово{chr(1072 + i)}ых", 600 + i) for i in range(3)]
+    messages.sort(key=lambda msg: msg['ts'])
+    topics = TopicSegmenter(min_size=5, max_topics=1).segment(messages)
+    assert len(topics) == 1 and len(topics[0]) == 23
@@ -0,0 +1,48 @@
+"""
+Тесты трассировки и профилировщика
+"""
+import asyncio
+import logging
+import marshal
+from db import Database
+from profiler import Profiler, ProfilerBusyError
+from tracing import span, trace
+
+def test_span_tree_is_logged_for_slow_trace(tmp_path, caplog):
+    db = Database(str(tmp_path / "bot.db"))
+
+    async def scenario():
+        with trace("update:test", slow_ms=0) as root:
+            await db.get_recent_messages(-1)
+            with span("llm.request", model="stub"):
+                await asyncio.gather(asyncio.sleep(0.01), db.get_chat_ids())
+        return root
+
+    with caplog.at_level(logging.WARNING, logger="tracing"):
+        root = asyncio.run(scenario())
+    db.close()
+    assert [child.name for child in root.children] == ["db.get_recent_messages", "llm.request"]
+    assert [child.name for child in root.children[1].children] == ["db.get_chat_ids"]
+    assert "update:test" in caplog.text and "  llm.request" in caplog.text
+
+def test_span_outside_trace_is_noop():
+    with span("db.anything") as current:
+        assert current is None
+
+def test_profiler_session():
+    profiler = Profiler(max_seconds=0.2)
+
+    async def scenario():
+        session = asyncio.create_task(profiler.run(5))
+        await asyncio.sleep(0.01)
+        try:
+            await profiler.run(1)
+            busy = False
+        except ProfilerBusyError:
+            busy = True
+        return await session, busy
+
+    profile, busy = asyncio.run(scenario())
+    assert busy
+    assert isinstance(marshal.loads(Profiler.dump(profile)), dict)
+    assert "function calls" in Profiler.report(profile)
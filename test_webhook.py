@@ -0,0 +1,66 @@
+"""
+Тесты приёма обновлений через webhook
+"""
+import asyncio
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from aiohttp import web
+from webhook import LimitedRequestHandler
+
+def _update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1704103200,
+            "chat": {"id": -1, "type": "group", "title": "Группа"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Ivan"},
+            "text": f"сообщение {update_id}",
+        },
+    }
+
+def test_secret_and_concurrency_limit():
+    state = {"active": 0, "peak": 0, "done": 0}
+    router = Router()
+
+    @router.message()
+    async def slow_handler(message: Message):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.05)
+        state["active"] -= 1
+        state["done"] += 1
+
+    async def scenario():
+        bot = Bot(token="42:TEST")
+        dp = Dispatcher()
+        dp.include_router(router)
+        handler = LimitedRequestHandler(dp, bot, max_concurrency=2, secret_token="s3cret")
+        app = web.Application()
+        handler.register(app, path="/webhook")
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}/webhook"
+
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=_update(0), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as resp:
+                rejected = resp.status
+            headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+
+            async def post(i):
+                async with session.post(url, json=_update(i), headers=headers) as resp:
+                    return resp.status
+
+            statuses = await asyncio.gather(*[post(i) for i in range(1, 7)])
+        await runner.cleanup()
+        return rejected, statuses
+
+    rejected, statuses = asyncio.run(scenario())
+    assert rejected == 401
+    assert statuses == [200] * 6
+    assert state["done"] == 6
+    assert state["peak"] <= 2
@@ -0,0 +1,178 @@
+"""
+Тесты распределения обновлений по исполнителям и общего хранилища состояний
+"""
+import asyncio
+import queue
+import time
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Message, Update
+from cache import SummaryCache
+from db import Database
+from hotbuffer import HotBuffer
+from fsm import SQLiteStorage
+from retention import RetentionManager
+from scheduler import DigestScheduler
+from sharding import shard_for, update_shard_key
+from summarizer import ChunkSummarizer
+from summary import SummaryService
+from workers import bypass_hot_buffer, consume
+
+class SummaryStates(StatesGroup):
+    waiting_for_group_selection = State()
+    waiting_for_time_period = State()
+
+def _message_update(update_id: int, chat_id: int, user_id: int = 7) -> dict:
+    chat = {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup", "title": "Группа"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": chat,
+        "from": {"id": user_id, "is_bot": False, "first_name": "Анна"}, "text": f"сообщение {update_id}"}}
+
+def test_updates_are_sharded_by_chat_then_user():
+    group = Update.model_validate(_message_update(1, -100500))
+    private = Update.model_validate(_message_update(2, 7))
+    callback = Update.model_validate({"update_id": 3, "callback_query": {
+        "id": "1", "chat_instance": "x", "data": "group_1",
+        "from": {"id": 7, "is_bot": False, "first_name": "Анна"},
+        "message": _message_update(3, 7)["message"]}})
+    inline = Update.model_validate({"update_id": 4, "inline_query": {
+        "id": "1", "query": "", "offset": "", "from": {"id": 9, "is_bot": False, "first_name": "Иван"}}})
+
+    assert update_shard_key(group) == -100500
+    assert update_shard_key(private) == update_shard_key(callback) == 7
+    assert update_shard_key(inline) == 9
+    assert update_shard_key(Update(update_id=5)) is None
+    # Отрицательные id групп тоже распределяются по всем исполнителям
+    assert {shard_for(chat_id, 4) for chat_id in range(-108, -100)} == {0, 1, 2, 3}
+
+def test_sqlite_storage_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "bot.db")
+    first, second = Database(path), Database(path)
+    key = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+    async def scenario():
+        # Выбор группы в одном процессе, выбор периода - в другом
+        await SQLiteStorage(first).set_state(key, SummaryStates.waiting_for_time_period)
+        await SQLiteStorage(first).update_data(key, {'selected_group_id': -100, 'title': 'Ёлка'})
+        storage = SQLiteStorage(second)
+        seen = await storage.get_state(key), await storage.get_data(key)
+        await storage.set_state(key, None)
+        await storage.set_data(key, {})
+        cleared = await storage.get_state(key), await storage.get_data(key)
+        return seen, cleared
+
+    seen, cleared = asyncio.run(scenario())
+    rows = second._connect().execute("SELECT COUNT(*) FROM fsm_states").fetchone()[0]
+    first.close()
+    second.close()
+    assert seen == (SummaryStates.waiting_for_time_period.state, {'selected_group_id': -100, 'title': 'Ёлка'})
+    assert cleared == (None, {})
+    assert rows == 0
+
+def test_abandoned_dialogs_are_removed_by_retention(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    storage = SQLiteStorage(db)
+    key = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+    async def scenario():
+        await storage.set_state(key, SummaryStates.waiting_for_group_selection)
+        await RetentionManager(db, default_days=0).run_once(now=time.time() + 2 * 86400)
+        return await storage.get_state(key)
+
+    state = asyncio.run(scenario())
+    db.close()
+    assert state is None
+
+class ChunkLLM:
+    def __init__(self):
+        self.chats = []
+
+    async def summarize_chunk(self, messages):
+        self.chats.append(messages[0]['chat_title'])
+        return "фрагмент"
+
+def test_chunk_summaries_are_sharded_between_workers(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    now = int(time.time())
+    chat_ids = [-100, -101, -102, -103]
+    llms = [ChunkLLM(), ChunkLLM()]
+    summarizers = [ChunkSummarizer(db, lambda llm=llm: llm, chunk_size=10) for llm in llms]
+
+    async def scenario():
+        for chat_id in chat_ids:
+            await db.save_messages_batch([(chat_id, str(chat_id), 1, "anna", f"сообщение {i}", now - 100 + i)
+                                          for i in range(25)])
+        for index, summarizer in enumerate(summarizers):
+            await summarizer.start(owns=lambda chat_id, index=index: shard_for(chat_id, 2) == index)
+        for _ in range(200):
+            if sum(len(llm.chats) for llm in llms) >= 2 * len(chat_ids):
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        # Сообщения чужого чата не учитываются исполнителем
+        summarizers[0].on_flush([(-101, "-101", 1, "anna", "ещё", now)] * 10, list(range(10)))
+        for summarizer in summarizers:
+            await summarizer.stop()
+
+    asyncio.run(scenario())
+    db.close()
+    assert sorted(llms[0].chats) == ["-100", "-100", "-102", "-102"]
+    assert sorted(llms[1].chats) == ["-101", "-101", "-103", "-103"]
+    assert -101 not in summarizers[0]._pending
+
+class DigestLLM:
+    async def summarize_messages(self, messages, time_period="общее", on_text=None):
+        return f"пересказ {len(messages)} сообщений"
+
+class DigestBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+def test_front_digest_sees_messages_written_by_workers(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    llm = DigestLLM()
+    # Сервисы основного процесса в режиме BOT_WORKERS > 1, как в main.py
+    hot_buffer = HotBuffer(db)
+    bypass_hot_buffer(hot_buffer)
+    summarizer = ChunkSummarizer(db, lambda: llm, hot_buffer=hot_buffer)
+    service = SummaryService(db, SummaryCache(), llm_provider=lambda: llm, summarizer=summarizer,
+                             hot_buffer=hot_buffer)
+    scheduler = DigestScheduler(db, service, jitter=0)
+    scheduler.bot = DigestBot()
+    now = int(time.time())
+
+    async def scenario():
+        await db.save_messages_batch([(-1, "Группа", 1, "anna", f"утро {i}", now) for i in range(3)])
+        await db.set_digest_subscription(-1, True)
+        await scheduler.run_once()
+        # Исполнитель записал новые сообщения мимо буфера основного процесса
+        await db.save_messages_batch([(-1, "Группа", 1, "anna", f"вечер {i}", now) for i in range(2)])
+        await scheduler.run_once(push=True)
+
+    asyncio.run(scenario())
+    db.close()
+    assert len(scheduler.bot.sent) == 1 and scheduler.bot.sent[0][1].endswith("пересказ 5 сообщений")
+
+def test_worker_consumes_queue_until_stop():
+    router = Router()
+    seen = []
+
+    @router.message()
+    async def remember(message: Message):
+        seen.append(message.message_id)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    updates = queue.Queue()
+    for update_id in range(1, 6):
+        updates.put(Update.model_validate(_message_update(update_id, -1)).model_dump(
+            mode="json", by_alias=True, exclude_none=True))
+    updates.put(None)
+
+    handled = asyncio.run(consume(dp, Bot("1:x"), updates))
+    assert handled == 5
+    assert sorted(seen) == [1, 2, 3, 4, 5]
@@ -0,0 +1,140 @@
+import math
+from collections import Counter
+from typing import Iterable, List, Mapping, Optional, Sequence, Set
+from config import (TOPIC_GAP_SECONDS, TOPIC_JOIN_THRESHOLD, TOPIC_MIN_SIZE, TOPIC_MAX_TOPICS,
+                    EXTRACT_REPLY_WINDOW)
+from extract import MENTION_RE, tokenize
+
+# Прибавка к сходству за упоминание участника темы и за сообщение сразу после её сообщения.
+# Прибавка за соседство меньше порога: без общих слов одного соседства мало
+MENTION_BONUS = 0.5
+REPLY_BONUS = 0.1
+
+class Topic:
+    """Тема обсуждения: сообщения, участники и частоты слов"""
+
+    __slots__ = ('messages', 'users', 'terms', 'norm_sq', 'first_ts', 'last_ts')
+
+    def __init__(self):
+        self.messages: List[Mapping] = []
+        self.users: Set[str] = set()
+        self.terms: Counter = Counter()
+        self.norm_sq = 0
+        self.first_ts: Optional[int] = None
+        self.last_ts = 0
+
+    def add(self, message: Mapping, tokens: Iterable[str]):
+        self.messages.append(message)
+        username = (message.get('username') or '').lower()
+        if username:
+            self.users.add(username)
+        for token in tokens:
+            count = self.terms[token]
+            # (c + 1)^2 - c^2: квадрат нормы обновляется без пересчёта
+            self.norm_sq += 2 * count + 1
+            self.terms[token] = count + 1
+        ts = message.get('ts') or 0
+        self.first_ts = ts if self.first_ts is None else min(self.first_ts, ts)
+        self.last_ts = max(self.last_ts, ts)
+
+    def similarity(self, tokens: Set[str]) -> float:
+        """Косинусная близость набора слов к словарю темы"""
+        if not tokens or not self.norm_sq:
+            return 0.0
+        dot = sum(self.terms.get(token, 0) for token in tokens)
+        return dot / math.sqrt(len(tokens) * self.norm_sq)
+
+    def merge(self, other: "Topic"):
+        self.messages.extend(other.messages)
+        self.users |= other.users
+        self.terms.update(other.terms)
+        self.norm_sq = sum(count * count for count in self.terms.values())
+        self.first_ts = min(self.first_ts, other.first_ts)
+        self.last_ts = max(self.last_ts, other.last_ts)
+
+    def distance(self, other: "Topic") -> int:
+        """Промежуток между темами во времени (0, если они пересекаются)"""
+        return max(0, other.first_ts - self.last_ts, self.first_ts - other.last_ts)
+
+class TopicSegmenter:
+    """Разбиение окна на темы без обращения к LLM.
+
+    Сообщения просматриваются по порядку; каждое присоединяется к открытой
+    теме, на которую больше всего похоже: по общим словам (косинус), по
+    упоминанию через @username её участника и по тому, что оно пришло в
+    течение reply_window после предыдущего сообщения этой темы (в базе нет
+    reply_to, поэтому цепочки ответов восстанавливаются так). Если ни одна
+    тема не набирает join_threshold, начинается новая. Тема закрывается
+    после паузы дольше gap_seconds. Темы меньше min_size сообщений
+    вливаются в ближайшие, а тем остаётся не больше max_topics.
+    """
+
+    def __init__(self, gap_seconds: int = TOPIC_GAP_SECONDS,
+                 join_threshold: float = TOPIC_JOIN_THRESHOLD,
+                 min_size: int = TOPIC_MIN_SIZE, max_topics: int = TOPIC_MAX_TOPICS,
+                 reply_window: int = EXTRACT_REPLY_WINDOW):
+        self.gap_seconds = gap_seconds
+        self.join_threshold = join_threshold
+        self.min_size = min_size
+        self.max_topics = max_topics
+        self.reply_window = reply_window
+
+    def segment(self, messages: Sequence[Mapping]) -> List[List[Mapping]]:
+        """Темы окна: сообщения каждой в хронологическом порядке, темы - по первому сообщению"""
+        topics: List[Topic] = []
+        open_topics: List[Topic] = []
+        previous: Optional[Topic] = None
+        previous_ts = 0
+
+        for msg in messages:
+            ts = msg.get('ts') or 0
+            text = msg.get('message_text') or ''
+            tokens = tokenize(text)
+            open_topics = [topic for topic in open_topics if ts - topic.last_ts <= self.gap_seconds]
+            mentioned = {name.lower() for name in MENTION_RE.findall(text)} if '@' in text else set()
+            adjacent = previous if previous in open_topics and ts - previous_ts <= self.reply_window else None
+
+            best, best_score = None, 0.0
+            for topic in open_topics:
+                score = topic.similarity(tokens)
+                if mentioned & topic.users:
+                    score += MENTION_BONUS
+                if topic is adjacent:
+                    score += REPLY_BONUS
+                if score > best_score:
+                    best, best_score = topic, score
+
+            if best_score < self.join_threshold:
+                # "ок", "+1" и прочие реплики без слов продолжают текущую тему
+                best = adjacent if not tokens and adjacent is not None else None
+            if best is None:
+                best = Topic()
+                topics.append(best)
+                open_topics.append(best)
+            best.add(msg, tokens)
+            previous, previous_ts = best, ts
+
+        topics = self._merge_small(topics)
+        return [sorted(topic.messages, key=lambda msg: (msg.get('ts') or 0, msg.get('id') or 0))
+                for topic in sorted(topics, key=lambda topic: topic.first_ts)]
+
+    def _merge_small(self, topics: List[Topic]) -> List[Topic]:
+        """Слияние мелких тем с ближайшими и ограничение числа тем"""
+        large = [topic for topic in topics if len(topic.messages) >= self.min_size]
+        small = [topic for topic in topics if len(topic.messages) < self.min_size]
+        if not large:
+            large, small = small[:1], small[1:]
+        for topic in small:
+            self._closest(topic, large).merge(topic)
+        large.sort(key=lambda topic: len(topic.messages))
+        while len(large) > max(1, self.max_topics):
+            smallest = large.pop(0)
+            self._closest(smallest, large).merge(smallest)
+            large.sort(key=lambda topic: len(topic.messages))
+        return large
+
+    @staticmethod
+    def _closest(topic: Topic, candidates: List[Topic]) -> Topic:
+        """Самая похожая по словам тема; при равенстве - ближайшая по времени"""
+        tokens = set(topic.terms)
+        return max(candidates, key=lambda other: (other.similarity(tokens), -other.distance(topic)))
@@ -0,0 +1,91 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from config import TRACING_ENABLED, TRACE_SLOW_MS
+
+logger = logging.getLogger(__name__)
+
+# Не больше стольких дочерних участков у одного участка - длинные пакеты не раздувают лог
+MAX_CHILDREN = 50
+
+class Span:
+    """Участок трассировки: имя, длительность, атрибуты и вложенные участки"""
+
+    __slots__ = ('name', 'attrs', 'started', 'duration', 'children', 'dropped')
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.children: List["Span"] = []
+        self.dropped = 0
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.started + self.duration if self.duration is not None else time.perf_counter()
+        return (end - self.started) * 1000
+
+    def add(self, child: "Span"):
+        if len(self.children) < MAX_CHILDREN:
+            self.children.append(child)
+        else:
+            self.dropped += 1
+
+    def render(self, depth: int = 0) -> List[str]:
+        attrs = " ".join(f"{key}={value}" for key, value in self.attrs.items())
+        lines = [f"{'  ' * depth}{self.name} {self.duration_ms:.1f} мс {attrs}".rstrip()]
+        for child in self.children:
+            lines.extend(child.render(depth + 1))
+        if self.dropped:
+            lines.append(f"{'  ' * (depth + 1)}... ещё {self.dropped} участков")
+        return lines
+
+_current: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    """Вложенный участок текущей трассировки; вне трассировки ничего не делает"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attrs)
+    parent.add(child)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.duration = time.perf_counter() - child.started
+        _current.reset(token)
+
+@contextmanager
+def trace(name: str, slow_ms: float = TRACE_SLOW_MS, **attrs) -> Iterator[Optional[Span]]:
+    """Корневой участок: если он длился дольше slow_ms, дерево участков пишется в лог"""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    root = Span(name, attrs)
+    token = _current.set(root)
+    try:
+        yield root
+    finally:
+        root.duration = time.perf_counter() - root.started
+        _current.reset(token)
+        if root.duration_ms >= slow_ms:
+            logger.warning("Медленная обработка:\n" + "\n".join(root.render()))
+
+class TracingMiddleware(BaseMiddleware):
+    """Трассировка каждого обновления, дошедшего до обработчика роутера"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        user = getattr(event, 'from_user', None)
+        with trace(f"update:{name}", user_id=getattr(user, 'id', None)):
+            return await handler(event, data)
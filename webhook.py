@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """Приём обновлений через webhook с ограничением параллельной обработки.
+
+    Telegram получает ответ сразу, а обновление обрабатывается в фоне.
+    Когда одновременно обрабатывается max_concurrency обновлений, новый
+    запрос ждёт свободного места до ответа Telegram - так нагрузка
+    упирается в лимит max_connections самого Telegram, а не в память.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrency: int,
+                 secret_token: Optional[str] = None, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True,
+                         secret_token=secret_token, **data)
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self.semaphore.acquire()
+        task = asyncio.create_task(self._process(bot, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _process(self, bot: Bot, update: Dict[str, Any]):
+        try:
+            await self._background_feed_update(bot=bot, update=update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления из webhook: {e}")
+        finally:
+            self.semaphore.release()
+
+    async def close(self):
+        """Дожидаемся обновлений в обработке и закрываем сессию бота"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await super().close()
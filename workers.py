@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import Update
+from config import BOT_TOKEN, OUTBOUND_GLOBAL_RATE, WORKER_QUEUE_SIZE
+from fsm import create_storage
+from llm import close_llm_service
+from outbound import OutboundSender
+from sharding import shard_for, update_shard_key
+
+logger = logging.getLogger(__name__)
+
+# Столько секунд исполнитель дорабатывает очередь при остановке, затем завершается принудительно
+STOP_TIMEOUT = 30
+
+class WorkerPool(BaseMiddleware):
+    """Процессы-исполнители и распределение обновлений между ними.
+
+    Подключается внешним middleware к dp.update основного процесса: вместо
+    обработки обновление передаётся через очередь исполнителю
+    shard_for(chat_id), поэтому все обновления одного чата обрабатывает
+    один процесс в порядке прихода. Если очередь исполнителя заполнена,
+    приём обновлений ждёт. Упавший исполнитель перезапускается при
+    следующем обновлении для него.
+    """
+
+    def __init__(self, workers: int, queue_size: int = WORKER_QUEUE_SIZE):
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self._processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * workers
+        self.forwarded = 0
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def _spawn(self, index: int):
+        process = self._context.Process(target=run_worker, args=(index, self.workers, self._queues[index]),
+                                        name=f"bot-worker-{index}")
+        process.start()
+        self._processes[index] = process
+        logger.info(f"Запущен исполнитель {index} (pid {process.pid})")
+
+    async def __call__(self, handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        key = update_shard_key(event)
+        index = shard_for(key if key is not None else event.update_id, self.workers)
+        process = self._processes[index]
+        if process is None or not process.is_alive():
+            logger.error(f"Исполнитель {index} не работает, перезапуск")
+            self._spawn(index)
+        payload = event.model_dump(mode="json", by_alias=True, exclude_none=True)
+        updates = self._queues[index]
+        try:
+            updates.put_nowait(payload)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, updates.put, payload)
+        self.forwarded += 1
+
+    async def stop(self):
+        """Остановка исполнителей после обработки уже переданных им обновлений"""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(None, self._stop_worker, index)
+                               for index in range(self.workers)])
+
+    def _stop_worker(self, index: int):
+        process = self._processes[index]
+        if process is None:
+            return
+        if process.is_alive():
+            try:
+                self._queues[index].put(None, timeout=STOP_TIMEOUT)
+                process.join(STOP_TIMEOUT)
+            except queue.Full:
+                pass
+        if process.is_alive():
+            logger.warning(f"Исполнитель {index} не остановился за {STOP_TIMEOUT} с, завершаю принудительно")
+            process.terminate()
+            process.join()
+        self._processes[index] = None
+
+def bypass_hot_buffer(hot_buffer):
+    """Чтение мимо буфера последних сообщений в основном процессе.
+
+    При нескольких исполнителях сообщения записывают только они: буфер
+    основного процесса не получает записанных пакетов и после первого
+    прогрева отдавал бы устаревший снимок (например, планировщику дайджестов).
+    """
+    hot_buffer.owns = lambda chat_id: False
+
+def run_worker(index: int, workers: int, updates: multiprocessing.Queue):
+    """Точка входа процесса-исполнителя"""
+    # Ctrl+C получает вся группа процессов: исполнителей останавливает основной процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve(index, workers, updates))
+
+async def serve(index: int, workers: int, updates: multiprocessing.Queue):
+    """Обработка обновлений своих чатов: приём сообщений, команды и очередь пересказов"""
+    # Сервисы создаются при импорте обработчиков, поэтому импорт - только в процессе-исполнителе
+    from handlers import router, ingestor, summarizer, job_queue, hot_buffer, db
+
+    def owns(chat_id: int) -> bool:
+        return shard_for(chat_id, workers) == index
+
+    hot_buffer.owns = owns
+    bot = Bot(token=BOT_TOKEN)
+    # Общий лимит отправки Telegram делится между исполнителями
+    bot.session.middleware(OutboundSender(global_rate=OUTBOUND_GLOBAL_RATE / workers))
+    dp = Dispatcher(storage=create_storage(db))
+    dp.include_router(router)
+    try:
+        await ingestor.start()
+        await summarizer.start(owns=owns)
+        await job_queue.start(bot, owns=owns)
+        logger.info(f"Исполнитель {index} из {workers} готов")
+        handled = await consume(dp, bot, updates)
+        logger.info(f"Исполнитель {index} остановлен, обработано обновлений: {handled}")
+    finally:
+        await job_queue.stop()
+        await ingestor.stop()
+        await summarizer.stop()
+        await close_llm_service()
+        await bot.session.close()
+        db.close()
+
+async def consume(dp: Dispatcher, bot: Bot, updates: multiprocessing.Queue) -> int:
+    """Обработка обновлений из очереди до None; возвращает число обработанных"""
+    loop = asyncio.get_running_loop()
+    tasks: Set[asyncio.Task] = set()
+    handled = 0
+    while True:
+        payload = await loop.run_in_executor(None, updates.get)
+        if payload is None:
+            break
+        # Как при long polling: каждое обновление - отдельная задача
+        task = asyncio.create_task(_feed(dp, bot, payload))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        handled += 1
+    await asyncio.gather(*tasks)
+    return handled
+
+async def _feed(dp: Dispatcher, bot: Bot, payload: Dict[str, Any]):
+    try:
+        await dp.feed_raw_update(bot, payload)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке обновления {payload.get('update_id')}: {e}")